@@ -0,0 +1,317 @@
+# Census Folium ACS:
+# An asynchronous client for downloading American Community Survey (ACS)
+# data from the Census API in bulk.
+# Released under the MIT license
+
+# The .csv files within census_data/ were created by querying the Census
+# API separately from this project. This client instead downloads many
+# variables, geographies, and years at once and returns DataFrames whose
+# columns match those files (NAME, Year, state, county, etc.), so that
+# they can be saved via to_csv() and passed to prepare_state_table,
+# prepare_county_table, or prepare_zip_table.
+
+# Requests are made concurrently over a small pool of reused (keep-alive)
+# connections, limited to a set number of requests per second, and retried
+# with exponential backoff when the API is busy or unavailable. Each
+# response is saved to an on-disk cache, so re-running a notebook doesn't
+# repeat queries that have already succeeded.
+
+# Only the standard library is used for networking: each request is made on
+# a worker thread (via asyncio.to_thread) using one of the pool's
+# http.client connections.
+
+# The base URL can be changed (e.g. to http://127.0.0.1:<port>) in order to
+# test the client against a local stub server that mimics the Census API.
+
+# Example usage:
+# client = CensusClient(api_key = 'your key')
+# county_pop = client.fetch_all([{'year': year, 'variables':
+# {'B01003_001E': 'Total_population'}, 'geography': 'county'}
+# for year in [2011, 2016, 2021]])
+# county_pop[0].to_csv('census_data/acs5_2011_county_pop.csv', index = False)
+
+import asyncio
+import hashlib
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+
+import pandas as pd
+
+# The 'for' and 'in' clauses for each supported geography. (Tracts and
+# block groups must be requested one state at a time, e.g. with
+# within = 'state:06 county:*'.)
+GEOGRAPHIES = {
+    'state': ('state:*', None),
+    'county': ('county:*', 'state:*'),
+    'zip': ('zip code tabulation area:*', None),
+    'tract': ('tract:*', None),
+    'block group': ('block group:*', None)
+}
+
+# The geographies for which the API rejects queries without an 'in' clause.
+GEOGRAPHIES_REQUIRING_WITHIN = {'tract', 'block group'}
+
+# The Census API accepts up to 50 variables per request (including NAME).
+MAX_VARIABLES_PER_REQUEST = 49
+
+# Responses with these status codes are retried.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class _ConnectionPool:
+    '''A thread-safe pool of persistent HTTP(S) connections to one host.
+    Connections are created as needed and reused until the server closes
+    them.'''
+
+    def __init__(self, base_url, size, timeout):
+        parsed_url = urllib.parse.urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if \
+            parsed_url.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parsed_url.netloc
+        self.base_path = parsed_url.path.rstrip('/')
+        self.timeout = timeout
+        self.connections = queue.LifoQueue()
+        for i in range(size):
+            self.connections.put(None)
+        self.opened = 0
+
+    def get(self, path):
+        '''Makes a GET request and returns its status and body.'''
+        connection = self.connections.get()
+        try:
+            if connection is None:
+                connection = self.connection_class(self.netloc,
+                timeout = self.timeout)
+                self.opened += 1
+            connection.request('GET', self.base_path + path,
+            headers = {'User-Agent': 'census_folium_tutorial ACS client'})
+            response = connection.getresponse()
+            body = response.read()
+            if response.will_close:
+                connection.close()
+                connection = None
+            return response.status, body
+        except (http.client.HTTPException, OSError):
+            if connection is not None:
+                connection.close()
+            connection = None
+            raise
+        finally:
+            self.connections.put(connection)
+
+
+class CensusClient:
+    '''Downloads ACS data from the Census API.
+
+    api_key: Your Census API key (available at
+    https://api.census.gov/data/key_signup.html). Keys aren't required for
+    small numbers of requests. The key isn't included within cache keys.
+
+    base_url: The API's base URL. Change this to test the client against a
+    local stub server.
+
+    cache_folder: The folder in which responses are cached, or None to
+    disable the cache. cache_max_age (in seconds) can be set to ignore
+    cached responses older than that age.
+
+    max_connections: The number of requests that can be in progress at
+    once (and the number of connections that are kept open).
+
+    requests_per_second: The maximum rate at which requests are started.
+
+    retries: The number of additional attempts made for each request that
+    fails due to a network error or a busy/unavailable API, waiting
+    backoff_seconds, then twice as long, and so on between attempts.'''
+
+    def __init__(self, api_key = None,
+    base_url = 'https://api.census.gov/data',
+    cache_folder = 'census_api_cache', cache_max_age = None,
+    max_connections = 8, requests_per_second = 10, retries = 3,
+    backoff_seconds = 1, timeout = 60):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache_folder = cache_folder
+        self.cache_max_age = cache_max_age
+        self.max_connections = max_connections
+        self.requests_per_second = requests_per_second
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.pool = _ConnectionPool(base_url, max_connections, timeout)
+        self.stats = {'requests': 0, 'cache_hits': 0, 'retries': 0}
+        self.stats_lock = threading.Lock()
+        # The semaphore and rate limiting state are created for each event
+        # loop, since asyncio objects can't be shared between loops (e.g.
+        # between two calls to fetch_all).
+        self._loop = None
+
+    def _prepare_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+            self._rate_lock = asyncio.Lock()
+            self._next_request_time = 0
+
+    async def _wait_for_rate_limit(self):
+        async with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) + \
+                1 / self.requests_per_second
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _cache_path(self, path):
+        return os.path.join(self.cache_folder, hashlib.sha256(
+            path.encode()).hexdigest()+'.json')
+
+    def _read_cache(self, path):
+        if self.cache_folder is None:
+            return None
+        cache_path = self._cache_path(path)
+        if not os.path.exists(cache_path) or (self.cache_max_age is not None
+        and time.time() - os.path.getmtime(cache_path) > self.cache_max_age):
+            return None
+        with open(cache_path, 'rb') as file:
+            return file.read()
+
+    def _write_cache(self, path, body):
+        if self.cache_folder is None:
+            return
+        os.makedirs(self.cache_folder, exist_ok = True)
+        cache_path = self._cache_path(path)
+        temp_path = cache_path+'.'+str(threading.get_ident())+'.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(body)
+        os.replace(temp_path, cache_path)
+
+    async def _get(self, path):
+        '''Returns the response body for path (from the cache if possible).
+        Returns None if the API has no data for the query.'''
+        body = self._read_cache(path)
+        if body is not None:
+            with self.stats_lock:
+                self.stats['cache_hits'] += 1
+            return body
+        request_path = path
+        if self.api_key is not None:
+            request_path += '&key='+urllib.parse.quote(self.api_key)
+        for attempt in range(self.retries + 1):
+            await self._wait_for_rate_limit()
+            async with self._semaphore:
+                with self.stats_lock:
+                    self.stats['requests'] += 1
+                try:
+                    status, body = await asyncio.to_thread(self.pool.get,
+                    request_path)
+                except (http.client.HTTPException, OSError):
+                    if attempt == self.retries:
+                        raise
+                    status = None
+            if status == 200:
+                self._write_cache(path, body)
+                return body
+            if status == 204:
+                # The API returns 204 when a query matches no data.
+                return None
+            if status is not None and status not in RETRY_STATUSES:
+                raise ValueError('Error: the Census API returned status '+
+                str(status)+' for '+path+': '+body.decode(errors = 'replace'))
+            if attempt == self.retries:
+                raise OSError('Error: the Census API returned status '+
+                str(status)+' for '+path+' after '+str(attempt + 1)+
+                ' attempts.')
+            with self.stats_lock:
+                self.stats['retries'] += 1
+            await asyncio.sleep(self.backoff_seconds * 2 ** attempt)
+
+    async def fetch(self, year, variables, geography, dataset = 'acs5',
+    within = None):
+        '''Downloads one or more variables for every area within a
+        geography and returns them as a DataFrame.
+
+        year: The ACS year (e.g. 2021).
+
+        variables: A list of ACS variable codes (e.g. ['B01003_001E']) or a
+        dictionary that maps codes to column names (e.g. {'B01003_001E':
+        'Total_population'}). Requests for more than 49 variables are split
+        into several requests and merged.
+
+        geography: 'state', 'county', 'zip', 'tract', or 'block group'.
+
+        dataset: The ACS dataset, e.g. 'acs5' or 'acs1'.
+
+        within: An optional 'in' clause (e.g. 'state:06' or
+        'state:06 county:*'), which overrides the default for the geography.
+        This clause is required for tracts and block groups.
+
+        The DataFrame contains NAME, Year, the geography code columns
+        (e.g. state and county) as integers, and the variables as numbers.
+        For zip codes, NAME contains the zip code itself (matching the zip
+        .csv files within census_data/).'''
+        self._prepare_loop()
+        if not isinstance(variables, dict):
+            variables = {variable: variable for variable in variables}
+        codes = list(variables)
+        for_clause, in_clause = GEOGRAPHIES[geography]
+        if within is not None:
+            in_clause = within
+        elif geography in GEOGRAPHIES_REQUIRING_WITHIN:
+            raise ValueError('Error: '+geography+' data must be requested \
+one state at a time by passing within (e.g. within = \'state:06 county:*\').')
+        chunks = [codes[i:i + MAX_VARIABLES_PER_REQUEST]
+        for i in range(0, len(codes), MAX_VARIABLES_PER_REQUEST)]
+        paths = []
+        for chunk in chunks:
+            query = {'get': ','.join(['NAME'] + chunk), 'for': for_clause}
+            if in_clause is not None:
+                query['in'] = in_clause
+            paths.append('/'+str(year)+'/acs/'+dataset+'?'+
+            urllib.parse.urlencode(query, safe = ':*,'))
+        bodies = await asyncio.gather(*[self._get(path) for path in paths])
+
+        tables = []
+        for body in bodies:
+            if body is None:
+                continue
+            rows = json.loads(body)
+            tables.append(pd.DataFrame(rows[1:], columns = rows[0]))
+        if len(tables) == 0:
+            return pd.DataFrame(columns = ['NAME', 'Year'] +
+            list(variables.values()))
+        # The requests for each chunk of variables all return the same
+        # areas, so they're merged on the geography columns.
+        geography_columns = [column for column in tables[0].columns
+        if column not in codes and column != 'NAME']
+        table = tables[0]
+        for other_table in tables[1:]:
+            table = table.merge(other_table.drop(columns = 'NAME'),
+            on = geography_columns, how = 'outer')
+
+        for code in codes:
+            table[code] = pd.to_numeric(table[code], errors = 'coerce')
+        if geography == 'zip':
+            table['NAME'] = table['zip code tabulation area']
+        for column in geography_columns:
+            if column != 'zip code tabulation area':
+                table[column] = table[column].astype(int)
+        table.insert(1, 'Year', year)
+        table = table[['NAME', 'Year'] + geography_columns + codes]
+        return table.rename(columns = variables)
+
+    async def fetch_many(self, queries):
+        '''Runs several fetch queries (each a dictionary of fetch arguments)
+        concurrently and returns their DataFrames in the same order.'''
+        return await asyncio.gather(*[self.fetch(**query)
+        for query in queries])
+
+    def fetch_all(self, queries):
+        '''A synchronous version of fetch_many for use within scripts.
+        (Within Jupyter, which already runs an event loop, use
+        await client.fetch_many(queries) instead.)'''
+        return asyncio.run(self.fetch_many(queries))
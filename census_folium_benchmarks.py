@@ -0,0 +1,936 @@
+# Census Folium Benchmarks:
+# A reproducible benchmark suite for the census_folium_viewer mapping
+# pipeline (prepare_state_table, prepare_county_table, prepare_zip_table,
+# generate_map, and create_vertical_legend).
+# Released under the MIT license
+
+# The benchmarks run on synthetic geographies that are generated locally,
+# so no TIGER shapefiles need to be downloaded. Each benchmark case runs
+# within a fresh process so that its peak memory usage (RSS) isn't affected
+# by the cases that ran before it.
+
+# Example usage (run from the project's root folder):
+# python census_folium_benchmarks.py
+# python census_folium_benchmarks.py --zip-count 5000 --repeat 5
+# python census_folium_benchmarks.py --compare benchmark_results/a.json
+# benchmark_results/b.json
+# python census_folium_benchmarks.py --generate block_group 240000
+# synthetic_block_groups
+# (The last command writes synthetic_block_groups.gpkg and
+# synthetic_block_groups.csv for load testing, one chunk at a time.)
+# python census_folium_benchmarks.py --compare-renderers zip 33000
+# (This command compares Leaflet's SVG and canvas renderers in headless
+# Chrome; see compare_renderers.)
+# python census_folium_benchmarks.py --compare-handoff zip 33000 4
+# (This command compares sending a prepared table to worker processes via
+# pickling and via shared memory; see compare_table_handoff.)
+# python census_folium_benchmarks.py --import-time
+# (This command reports how long census_folium_viewer takes to import, 
+# along with its slowest imports. This time is also included within the
+# results of each full benchmark run.)
+# python census_folium_benchmarks.py --compare-formats
+# state_and_census_table.geojson county_and_census_table.geojson
+# (This command compares the write time, read time, and file size of
+# GeoJSON and GeoParquet tables; see compare_table_formats. If no paths
+# are given, a synthetic zip table is used.)
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import queue
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas
+import shapely
+
+import census_folium_viewer
+
+# The approximate bounds of the continental US, which the synthetic shapes
+# will cover.
+US_BOUNDS = (-125, 25, -67, 49)
+
+# The default number of vertices per polygon for each geography. These are
+# roughly in line with the unsimplified TIGER shapefiles, in which larger
+# shapes tend to have more detailed boundaries.
+DEFAULT_VERTICES_PER_POLYGON = {'state': 2000, 'county': 400, 'zip': 240,
+'tract': 160, 'block_group': 100, 'block': 40}
+
+# The .csv files whose columns will be used for the synthetic Census data.
+# (No zip-, tract-, or block-level results tables are stored within
+# census_data, so the county schema is used for these geographies.)
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+'census_data')
+DEFAULT_SCHEMA_PATHS = {
+'state': os.path.join(DATA_FOLDER, 'acs5_2021_state_results.csv'),
+'county': os.path.join(DATA_FOLDER, 'acs5_2021_county_results.csv')}
+
+# The number of child geographies per parent geography when creating
+# synthetic codes (e.g. 60 counties per state and 25 tracts per county).
+CHILDREN_PER_PARENT = {'county': 60, 'tract': 25, 'block_group': 3,
+'block': 25}
+
+
+def _synthetic_codes(indices, geography):
+    '''Creates TIGER-style shapefile columns (STATEFP, COUNTYFP, etc.)
+    and Census API-style data columns (state, county, etc.) for the
+    polygons with the specified indices.'''
+    if geography == 'zip':
+        zip_codes = pd.Series(indices).astype(str).str.zfill(5).to_numpy()
+        return {'ZCTA5CE20': zip_codes, 'GEOID20': zip_codes}, {
+            'NAME': zip_codes, 'state': (indices % 56 + 1)}
+    shape_codes = {}
+    data_codes = {}
+    levels = ['state', 'county', 'tract', 'block_group', 'block']
+    parent_indices = indices
+    # The codes are created from the finest level upwards; each level's
+    # index is divided by CHILDREN_PER_PARENT to find its parent's index.
+    for level in reversed(levels[:levels.index(geography) + 1]):
+        if level == 'state':
+            codes = pd.Series(parent_indices + 1).astype(str).str.zfill(2)
+            shape_codes['STATEFP'] = codes.to_numpy()
+            data_codes['state'] = parent_indices + 1
+            continue
+        children = CHILDREN_PER_PARENT[level]
+        positions = parent_indices % children
+        parent_indices = parent_indices // children
+        if level == 'county':
+            shape_codes['COUNTYFP'] = pd.Series(positions * 2 + 1).astype(
+                str).str.zfill(3).to_numpy()
+            data_codes['county'] = positions * 2 + 1
+        elif level == 'tract':
+            shape_codes['TRACTCE'] = pd.Series((positions + 1) * 100).astype(
+                str).str.zfill(6).to_numpy()
+            data_codes['tract'] = shape_codes['TRACTCE']
+        elif level == 'block_group':
+            shape_codes['BLKGRPCE'] = (positions + 1).astype(str)
+            data_codes['block group'] = shape_codes['BLKGRPCE']
+        elif level == 'block':
+            shape_codes['BLOCKCE20'] = pd.Series(positions + 1000).astype(
+                str).str.zfill(4).to_numpy()
+            data_codes['block'] = shape_codes['BLOCKCE20']
+    geoid_columns = [column for column in ['STATEFP', 'COUNTYFP', 'TRACTCE',
+    'BLKGRPCE', 'BLOCKCE20'] if column in shape_codes]
+    geoids = pd.Series(shape_codes[geoid_columns[0]])
+    for column in geoid_columns[1:]:
+        geoids = geoids + shape_codes[column]
+    shape_codes = {'GEOID': geoids.to_numpy(), **shape_codes}
+    if geography == 'state':
+        names = 'Synthetic State ' + geoids
+        shape_codes['NAME'] = names.to_numpy()
+    elif geography == 'county':
+        shape_codes['NAME'] = ('County ' + geoids).to_numpy()
+        names = 'County ' + geoids + ', Synthetic State ' + \
+            pd.Series(shape_codes['STATEFP'])
+    else:
+        names = geography.replace('_', ' ').title() + ' ' + geoids
+    return shape_codes, {'NAME': names.to_numpy(), **data_codes}
+
+
+def _lattice_jitter(seed, stream, row, size):
+    '''Returns uniform random values in [-1, 1) for one row of the lattice.
+    Each row has its own random stream (derived from the seed), which keeps
+    the output identical no matter how the grid is split into chunks.'''
+    return np.random.default_rng([seed, stream, row]).uniform(-1, 1, size)
+
+
+def _lattice_draw(seed, stream, first_row, last_row, columns, count, draw):
+    '''Draws one random value per polygon for lattice rows first_row 
+    through last_row - 1 and returns the first count of them. draw is a
+    function that takes a random generator and a size. As with
+    _lattice_jitter, each row's values come from that row's own random
+    stream, so they don't depend on how the rows are split into chunks.'''
+    return np.concatenate([draw(np.random.default_rng([seed, stream, row]),
+    columns) for row in range(first_row, last_row)])[:count]
+
+
+def _tessellate_rows(first_row, last_row, columns, rows, seed, edge_points):
+    '''Creates the polygons for cell rows first_row through last_row - 1 of
+    a rows x columns tessellation of the continental US. Neighboring polygons
+    share their corners and edges, so there are no gaps or overlaps.'''
+    min_x, min_y, max_x, max_y = US_BOUNDS
+    width = (max_x - min_x) / columns
+    height = (max_y - min_y) / rows
+    row_count = last_row - first_row
+
+    # Corners are jittered by up to 20% of the cell size (except along the
+    # outer boundary of the grid).
+    corners = np.empty((row_count + 1, columns + 1, 2))
+    for i, row in enumerate(range(first_row, last_row + 1)):
+        jitter = _lattice_jitter(seed, 0, row, (columns + 1, 2)) * 0.2
+        jitter[[0, -1], 0] = 0
+        if row in [0, rows]:
+            jitter[:, 1] = 0
+        corners[i, :, 0] = min_x + (np.arange(columns + 1) + jitter[:, 0]
+        ) * width
+        corners[i, :, 1] = min_y + (row + jitter[:, 1]) * height
+
+    # The points in between each pair of corners are offset perpendicular
+    # to the edge (by up to 15% of the cell size). The offset tapers to 0 at
+    # each corner so that edges meeting at a corner don't cross.
+    t = np.arange(1, edge_points + 1) / (edge_points + 1)
+    taper = np.sin(np.pi * t)
+    horizontal = np.empty((row_count + 1, columns, edge_points, 2))
+    for i, row in enumerate(range(first_row, last_row + 1)):
+        start = corners[i, :-1, None, :]
+        end = corners[i, 1:, None, :]
+        horizontal[i] = start + (end - start) * t[None, :, None]
+        if row not in [0, rows]:
+            horizontal[i, :, :, 1] += _lattice_jitter(seed, 1, row,
+            (columns, edge_points)) * taper * 0.15 * height
+    vertical = np.empty((row_count, columns + 1, edge_points, 2))
+    for i, row in enumerate(range(first_row, last_row)):
+        start = corners[i, :, None, :]
+        end = corners[i + 1, :, None, :]
+        vertical[i] = start + (end - start) * t[None, :, None]
+        jitter = _lattice_jitter(seed, 2, row, (columns + 1, edge_points)
+        ) * taper * 0.15 * width
+        jitter[[0, -1]] = 0
+        vertical[i, :, :, 0] += jitter
+
+    # Each ring runs counterclockwise: along the bottom edge, up the right
+    # edge, back along the top edge, and down the left edge.
+    rings = np.concatenate([
+        corners[:-1, :-1, None, :], horizontal[:-1],
+        corners[:-1, 1:, None, :], vertical[:, 1:],
+        corners[1:, 1:, None, :], horizontal[1:, :, ::-1],
+        corners[1:, :-1, None, :], vertical[:, :-1, ::-1],
+        corners[:-1, :-1, None, :]], axis = 2)
+    return shapely.polygons(rings.reshape(row_count * columns, -1, 2))
+
+
+def generate_synthetic_geography_chunks(polygon_count, geography, seed = 0,
+vertices_per_polygon = None, schema_path = None, chunk_size = 100000):
+    '''Generates a tessellation of polygon_count polygons covering the
+    continental US, along with matching synthetic Census data, in chunks of
+    roughly chunk_size polygons. This allows very large layers (such as
+    the ~240,000 block groups or millions of blocks in the US) to be
+    created without holding the entire layer in memory.
+
+    geography: 'state', 'county', 'zip', 'tract', 'block_group', or 'block'.
+    This determines the shapefile and data columns that are created (e.g.
+    STATEFP/COUNTYFP/GEOID and state/county for counties) along with the
+    default number of vertices per polygon.
+
+    seed: The random seed. The same seed always produces the same output,
+    regardless of chunk_size.
+
+    vertices_per_polygon: The approximate number of vertices in each
+    polygon. See DEFAULT_VERTICES_PER_POLYGON for the defaults.
+
+    schema_path: A .csv file within census_data whose columns the synthetic
+    data should match. The synthetic data is created by sampling entire rows
+    (with replacement) from this file, which keeps the values and the
+    relationships between columns realistic. If the file isn't available,
+    a few basic columns are created instead.
+
+    Yields (shape_table, data_table) tuples.'''
+    if vertices_per_polygon is None:
+        vertices_per_polygon = DEFAULT_VERTICES_PER_POLYGON[geography]
+    if schema_path is None:
+        schema_path = DEFAULT_SCHEMA_PATHS.get(geography,
+        DEFAULT_SCHEMA_PATHS['county'])
+    schema_table = None
+    if os.path.exists(schema_path):
+        schema_table = pd.read_csv(schema_path)
+        schema_table = schema_table.drop(columns = [column for column in
+        schema_table.columns if column in ['NAME', 'state', 'county']
+        or column.startswith('Unnamed')])
+
+    edge_points = max(1, vertices_per_polygon // 4 - 1)
+    min_x, min_y, max_x, max_y = US_BOUNDS
+    aspect = (max_x - min_x) / (max_y - min_y)
+    columns = int(np.ceil(np.sqrt(polygon_count * aspect)))
+    rows = int(np.ceil(polygon_count / columns))
+    rows_per_chunk = max(1, chunk_size // columns)
+
+    for first_row in range(0, rows, rows_per_chunk):
+        last_row = min(rows, first_row + rows_per_chunk)
+        geometry = _tessellate_rows(first_row, last_row, columns, rows, seed,
+        edge_points)
+        indices = np.arange(first_row * columns, last_row * columns)
+        # The final row of the grid may be only partially filled.
+        geometry = geometry[indices < polygon_count]
+        indices = indices[indices < polygon_count]
+        shape_codes, data_codes = _synthetic_codes(indices, geography)
+        shape_table = geopandas.GeoDataFrame(shape_codes,
+        geometry = geometry, crs = 'EPSG:4269')
+
+        if schema_table is not None:
+            data_table = schema_table.iloc[_lattice_draw(seed, 3, 
+            first_row, last_row, columns, len(indices), 
+            lambda rng, size: rng.integers(0, len(schema_table), size))
+            ].reset_index(drop = True)
+        else:
+            data_table = pd.DataFrame({
+            'Total_population': _lattice_draw(seed, 3, first_row,
+            last_row, columns, len(indices), lambda rng, size: rng.integers(
+                1000, 100000, size)),
+            'Median_household_income': _lattice_draw(seed, 4, first_row,
+            last_row, columns, len(indices), lambda rng, size: rng.normal(
+                65000, 15000, size)).round(),
+            'Median House Value': _lattice_draw(seed, 5, first_row, 
+            last_row, columns, len(indices), lambda rng, size: rng.normal(
+                250000, 80000, size)).round()})
+        data_table = pd.concat([pd.DataFrame(data_codes), data_table],
+        axis = 1)
+        yield shape_table, data_table
+
+
+def make_synthetic_geography(polygon_count, geography, seed = 0,
+vertices_per_polygon = None, schema_path = None):
+    '''Creates an entire synthetic geography in memory. See
+    generate_synthetic_geography_chunks for details.
+
+    Returns a (shape_table, data_table) tuple.'''
+    chunks = list(generate_synthetic_geography_chunks(polygon_count,
+    geography, seed = seed, vertices_per_polygon = vertices_per_polygon,
+    schema_path = schema_path))
+    shape_table = pd.concat([chunk[0] for chunk in chunks],
+    ignore_index = True)
+    data_table = pd.concat([chunk[1] for chunk in chunks],
+    ignore_index = True)
+    return shape_table, data_table
+
+
+def write_synthetic_geography(shape_path, data_path, polygon_count,
+geography, seed = 0, vertices_per_polygon = None, schema_path = None,
+chunk_size = 100000):
+    '''Streams a synthetic geography to disk one chunk at a time. The shapes
+    are appended to a GeoPackage (.gpkg) file at shape_path, which can be
+    read by geopandas.read_file (and therefore by the prepare_*_table
+    functions), and the synthetic data is appended to a .csv file at
+    data_path. Peak memory usage depends on chunk_size rather than on
+    polygon_count.
+
+    Returns the number of polygons written.'''
+    for path in [shape_path, data_path]:
+        if os.path.exists(path):
+            os.remove(path)
+    polygons_written = 0
+    for shape_table, data_table in generate_synthetic_geography_chunks(
+        polygon_count, geography, seed = seed,
+        vertices_per_polygon = vertices_per_polygon,
+        schema_path = schema_path, chunk_size = chunk_size):
+        shape_table.to_file(shape_path, driver = 'GPKG',
+        mode = 'w' if polygons_written == 0 else 'a')
+        data_table.to_csv(data_path, mode = 'w' if polygons_written == 0
+        else 'a', header = polygons_written == 0, index = False)
+        polygons_written += len(shape_table)
+        print(f"Wrote {polygons_written} of {polygon_count} polygons")
+    return polygons_written
+
+
+def _prepare(geography, shape_path, data_path):
+    '''Calls the prepare function for the specified geography using the
+    column names created by make_synthetic_geography.'''
+    if geography == 'state':
+        return census_folium_viewer.prepare_state_table(
+            shapefile_path = shape_path, shape_feature_name = 'NAME',
+            tolerance = 0.005, data_path = data_path,
+            data_feature_name = 'NAME')
+    elif geography == 'county':
+        return census_folium_viewer.prepare_county_table(
+            shapefile_path = shape_path, shape_state_code_column = 'STATEFP',
+            shape_county_code_column = 'COUNTYFP', tolerance = 0.005,
+            data_path = data_path, data_state_code_column = 'state',
+            data_county_code_column = 'county')
+    return census_folium_viewer.prepare_zip_table(
+        shapefile_path = shape_path, shape_feature_name = 'ZCTA5CE20',
+        tolerance = 0.005, data_path = data_path, data_feature_name = 'NAME')
+
+
+def _peak_rss_bytes():
+    try:
+        import resource
+    except ImportError: # The resource module isn't available on Windows.
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def _run_case(case, result_queue):
+    '''Runs a single benchmark case. This function is called within a
+    separate process; its results are returned through result_queue.'''
+    output_bytes = None
+    # The prepare functions print their progress, which would clutter
+    # the benchmark's output.
+    with contextlib.redirect_stdout(io.StringIO()):
+        if case['kind'] == 'prepare':
+            baseline_rss = _peak_rss_bytes()
+            start_time = time.perf_counter()
+            table = _prepare(case['geography'], case['shape_path'],
+            case['data_path'])
+            wall_seconds = time.perf_counter() - start_time
+        elif case['kind'] == 'generate_map':
+            with open(case['table_path'], 'rb') as file:
+                table = pickle.load(file)
+            baseline_rss = _peak_rss_bytes()
+            records = []
+            start_time = time.perf_counter()
+            census_folium_viewer.generate_map(merged_data_table = table,
+            shape_feature_name = case['shape_feature_name'],
+            data_variable = 'Median_household_income',
+            feature_text = case['geography'], map_name = case['name'],
+            html_save_path = case['output_path'],
+            variable_decimals = 0, fill_color = 'RdYlGn',
+            generate_image = False, stats_callback = records.append)
+            wall_seconds = time.perf_counter() - start_time
+            output_bytes = records[0]['output_bytes']
+        elif case['kind'] == 'legend':
+            baseline_rss = _peak_rss_bytes()
+            start_time = time.perf_counter()
+            census_folium_viewer.create_vertical_legend(
+                bins = list(np.linspace(0, 100000, 9)),
+                data_variable_text = 'Median Household Income',
+                map_name = case['name'], path_to_legends = case['output_path'],
+                color_list = ['#d73027', '#f46d43', '#fdae61', '#fee08b',
+                '#d9ef8b', '#a6d96a', '#66bd63', '#1a9850'],
+                variable_decimals = 0)
+            wall_seconds = time.perf_counter() - start_time
+            legend_path = case['output_path']+'\\'+case['name']+'_legend.svg'
+            output_bytes = os.path.getsize(legend_path)
+    peak_rss = _peak_rss_bytes()
+    result_queue.put({'wall_seconds': wall_seconds,
+    'peak_rss_bytes': peak_rss,
+    'rss_increase_bytes': None if peak_rss is None else
+    peak_rss - baseline_rss, 'output_bytes': output_bytes})
+
+
+def _run_in_fresh_process(case, timeout_seconds = 3600):
+    # The 'spawn' start method ensures that each case begins with a clean
+    # interpreter (rather than a copy of this process's memory).
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target = _run_case, args = (case, result_queue))
+    process.start()
+    # The queue is checked once per second so that a child that crashes
+    # (or is killed for running out of memory) without sending a result
+    # is noticed instead of blocking the benchmark forever.
+    start_time = time.perf_counter()
+    while True:
+        try:
+            result = result_queue.get(timeout = 1)
+            break
+        except queue.Empty:
+            if process.exitcode is not None:
+                # The child may have sent its result just before exiting.
+                try:
+                    result = result_queue.get(timeout = 1)
+                    break
+                except queue.Empty:
+                    raise RuntimeError('Error: the benchmark process for '+
+                    case['name']+' exited with status '+
+                    str(process.exitcode)+' without returning a result.')
+            if time.perf_counter() - start_time > timeout_seconds:
+                process.terminate()
+                process.join()
+                raise RuntimeError('Error: the benchmark process for '+
+                case['name']+' didn\'t finish within '+str(timeout_seconds)+
+                ' seconds.')
+    process.join()
+    return result
+
+
+def measure_import_time(module = 'census_folium_viewer', repeat = 5,
+top = 10):
+    '''Imports module within fresh interpreters via python -X importtime
+    (which reports how long each import takes) and returns a dictionary
+    containing the median total import time in seconds, the times from
+    each run, and the median times of the module's slowest direct imports.
+    Batch workers pay this cost each time they start, so it's tracked 
+    alongside the other benchmarks.'''
+    totals = []
+    import_times = {}
+    for i in range(repeat):
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+        'import '+module], capture_output = True, text = True, check = True,
+        cwd = os.path.dirname(os.path.abspath(__file__)))
+        for line in completed.stderr.splitlines():
+            # Each line reads 'import time: <self us> | <cumulative us> | 
+            # <name>', with the name indented by two spaces per level
+            # of nesting.
+            match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)',
+            line)
+            if match is None:
+                continue
+            seconds = int(match.group(1)) / 1000000
+            if match.group(3) == module and len(match.group(2)) == 0:
+                totals.append(seconds)
+            elif len(match.group(2)) == 2:
+                import_times.setdefault(match.group(3), []).append(seconds)
+    slowest_imports = sorted([(name, statistics.median(times)) for 
+    name, times in import_times.items()], key = lambda item: -item[1])[:top]
+    return {'module': module, 'median_seconds': statistics.median(totals),
+    'wall_seconds': totals, 'slowest_imports': dict(slowest_imports)}
+
+
+def _current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+        capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(polygon_counts, repeat = 3, seed = 0,
+results_folder = 'benchmark_results'):
+    '''Runs every benchmark case and saves the results to a .json file
+    within results_folder (named after the current time and git commit).
+
+    polygon_counts: A dictionary mapping each geography ('state', 'county',
+    and/or 'zip') to the number of synthetic polygons to create for it.
+
+    repeat: The number of times to run each case. The median wall time and
+    the maximum peak RSS across these runs are reported.
+
+    Returns the path to the results file.'''
+    results = []
+    with tempfile.TemporaryDirectory() as temp_folder:
+        for folder in ['maps', 'legends']:
+            os.makedirs(os.path.join(temp_folder, folder))
+        cases = []
+        for geography, polygon_count in polygon_counts.items():
+            shape_path = os.path.join(temp_folder, geography+'_shapes.gpkg')
+            data_path = os.path.join(temp_folder, geography+'_data.csv')
+            with contextlib.redirect_stdout(io.StringIO()):
+                write_synthetic_geography(shape_path, data_path,
+                polygon_count, geography, seed = seed)
+            # The prepared table is pickled so that the generate_map case
+            # can load it quickly without re-running the prepare function.
+            table_path = os.path.join(temp_folder, geography+'_table.pkl')
+            with contextlib.redirect_stdout(io.StringIO()):
+                prepared_table = _prepare(geography, shape_path, data_path)
+            with open(table_path, 'wb') as file:
+                pickle.dump(prepared_table, file)
+            cases.append({'name': 'prepare_'+geography+'_table',
+            'kind': 'prepare', 'geography': geography,
+            'polygons': polygon_count, 'shape_path': shape_path,
+            'data_path': data_path})
+            cases.append({'name': 'generate_map_'+geography,
+            'kind': 'generate_map', 'geography': geography,
+            'polygons': polygon_count, 'table_path': table_path,
+            # (The county prepare function renames the shapefile's NAME
+            # column, so NAME refers to the data table's column.)
+            'shape_feature_name': {'state': 'NAME', 'county': 'NAME',
+            'zip': 'ZCTA5CE20'}[geography],
+            'output_path': os.path.join(temp_folder, 'maps')})
+        cases.append({'name': 'create_vertical_legend', 'kind': 'legend',
+        'geography': None, 'polygons': None,
+        'output_path': os.path.join(temp_folder, 'legends')})
+
+        import_time = measure_import_time(repeat = max(repeat, 5))
+        results.append({'case': 'import_census_folium_viewer', 
+        'polygons': None, 'repeat': len(import_time['wall_seconds']),
+        'wall_seconds': import_time['wall_seconds'],
+        'median_seconds': import_time['median_seconds'],
+        'peak_rss_bytes': None, 'rss_increase_bytes': None,
+        'output_bytes': None, 
+        'slowest_imports': import_time['slowest_imports']})
+        print(f"import_census_folium_viewer: \
+{import_time['median_seconds']:.3f} s median")
+
+        for case in cases:
+            runs = [_run_in_fresh_process(case) for i in range(repeat)]
+            wall_seconds = [run['wall_seconds'] for run in runs]
+            result = {'case': case['name'], 'polygons': case['polygons'],
+            'repeat': repeat, 'wall_seconds': wall_seconds,
+            'median_seconds': statistics.median(wall_seconds),
+            'peak_rss_bytes': max([run['peak_rss_bytes'] or 0
+            for run in runs]) or None,
+            'rss_increase_bytes': max([run['rss_increase_bytes'] or 0
+            for run in runs]) or None,
+            'output_bytes': runs[-1]['output_bytes']}
+            print(f"{result['case']} ({result['polygons']} polygons): "
+            f"{result['median_seconds']:.3f} s median, "
+            f"peak RSS {result['peak_rss_bytes']}, "
+            f"output {result['output_bytes']} bytes")
+            results.append(result)
+
+    commit = _current_commit()
+    report = {'commit': commit,
+    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+    'python': platform.python_version(), 'platform': platform.platform(),
+    'seed': seed, 'polygon_counts': polygon_counts, 'results': results}
+    os.makedirs(results_folder, exist_ok = True)
+    results_path = os.path.join(results_folder, time.strftime(
+        '%Y%m%d_%H%M%S')+'_'+str(commit)+'.json')
+    with open(results_path, 'w') as file:
+        file.write(json.dumps(report, indent = 2))
+    print("Saved results to", results_path)
+    return results_path
+
+
+def compare_results(baseline_path, comparison_path):
+    '''Prints the change in median wall time, peak RSS, and output size for
+    each case between two results files (e.g. from two different commits),
+    and returns the comparison as a DataFrame.'''
+    tables = []
+    for path in [baseline_path, comparison_path]:
+        with open(path) as file:
+            report = json.loads(file.read())
+        tables.append(pd.DataFrame(report['results']).set_index('case')[
+            ['median_seconds', 'peak_rss_bytes', 'output_bytes']])
+    comparison = tables[0].join(tables[1], lsuffix = '_baseline',
+    rsuffix = '_comparison')
+    comparison['time_ratio'] = comparison['median_seconds_comparison'] / \
+        comparison['median_seconds_baseline']
+    print(comparison.to_string())
+    return comparison
+
+
+def measure_browser_rendering(html_path, pan_seconds = 3, 
+window_width = 3000):
+    '''Opens a map within headless Chrome and measures how quickly it
+    renders and pans. Returns a dictionary containing:
+
+    first_render_ms: The time between the start of navigation and the first
+    frame drawn after the page (including its map layers) has loaded.
+
+    pan_fps: The number of frames per second achieved while the map is
+    panned continuously for pan_seconds.
+
+    The following metrics from Chrome's performance log (via the DevTools
+    Performance domain), collected after panning: dom_nodes, 
+    layout_seconds, script_seconds, and js_heap_used_bytes.'''
+    driver = census_folium_viewer.create_screenshot_driver(window_width,
+    verbose = False)
+    try:
+        driver.execute_cdp_cmd('Performance.enable', {})
+        driver.get(Path(os.path.abspath(html_path)).as_uri())
+        first_render_ms = driver.execute_async_script("""
+            var done = arguments[arguments.length - 1];
+            requestAnimationFrame(function() {
+                requestAnimationFrame(function() {
+                    done(performance.now());
+                });
+            });""")
+        pan_fps = driver.execute_async_script("""
+            var done = arguments[arguments.length - 1];
+            var duration = arguments[0] * 1000;
+            // Folium stores the map within a global variable.
+            var map = Object.values(window).find(function(value) {
+                return value instanceof L.Map;
+            });
+            var frames = 0;
+            var start = performance.now();
+            function step(now) {
+                frames += 1;
+                map.panBy([25, 10], {animate: false});
+                if (now - start < duration) {
+                    requestAnimationFrame(step);
+                } else {
+                    done(frames * 1000 / (now - start));
+                }
+            }
+            requestAnimationFrame(step);""", pan_seconds)
+        metrics = {metric['name']: metric['value'] for metric in 
+        driver.execute_cdp_cmd('Performance.getMetrics', {})['metrics']}
+    finally:
+        driver.quit()
+    return {'first_render_ms': first_render_ms, 'pan_fps': pan_fps,
+    'dom_nodes': metrics.get('Nodes'), 
+    'layout_seconds': metrics.get('LayoutDuration'),
+    'script_seconds': metrics.get('ScriptDuration'),
+    'js_heap_used_bytes': metrics.get('JSHeapUsedSize')}
+
+
+def _memory_usage_bytes():
+    '''Returns this process's current RSS and PSS (proportional set size, 
+    which divides shared pages among the processes that use them) in bytes.
+    Both values are None where /proc isn't available.'''
+    usage = {'rss_bytes': None, 'pss_bytes': None}
+    try:
+        with open('/proc/self/smaps_rollup') as file:
+            for line in file:
+                if line.startswith('Rss:'):
+                    usage['rss_bytes'] = int(line.split()[1]) * 1024
+                elif line.startswith('Pss:'):
+                    usage['pss_bytes'] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return usage
+
+
+def _receive_table(table, sent_at):
+    '''Runs within a worker process: materializes the table that was sent
+    to it and reports how long that took (since sent_at) and how much
+    memory the worker is using.'''
+    if isinstance(table, census_folium_viewer.SharedTable):
+        table = table.table()
+    # Touching the numeric columns ensures that their pages are mapped.
+    float(table.select_dtypes('number').sum().sum())
+    return {'startup_seconds': time.time() - sent_at,
+    **_memory_usage_bytes(), 'peak_rss_bytes': _peak_rss_bytes()}
+
+
+def _warm_up_worker(seconds):
+    time.sleep(seconds)
+    return _memory_usage_bytes()
+
+
+def compare_table_handoff(polygon_count = 33000, geography = 'zip', 
+workers = 4, seed = 0):
+    '''Compares two ways of giving a prepared table to a pool of worker
+    processes: pickling it (the default for ProcessPoolExecutor) and
+    placing it in shared memory via census_folium_viewer.SharedTable.
+
+    For each method, every worker receives the table once. The time 
+    between sending the table and the worker having a usable GeoDataFrame
+    (startup_seconds) is recorded, along with each worker's RSS and PSS
+    before and after receiving it.
+
+    Returns a DataFrame with one row per method containing the median
+    startup time and the mean memory increase per worker.'''
+    with tempfile.TemporaryDirectory() as temp_folder:
+        shape_path = os.path.join(temp_folder, geography+'_shapes.gpkg')
+        data_path = os.path.join(temp_folder, geography+'_data.csv')
+        with contextlib.redirect_stdout(io.StringIO()):
+            write_synthetic_geography(shape_path, data_path, polygon_count,
+            geography, seed = seed)
+            table = _prepare(geography, shape_path, data_path)
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for method in ['pickle', 'shared_memory']:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers,
+        mp_context = context) as executor:
+            # Each worker is started (and has imported its modules) before
+            # the measurements begin.
+            baselines = list(executor.map(_warm_up_worker, 
+            [1] * workers))
+            sent_table = table
+            if method == 'shared_memory':
+                setup_start = time.perf_counter()
+                sent_table = census_folium_viewer.SharedTable(table)
+                setup_seconds = time.perf_counter() - setup_start
+            else:
+                setup_seconds = 0
+            try:
+                futures = [executor.submit(_receive_table, sent_table, 
+                time.time()) for i in range(workers)]
+                worker_results = [future.result() for future in futures]
+            finally:
+                if method == 'shared_memory':
+                    sent_table.unlink()
+        baseline_rss = statistics.mean([baseline['rss_bytes'] or 0
+        for baseline in baselines])
+        baseline_pss = statistics.mean([baseline['pss_bytes'] or 0
+        for baseline in baselines])
+        results.append({'method': method, 'polygons': polygon_count,
+        'workers': workers, 'setup_seconds': setup_seconds,
+        'median_startup_seconds': statistics.median([result[
+            'startup_seconds'] for result in worker_results]),
+        'mean_rss_increase_bytes': statistics.mean([(result['rss_bytes'] 
+        or 0) for result in worker_results]) - baseline_rss,
+        'mean_pss_increase_bytes': statistics.mean([(result['pss_bytes']
+        or 0) for result in worker_results]) - baseline_pss,
+        'max_peak_rss_bytes': max([result['peak_rss_bytes'] or 0
+        for result in worker_results])})
+
+    comparison = pd.DataFrame(results).set_index('method')
+    print(comparison.to_string())
+    return comparison
+
+
+def compare_renderers(polygon_count = 33000, geography = 'zip', seed = 0,
+repeat = 3, pan_seconds = 3):
+    '''Creates the same synthetic map with Leaflet's SVG renderer and with
+    its canvas renderer (generate_map's prefer_canvas option), then
+    measures each within headless Chrome via measure_browser_rendering.
+    The maps don't use a tile background so that the measurements don't
+    depend on network access.
+
+    Returns a DataFrame with the median of each measurement for each
+    renderer.'''
+    results = []
+    with tempfile.TemporaryDirectory() as temp_folder:
+        shape_path = os.path.join(temp_folder, geography+'_shapes.gpkg')
+        data_path = os.path.join(temp_folder, geography+'_data.csv')
+        with contextlib.redirect_stdout(io.StringIO()):
+            write_synthetic_geography(shape_path, data_path, polygon_count,
+            geography, seed = seed)
+            table = _prepare(geography, shape_path, data_path)
+        for renderer in ['svg', 'canvas']:
+            map_name = geography+'_'+renderer
+            with contextlib.redirect_stdout(io.StringIO()):
+                m = census_folium_viewer.generate_map(
+                    merged_data_table = table,
+                    shape_feature_name = {'state': 'NAME', 'county': 'NAME',
+                    'zip': 'ZCTA5CE20'}[geography],
+                    data_variable = 'Median_household_income',
+                    feature_text = geography, map_name = map_name,
+                    html_save_path = temp_folder, variable_decimals = 0,
+                    fill_color = 'RdYlGn', tiles = None,
+                    generate_image = False,
+                    prefer_canvas = (renderer == 'canvas'))
+            # The map is saved again under a platform-independent path
+            # for Chrome to open.
+            html_path = os.path.join(temp_folder, map_name+'.html')
+            m.save(html_path)
+            for i in range(repeat):
+                result = measure_browser_rendering(html_path,
+                pan_seconds = pan_seconds)
+                result['renderer'] = renderer
+                results.append(result)
+
+    comparison = pd.DataFrame(results).groupby('renderer').median()
+    print(comparison.to_string())
+    return comparison
+
+
+def compare_table_formats(table_paths = None, polygon_count = 33000,
+geography = 'zip', seed = 0, repeat = 3):
+    '''Compares saving and loading prepared tables as GeoJSON (via
+    to_file(driver = 'GeoJSON') and geopandas.read_file, as within the
+    tutorial notebooks) and as GeoParquet (via
+    census_folium_viewer.save_table and load_table).
+
+    table_paths: A list of existing tables to compare (e.g. 
+    ['state_and_census_table.geojson', 'county_and_census_table.geojson',
+    'zip_and_census_table.geojson']). If this is None, a synthetic table
+    with polygon_count polygons is prepared instead.
+
+    For each table, the median write and read times and the file size are
+    recorded for both formats. The GeoParquet read is also timed with only
+    the columns that a single map needs (the first column, the first 
+    numeric column, and the geometry), since Parquet can skip the others.
+
+    Returns a DataFrame with one row per table and format.'''
+    results = []
+    with tempfile.TemporaryDirectory() as temp_folder:
+        if table_paths is None:
+            shape_path = os.path.join(temp_folder, geography+'_shapes.gpkg')
+            data_path = os.path.join(temp_folder, geography+'_data.csv')
+            with contextlib.redirect_stdout(io.StringIO()):
+                write_synthetic_geography(shape_path, data_path,
+                polygon_count, geography, seed = seed)
+                tables = {geography+'_'+str(polygon_count): _prepare(
+                    geography, shape_path, data_path)}
+        else:
+            tables = {Path(path).stem: geopandas.read_file(path)
+            for path in table_paths}
+
+        for table_name, table in tables.items():
+            numeric_columns = table.select_dtypes('number').columns
+            map_columns = [table.columns[0], numeric_columns[0], 'geometry'] \
+                if len(numeric_columns) > 0 else [table.columns[0], 
+                'geometry']
+            for table_format in ['geojson', 'geoparquet']:
+                path = os.path.join(temp_folder, table_name+'.'+(
+                    'parquet' if table_format == 'geoparquet' else 
+                    'geojson'))
+                write_seconds, read_seconds, projected_read_seconds = \
+                    [], [], []
+                for i in range(repeat):
+                    start_time = time.perf_counter()
+                    if table_format == 'geoparquet':
+                        census_folium_viewer.save_table(table, path)
+                    else:
+                        table.to_file(path, driver = 'GeoJSON')
+                    write_seconds.append(time.perf_counter() - start_time)
+                    start_time = time.perf_counter()
+                    if table_format == 'geoparquet':
+                        census_folium_viewer.load_table(path)
+                        read_seconds.append(time.perf_counter() - 
+                        start_time)
+                        start_time = time.perf_counter()
+                        census_folium_viewer.load_table(path,
+                        columns = map_columns)
+                        projected_read_seconds.append(
+                            time.perf_counter() - start_time)
+                    else:
+                        geopandas.read_file(path)
+                        read_seconds.append(time.perf_counter() - 
+                        start_time)
+                results.append({'table': table_name, 'format': table_format,
+                'rows': len(table), 'file_bytes': os.path.getsize(path),
+                'median_write_seconds': statistics.median(write_seconds),
+                'median_read_seconds': statistics.median(read_seconds),
+                'median_projected_read_seconds': statistics.median(
+                    projected_read_seconds) if len(
+                    projected_read_seconds) > 0 else None})
+
+    comparison = pd.DataFrame(results).set_index(['table', 'format'])
+    print(comparison.to_string())
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks the \
+census_folium_viewer mapping pipeline on synthetic geographies.')
+    parser.add_argument('--state-count', type = int, default = 50)
+    parser.add_argument('--county-count', type = int, default = 3000)
+    parser.add_argument('--zip-count', type = int, default = 33000)
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--results-folder', default = 'benchmark_results')
+    parser.add_argument('--compare', nargs = 2, metavar = ('BASELINE',
+    'COMPARISON'), help = 'Compare two existing results files instead of \
+running the benchmarks.')
+    parser.add_argument('--generate', nargs = 3, metavar = ('GEOGRAPHY',
+    'COUNT', 'OUTPUT_PREFIX'), help = 'Write a synthetic geography to \
+OUTPUT_PREFIX.gpkg and OUTPUT_PREFIX.csv instead of running the benchmarks.')
+    parser.add_argument('--chunk-size', type = int, default = 100000)
+    parser.add_argument('--import-time', action = 'store_true', help = 
+    'Only measure the time taken to import census_folium_viewer.')
+    parser.add_argument('--compare-handoff', nargs = 3, metavar = (
+    'GEOGRAPHY', 'COUNT', 'WORKERS'), help = 'Compare the startup time and \
+memory use of workers that receive a prepared table via pickling versus \
+shared memory instead of running the benchmarks.')
+    parser.add_argument('--compare-renderers', nargs = 2, metavar = (
+    'GEOGRAPHY', 'COUNT'), help = 'Compare the time to first render and \
+the panning frame rate of SVG and canvas maps within headless Chrome \
+instead of running the benchmarks.')
+    parser.add_argument('--compare-formats', nargs = '*', metavar = 'PATH',
+    help = 'Compare saving and loading tables as GeoJSON and GeoParquet \
+instead of running the benchmarks.')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare_results(*args.compare)
+    elif args.generate is not None:
+        geography, polygon_count, output_prefix = args.generate
+        write_synthetic_geography(output_prefix+'.gpkg', output_prefix+'.csv',
+        int(polygon_count), geography, seed = args.seed,
+        chunk_size = args.chunk_size)
+    elif args.import_time == True:
+        import_time = measure_import_time(repeat = max(args.repeat, 5))
+        print(f"census_folium_viewer: {import_time['median_seconds']:.3f} \
+s median")
+        for name, seconds in import_time['slowest_imports'].items():
+            print(f"  {name}: {seconds:.3f} s")
+    elif args.compare_handoff is not None:
+        geography, polygon_count, workers = args.compare_handoff
+        compare_table_handoff(int(polygon_count), geography, 
+        workers = int(workers), seed = args.seed)
+    elif args.compare_renderers is not None:
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        geography, polygon_count = args.compare_renderers
+        compare_renderers(int(polygon_count), geography, seed = args.seed,
+        repeat = args.repeat)
+    elif args.compare_formats is not None:
+        compare_table_formats(args.compare_formats if len(
+            args.compare_formats) > 0 else None, args.zip_count,
+        seed = args.seed, repeat = args.repeat)
+    else:
+        # generate_map reads color_schemes_from_branca.json from the current
+        # folder, so the benchmarks are run from the project's root folder.
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        run_benchmarks({'state': args.state_count,
+        'county': args.county_count, 'zip': args.zip_count},
+        repeat = args.repeat, seed = args.seed,
+        results_folder = args.results_folder)
@@ -0,0 +1,472 @@
+# Census Folium Geometry:
+# Classes for storing the shapes of prepared tables once and sharing them,
+# whether between attribute tables (GeographyStore), between processes via
+# memory-mapped files (MappedGeometryStore), or between processes via
+# shared memory (SharedTable).
+# Released under the MIT license
+
+# The latter two store each table's shapes as flat coordinate and offset
+# arrays (shapely's "ragged array" format, via encode_geometry and
+# decode_geometry), which can be written to disk or copied into shared
+# memory without pickling the shapes themselves.
+# census_folium_viewer imports these classes, so they can also be accessed
+# as census_folium_viewer.GeographyStore, etc.
+
+import json
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+import geopandas
+import shapely
+
+
+class GeographyStore:
+    '''This class stores the geometry of a prepared table (e.g. one returned
+    by prepare_state_table, prepare_county_table, or prepare_zip_table) a
+    single time, indexed by a key column (such as a GEOID, a zip code, or a
+    [state code, county code] pair). Additional attribute tables (population
+    growth data, home value data, etc.) can then be attached to the store
+    without re-merging the entire table and copying its geometry each time.
+
+    Variables:
+
+    merged_data_table: The GeoDataFrame created via prepare_zip_table,
+    prepare_county_table, or prepare_state_table.
+
+    key_column: The name of the column (or a list of column names) within
+    merged_data_table that uniquely identifies each shape. For counties,
+    I recommend passing ['STATEFP', 'COUNTYFP'] (the state and county codes
+    within the county shapefile).
+
+    Example:
+    store = GeographyStore(state_and_census_table, 'NAME')
+    store.attach(df_acs5_state_pop_growth, key_column = 'NAME')
+    store.attach(df_acs5_state_home_val_growth, key_column = 'NAME')
+    generate_map(merged_data_table = store.view(), ...)
+    '''
+
+    def __init__(self, merged_data_table, key_column):
+        self.key_column = key_column
+        key_columns = key_column if isinstance(key_column, list) else [
+            key_column]
+        table = merged_data_table.dropna(subset = 'geometry')
+        self.index = self._build_index(table, key_columns)
+        if self.index.has_duplicates:
+            raise ValueError('Error: the values in key_column must be unique \
+in order to build a GeographyStore.')
+        # The geometry is stored as a GeometryArray (without its own index),
+        # which allows it to be shared by every view of the store rather than
+        # copied into each one.
+        self.geometry = table.geometry.values
+        self.crs = table.crs
+        # The remaining columns are stored as a dictionary of 1D arrays, all
+        # of which are aligned with self.index. Attaching a new table
+        # therefore only adds entries to this dictionary.
+        self.columns = {column: table[column].to_numpy() for column in
+        table.columns if column != table.geometry.name}
+
+    @staticmethod
+    def _build_index(table, key_columns):
+        '''Creates the (possibly multi-level) index used to look up rows
+        by key.'''
+        if len(key_columns) == 1:
+            return pd.Index(table[key_columns[0]].to_numpy(),
+            name = key_columns[0])
+        return pd.MultiIndex.from_arrays(
+            [table[column].to_numpy() for column in key_columns],
+            names = key_columns)
+
+    def __len__(self):
+        return len(self.index)
+
+    def attach(self, attribute_table, key_column = None, columns = None,
+    prefix = '', overwrite = False):
+        '''Attaches the columns within attribute_table to the store by
+        matching attribute_table's key column(s) to the store's key column(s).
+        Rows within attribute_table whose keys aren't found within the store
+        are ignored (as they would have no geometry to map), and shapes
+        without a matching row receive missing values.
+
+        key_column: The name of the column (or list of column names) within
+        attribute_table that should be matched to the store's key. If this
+        value is None, the store's own key_column will be used.
+
+        columns: A list of the columns within attribute_table that should be
+        attached. If this value is None, all non-key columns will be attached.
+
+        prefix: A string to add to the start of each attached column name
+        (e.g. 'census_' or 'acs5_'). This replaces the renaming loops that
+        were previously needed to keep columns from different surveys apart.
+
+        overwrite: Whether to replace existing columns that share a name with
+        an attached column. If False, a ValueError is raised instead.'''
+        if key_column is None:
+            key_column = self.key_column
+        key_columns = key_column if isinstance(key_column, list) else [
+            key_column]
+        if columns is None:
+            columns = [column for column in attribute_table.columns
+            if column not in key_columns]
+        attribute_index = self._build_index(attribute_table, key_columns)
+        if attribute_index.has_duplicates:
+            raise ValueError('Error: the values in the attribute table\'s \
+key column(s) must be unique.')
+
+        # get_indexer performs a single hash-based lookup per shape, so the
+        # cost of this step grows linearly with the number of rows. Shapes
+        # that aren't present within attribute_table receive a position of -1.
+        positions = attribute_index.get_indexer(self.index)
+        missing = positions == -1
+
+        for column in columns:
+            new_name = prefix + column
+            if (new_name in self.columns) and (overwrite == False):
+                raise ValueError(f'Error: {new_name} is already present \
+within the store. Pass a prefix or set overwrite to True.')
+            values = attribute_table[column].to_numpy()
+            if missing.any():
+                # Missing values require a dtype that supports NaN/None.
+                if values.dtype.kind in 'iub':
+                    values = values.astype('float64')
+                aligned = values[positions]
+                aligned[missing] = None if values.dtype.kind == 'O' else np.nan
+            else:
+                aligned = values[positions]
+            self.columns[new_name] = aligned
+        return self
+
+    def view(self, columns = None):
+        '''Returns a GeoDataFrame containing the store's geometry along with
+        the columns specified (or all columns if columns is None). This
+        GeoDataFrame can be passed directly to generate_map. The geometry
+        array is shared with the store rather than copied.'''
+        if columns is None:
+            columns = list(self.columns.keys())
+        return geopandas.GeoDataFrame(
+            {column: self.columns[column] for column in columns},
+            geometry = self.geometry, crs = self.crs)
+
+
+def _concatenated_ranges(starts, counts):
+    '''Returns the concatenation of range(start, start + count) for each
+    start and count, without a Python loop.'''
+    ends = np.cumsum(counts)
+    return np.repeat(starts - ends + counts, counts) + np.arange(
+        ends[-1] if len(ends) > 0 else 0)
+
+
+def encode_geometry(geometry):
+    '''Converts an array of shapes to shapely's ragged array format: a 
+    single array of coordinates plus arrays of offsets that indicate where
+    each shape (and each of its polygons and rings) begins. Returns a
+    (geometry_type, coordinates, offsets, missing) tuple, in which missing
+    is a boolean array that marks the shapes that are None.
+
+    Missing and empty shapes are stored as zero-length entries (i.e. shapes
+    with no polygons or rings). Replacing them with empty Polygons instead
+    would not work for tables that also contain MultiPolygons, since
+    to_ragged_array would store each empty Polygon as a polygon with no
+    rings, which shapely.from_ragged_array can't read.'''
+    geometry = np.asarray(geometry)
+    missing = shapely.is_missing(geometry)
+    present = ~missing & ~shapely.is_empty(geometry)
+    if present.any():
+        geometry_type, coordinates, offsets = shapely.to_ragged_array(
+            geometry[present])
+        if len(offsets) == 0:
+            raise ValueError('Error: only line and polygon shapes can be \
+stored in ragged array format.')
+    else:
+        geometry_type = shapely.GeometryType.POLYGON
+        coordinates = np.empty((0, 2))
+        offsets = (np.zeros(1, dtype = 'int64'), 
+        np.zeros(1, dtype = 'int64'))
+    # The outermost offsets (one entry per shape) are expanded so that
+    # each missing or empty shape has a count of 0.
+    counts = np.zeros(len(geometry), dtype = 'int64')
+    counts[present] = np.diff(offsets[-1])
+    offsets = tuple(np.asarray(level_offsets, dtype = 'int64') 
+    for level_offsets in offsets[:-1]) + (np.concatenate(
+        [[0], np.cumsum(counts)]).astype('int64'),)
+    return int(geometry_type), coordinates, offsets, missing
+
+
+def decode_geometry(geometry_type, coordinates, offsets, missing):
+    '''Rebuilds the array of shapes encoded by encode_geometry. Missing
+    shapes are restored as None, and empty shapes are restored as empty
+    shapes of the array's geometry type.'''
+    geometry = shapely.from_ragged_array(shapely.GeometryType(
+        geometry_type), coordinates, offsets)
+    geometry[np.asarray(missing)] = None
+    return geometry
+
+
+def write_geometry_store(merged_data_table, store_path):
+    '''Writes a prepared table (e.g. one returned by prepare_zip_table or
+    prepare_county_table) to a folder that MappedGeometryStore can open.
+
+    The shapes are stored in ragged array format (see encode_geometry) as
+    .npy files that are memory-mapped when the store is opened. The 
+    other columns are saved to attributes.parquet.'''
+    os.makedirs(store_path, exist_ok = True)
+    geometry = np.asarray(merged_data_table.geometry.values)
+    geometry_type, coordinates, offsets, missing = encode_geometry(geometry)
+    np.save(os.path.join(store_path, 'coordinates.npy'), coordinates)
+    for level, level_offsets in enumerate(offsets):
+        np.save(os.path.join(store_path, f'offsets_{level}.npy'), 
+        level_offsets)
+    np.save(os.path.join(store_path, 'bounds.npy'), shapely.bounds(geometry))
+    np.save(os.path.join(store_path, 'missing.npy'), missing)
+    pd.DataFrame(merged_data_table.drop(
+        columns = merged_data_table.geometry.name)).to_parquet(
+            os.path.join(store_path, 'attributes.parquet'))
+    crs = merged_data_table.crs
+    with open(os.path.join(store_path, 'metadata.json'), 'w') as file:
+        file.write(json.dumps({'geometry_type': int(geometry_type),
+        'offset_levels': len(offsets), 'rows': len(geometry),
+        'geometry_column': merged_data_table.geometry.name,
+        'crs': None if crs is None else crs.to_wkt()}))
+    return store_path
+
+
+class MappedGeometryStore:
+    '''This class opens a table saved via write_geometry_store without
+    reading or parsing its shapes. The coordinate and offset arrays are
+    memory-mapped, so opening a store is nearly instant, and worker
+    processes that open the same store share its pages through the 
+    operating system's file cache rather than each holding their own copy
+    of the geometry. Shapes are only created (from the relevant slices of
+    the coordinate array) for the rows that are actually requested.
+
+    This makes it well suited to batch jobs that fan out to many workers:
+    pass each worker the store's path (which, unlike a GeoDataFrame, costs
+    nothing to send to another process) and have it open the store itself.
+
+    Example:
+    write_geometry_store(zip_and_census_table, 'zip_table.geostore')
+    # Then, within each worker:
+    store = MappedGeometryStore('zip_table.geostore')
+    table = store.table(rows = store.rows_within((-80.5, 37, -66.9, 47.5)),
+    columns = ['NAME', 'population_2021'])
+    '''
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(os.path.join(store_path, 'metadata.json')) as file:
+            self.metadata = json.loads(file.read())
+        self.coordinates = np.load(os.path.join(store_path, 
+        'coordinates.npy'), mmap_mode = 'r')
+        self.offsets = tuple(np.load(os.path.join(store_path, 
+        f'offsets_{level}.npy'), mmap_mode = 'r') 
+        for level in range(self.metadata['offset_levels']))
+        self.bounds = np.load(os.path.join(store_path, 'bounds.npy'),
+        mmap_mode = 'r')
+        self.missing = np.load(os.path.join(store_path, 'missing.npy'),
+        mmap_mode = 'r')
+        self.crs = self.metadata['crs']
+
+    def __len__(self):
+        return self.metadata['rows']
+
+    def rows_within(self, bounding_box):
+        '''Returns the positions of the rows whose shapes overlap 
+        bounding_box (a (min_longitude, min_latitude, max_longitude, 
+        max_latitude) tuple), based on the stored bounds of each shape.'''
+        bounds = self.bounds
+        return np.flatnonzero((bounds[:, 0] <= bounding_box[2]) & 
+        (bounds[:, 2] >= bounding_box[0]) & (bounds[:, 1] <= 
+        bounding_box[3]) & (bounds[:, 3] >= bounding_box[1]))
+
+    def geometry(self, rows = None):
+        '''Creates the shapes for the given row positions (or for every row
+        if rows is None) and returns them as an array.'''
+        if rows is None:
+            rows = np.arange(len(self))
+        rows = np.asarray(rows, dtype = 'int64')
+        # Starting from the outermost offsets (shapes), each level's
+        # offsets are used to find the positions of the next level's items
+        # (e.g. polygons, then rings, then coordinates) that belong to the
+        # selected rows. The offsets are rebuilt for the selection along
+        # the way.
+        positions = rows
+        new_offsets = []
+        for level_offsets in reversed(self.offsets):
+            starts = np.asarray(level_offsets[positions])
+            counts = np.asarray(level_offsets[positions + 1]) - starts
+            new_offsets.append(np.concatenate([[0], np.cumsum(counts)]))
+            positions = _concatenated_ranges(starts, counts)
+        return decode_geometry(self.metadata['geometry_type'],
+        np.asarray(self.coordinates[positions]), 
+        tuple(reversed(new_offsets)), self.missing[rows])
+
+    def table(self, rows = None, columns = None):
+        '''Returns a GeoDataFrame containing the given row positions (or 
+        every row) and columns (or every column), which can be passed to
+        generate_map.'''
+        attributes = pd.read_parquet(os.path.join(self.store_path,
+        'attributes.parquet'), columns = columns)
+        if rows is not None:
+            attributes = attributes.iloc[np.asarray(rows)]
+        geometry_column = self.metadata['geometry_column']
+        return geopandas.GeoDataFrame(attributes.assign(**{geometry_column:
+        geopandas.GeoSeries(self.geometry(rows), index = attributes.index,
+        crs = self.crs)}), geometry = geometry_column, crs = self.crs)
+
+
+# The SharedTables that this process has attached to, keyed by the names of
+# their shared memory blocks
+_attached_shared_tables = {}
+
+
+def _attach_shared_memory(name):
+    '''Attaches to an existing shared memory block without registering it
+    with this process's resource tracker (which would otherwise delete the
+    block when this process exits, even though another process owns it).'''
+    try:
+        return shared_memory.SharedMemory(name = name, track = False)
+    except TypeError: # The track argument requires Python 3.13 or later.
+        block = shared_memory.SharedMemory(name = name)
+        resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+
+class SharedTable:
+    '''This class copies a prepared table's numeric columns and the 
+    coordinate arrays of its shapes into a single shared memory block, so
+    that worker processes can use the table without each receiving (and
+    storing) their own pickled copy. Only a small description of the block,
+    along with any non-numeric columns (such as names), is pickled when a
+    SharedTable is sent to a worker; the worker then attaches to the block
+    and reads its numeric columns directly from shared memory (as
+    read-only arrays). The shapes are rebuilt from the shared coordinate
+    arrays within each worker, which is much faster than unpickling them.
+
+    The process that creates a SharedTable owns its block and should call
+    unlink() once the workers have finished (generate_maps does this
+    automatically).
+
+    Example:
+    shared_table = SharedTable(zip_and_census_table)
+    # Within a worker that receives shared_table:
+    generate_map(merged_data_table = shared_table.table(), ...)
+    '''
+
+    def __init__(self, merged_data_table):
+        geometry_type, coordinates, offsets, missing = encode_geometry(
+            merged_data_table.geometry.values)
+        self.geometry_type = geometry_type
+        self.geometry_column = merged_data_table.geometry.name
+        self.crs = None if merged_data_table.crs is None else \
+            merged_data_table.crs.to_wkt()
+        self.index = merged_data_table.index
+        self.column_order = list(merged_data_table.columns)
+        self.offset_levels = len(offsets)
+
+        arrays = {'coordinates': coordinates, 'missing': missing}
+        for level, level_offsets in enumerate(offsets):
+            arrays['offsets_'+str(level)] = level_offsets
+        # Numeric and boolean columns are placed in shared memory; other
+        # columns (e.g. names) are pickled along with the SharedTable.
+        self.other_columns = {}
+        self.shared_columns = []
+        for position, column in enumerate(self.column_order):
+            if column == self.geometry_column:
+                continue
+            values = merged_data_table.iloc[:, position]
+            if values.dtype.kind in 'biuf':
+                arrays['column_'+str(position)] = values.to_numpy()
+                self.shared_columns.append(position)
+            else:
+                self.other_columns[position] = values
+
+        # Each array is placed at a 64-byte-aligned position within the
+        # block.
+        self.layout = {}
+        size = 0
+        for key, array in arrays.items():
+            self.layout[key] = (array.dtype.str, array.shape, size)
+            size += -(-array.nbytes // 64) * 64
+        self.shared_memory = shared_memory.SharedMemory(create = True,
+        size = max(size, 1))
+        for key, array in arrays.items():
+            dtype, shape, offset = self.layout[key]
+            view = np.ndarray(shape, dtype = dtype, 
+            buffer = self.shared_memory.buf, offset = offset)
+            view[...] = array
+            del view
+        self.owner = True
+        self._table = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shared_memory_name'] = self.shared_memory.name
+        del state['shared_memory']
+        state['owner'] = False
+        state['_table'] = None
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop('shared_memory_name')
+        self.__dict__.update(state)
+        # Worker processes often receive the same SharedTable for several
+        # tasks, so the block (and the table built from it) is reused.
+        if name in _attached_shared_tables:
+            attached = _attached_shared_tables[name]
+            self.shared_memory = attached.shared_memory
+            self._table = attached._table
+        else:
+            self.shared_memory = _attach_shared_memory(name)
+            _attached_shared_tables[name] = self
+
+    def _array(self, key):
+        dtype, shape, offset = self.layout[key]
+        array = np.ndarray(shape, dtype = dtype, 
+        buffer = self.shared_memory.buf, offset = offset)
+        array.flags.writeable = False
+        return array
+
+    def table(self):
+        '''Returns the table as a GeoDataFrame whose numeric columns are
+        read-only views of the shared memory block. The table is created 
+        once per process and then reused.'''
+        if self._table is not None:
+            return self._table
+        offsets = tuple(self._array('offsets_'+str(level)) 
+        for level in range(self.offset_levels))
+        geometry = decode_geometry(self.geometry_type, 
+        self._array('coordinates'), offsets, self._array('missing'))
+        data = {}
+        for position, column in enumerate(self.column_order):
+            if column == self.geometry_column:
+                data[position] = geopandas.GeoSeries(geometry, 
+                index = self.index, crs = self.crs)
+            elif position in self.other_columns:
+                data[position] = self.other_columns[position]
+            else:
+                data[position] = pd.Series(self._array('column_'+
+                str(position)), index = self.index, copy = False)
+        # The columns are keyed by position (and renamed afterwards) so that
+        # tables with duplicate column names are handled correctly.
+        table = pd.DataFrame(data, index = self.index, copy = False)
+        table.columns = self.column_order
+        self._table = geopandas.GeoDataFrame(table, 
+        geometry = self.geometry_column, crs = self.crs)
+        if self.owner == False:
+            _attached_shared_tables[self.shared_memory.name]._table = \
+                self._table
+        return self._table
+
+    def unlink(self):
+        '''Releases the shared memory block. Only the process that created
+        the SharedTable can do this.'''
+        self._table = None
+        try:
+            self.shared_memory.close()
+        except BufferError:
+            # Views of the block are still in use within this process;
+            # it will be unmapped once they're garbage collected.
+            pass
+        if self.owner == True:
+            self.shared_memory.unlink()
@@ -0,0 +1,341 @@
+# Census Folium Service:
+# A long-running localhost HTTP service that creates maps via
+# census_folium_viewer.generate_map on request.
+# Released under the MIT license
+
+# Creating an ad-hoc map from a script means starting Python, importing
+# the mapping libraries, and re-reading the prepared state, county, or zip
+# tables before generate_map can even begin. This service instead loads
+# those tables once and keeps them in memory, so each request only has to
+# run generate_map itself. The resulting .html maps are also cached (with
+# the least recently used maps removed once the cache is full), so
+# repeated requests for the same map are returned almost instantly.
+
+# Endpoints:
+# /map?table=county&data_variable=Median_home_value&fill_color=RdYlGn
+# &bin_count=6 returns a map as HTML. (The other supported generate_map
+# arguments are listed within MAP_ARGUMENTS.)
+# /tables lists the loaded tables and their columns.
+# /metrics returns request counts, cache statistics, latency percentiles,
+# and throughput as JSON.
+
+# Example usage (run from the project's root folder, since generate_map
+# reads color_schemes_from_branca.json from the current folder):
+# python census_folium_service.py --port 8766
+# --table state state_and_census_table.geojson NAME state
+# Then visit:
+# http://127.0.0.1:8766/map?table=state&data_variable=Median_household_income
+
+import argparse
+import collections
+import hashlib
+import http.server
+import inspect
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+import census_folium_viewer
+
+# The generate_map arguments that can be passed as query parameters, along
+# with the function that converts each parameter's text to the type that
+# generate_map expects.
+def _parse_bool(text):
+    if text.lower() in ['true', '1', 'yes']:
+        return True
+    if text.lower() in ['false', '0', 'no']:
+        return False
+    raise ValueError('Error: '+text+' is not a valid boolean value.')
+
+MAP_ARGUMENTS = {
+    'data_variable': str,
+    'data_variable_text': str,
+    'popup_variable_text': str,
+    'variable_decimals': int,
+    'fill_color': str,
+    'rows_to_map': int,
+    'bin_count': int,
+    'bin_type': str,
+    'tiles': str,
+    'tiles_attribution': str,
+    'multiply_data_by': float,
+    'render_mode': str,
+    'dot_value': float,
+    'prefer_canvas': _parse_bool,
+    'show_boundaries': _parse_bool,
+    # Comma-separated lists, e.g. states=9,23,25 or
+    # bounding_box=-80.5,37,-66.9,47.5
+    'states': lambda text: [int(value) if value.isdigit() else value
+    for value in text.split(',')],
+    'bounding_box': lambda text: tuple(float(value)
+    for value in text.split(','))
+}
+
+
+class MapService:
+    '''Keeps a set of prepared tables in memory and creates maps from them
+    via generate_map, caching the resulting HTML.
+
+    tables: A dictionary that maps each table's name (as used within
+    requests) to a (merged_data_table, shape_feature_name, feature_text)
+    tuple. merged_data_table can be a GeoDataFrame or the path to a file
+    that census_folium_viewer.load_table can read (such as the .geojson
+    tables saved by the tutorial notebooks or .parquet tables saved by
+    save_table, which load much faster).
+
+    cache_size: The maximum number of maps to keep in the cache.
+
+    latency_window: The number of recent requests used to calculate the
+    latency percentiles reported at /metrics.
+
+    port: The port to listen on. If this is 0, a free port is chosen.'''
+
+    def __init__(self, tables, cache_size = 128, latency_window = 1000,
+    port = 0, host = '127.0.0.1'):
+        self.tables = {}
+        for name, (table, shape_feature_name, feature_text) in tables.items():
+            if isinstance(table, str):
+                table = census_folium_viewer.load_table(table)
+            self.tables[name] = (table, shape_feature_name, feature_text)
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.cache_lock = threading.Lock()
+        # Each map that's being created has its own lock, so concurrent
+        # requests for the same map wait for a single render, while
+        # requests for other maps aren't held up.
+        self.render_locks = {}
+        # The color schemes and generate_map's defaults are used to
+        # validate requests before any rendering begins. (generate_map
+        # reads the color schemes from the current folder.)
+        with open('color_schemes_from_branca.json') as file:
+            self.color_schemes = json.loads(file.read())
+        self.map_defaults = {name: parameter.default for name, parameter
+        in inspect.signature(census_folium_viewer.generate_map
+        ).parameters.items()}
+        self.output_folder = tempfile.mkdtemp(prefix = 'census_folium_')
+        self.metrics_lock = threading.Lock()
+        self.started_at = time.time()
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen = latency_window)
+        self.render_seconds = collections.deque(maxlen = latency_window)
+        self.httpd = http.server.ThreadingHTTPServer((host, port),
+        _MapRequestHandler)
+        self.httpd.service = self
+        self.host, self.port = self.httpd.server_address[:2]
+        self.thread = None
+
+    def url(self, path = '/'):
+        return f'http://{self.host}:{self.port}{path}'
+
+    def _cache_key(self, table_name, map_arguments):
+        return hashlib.sha256(json.dumps([table_name, map_arguments],
+        sort_keys = True, default = str).encode()).hexdigest()
+
+    def _validate(self, table_name, map_arguments):
+        '''Raises KeyError for unknown tables and columns and ValueError for
+        invalid arguments.'''
+        if table_name not in self.tables:
+            raise KeyError('Error: table '+str(table_name)+' isn\'t loaded.')
+        table = self.tables[table_name][0]
+        if map_arguments['data_variable'] not in table.columns:
+            raise KeyError('Error: column '+map_arguments['data_variable']+
+            ' isn\'t present within '+table_name+'.')
+        fill_color = map_arguments.get('fill_color', 
+        self.map_defaults['fill_color'])
+        bin_count = map_arguments.get('bin_count', 
+        self.map_defaults['bin_count'])
+        if fill_color+'_'+str(bin_count).zfill(2) not in self.color_schemes:
+            raise ValueError('Error: the color scheme '+fill_color+
+            ' isn\'t available with '+str(bin_count)+' bins.')
+
+    def get_map(self, table_name, map_arguments):
+        '''Returns the HTML for a map along with whether it came from the
+        cache. Raises KeyError for unknown tables and columns, ValueError
+        for invalid arguments, and RuntimeError if generate_map fails for
+        any other reason.'''
+        self._validate(table_name, map_arguments)
+        key = self._cache_key(table_name, map_arguments)
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key], True
+            render_lock = self.render_locks.setdefault(key, 
+            threading.Lock())
+
+        try:
+            with render_lock:
+                # Another request may have created the same map while this
+                # one was waiting.
+                with self.cache_lock:
+                    if key in self.cache:
+                        self.cache.move_to_end(key)
+                        return self.cache[key], True
+                html, render_seconds = self._render(table_name, key,
+                map_arguments)
+                evictions = 0
+                with self.cache_lock:
+                    self.cache[key] = html
+                    while len(self.cache) > self.cache_size:
+                        self.cache.popitem(last = False)
+                        evictions += 1
+        finally:
+            with self.cache_lock:
+                self.render_locks.pop(key, None)
+        with self.metrics_lock:
+            self.counts['cache_evictions'] += evictions
+            self.render_seconds.append(render_seconds)
+        return html, False
+
+    def _render(self, table_name, key, map_arguments):
+        '''Creates a map via generate_map and returns its HTML along with
+        the time taken to create it.'''
+        table, shape_feature_name, feature_text = self.tables[table_name]
+        records = []
+        try:
+            census_folium_viewer.generate_map(merged_data_table = table,
+            shape_feature_name = shape_feature_name,
+            feature_text = feature_text, map_name = key,
+            html_save_path = self.output_folder, generate_image = False,
+            stats_callback = records.append, **map_arguments)
+        except (ValueError, TypeError):
+            raise
+        except Exception as error:
+            # Other errors (including KeyErrors raised within generate_map)
+            # indicate a problem with the service rather than with the
+            # request.
+            raise RuntimeError('Error: the map couldn\'t be created ('+
+            type(error).__name__+': '+str(error)+').') from error
+        # The service returns the HTML that generate_map saved, then
+        # deletes the saved files.
+        outputs = records[0]['outputs']
+        html_path = [path for path in outputs if path.endswith('.html')][0]
+        with open(html_path, 'rb') as file:
+            html = file.read()
+        for output_path in outputs:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        return html, records[0]['total_seconds']
+
+    def record_request(self, status, seconds, cache_hit = None):
+        with self.metrics_lock:
+            self.counts['requests'] += 1
+            self.counts['status_'+str(status)] += 1
+            if cache_hit is not None:
+                self.counts['cache_hits' if cache_hit else 'cache_misses'] += 1
+            self.latencies.append(seconds)
+
+    def metrics(self):
+        '''Returns the service's request counts, cache statistics, latency
+        percentiles (in milliseconds), and throughput.'''
+        with self.metrics_lock:
+            counts = dict(self.counts)
+            latencies = np.array(self.latencies) * 1000
+            render_seconds = np.array(self.render_seconds)
+        uptime = time.time() - self.started_at
+        lookups = counts.get('cache_hits', 0) + counts.get('cache_misses', 0)
+        percentiles = {}
+        if len(latencies) > 0:
+            percentiles = {f'latency_p{percentile}_ms': float(
+                np.percentile(latencies, percentile))
+                for percentile in [50, 95, 99]}
+        return {'uptime_seconds': uptime, **counts,
+        'requests_per_second': counts.get('requests', 0) / uptime,
+        'cache_entries': len(self.cache), 'cache_size': self.cache_size,
+        'cache_hit_rate': counts.get('cache_hits', 0) / lookups
+        if lookups > 0 else None, **percentiles,
+        'mean_render_seconds': float(render_seconds.mean())
+        if len(render_seconds) > 0 else None}
+
+    def start(self):
+        self.thread = threading.Thread(target = self.httpd.serve_forever,
+        daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+
+class _MapRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        service = self.server.service
+        start_time = time.perf_counter()
+        url = urllib.parse.urlparse(self.path)
+        cache_hit = None
+        if url.path == '/map':
+            query = dict(urllib.parse.parse_qsl(url.query))
+            try:
+                table_name = query.pop('table')
+                unknown = [key for key in query if key not in MAP_ARGUMENTS]
+                if 'data_variable' not in query:
+                    raise ValueError('Error: data_variable is required.')
+                if len(unknown) > 0:
+                    raise ValueError('Error: unsupported arguments: '+
+                    ', '.join(unknown))
+                map_arguments = {key: MAP_ARGUMENTS[key](value)
+                for key, value in query.items()}
+                html, cache_hit = service.get_map(table_name, map_arguments)
+                status, content_type, content = 200, 'text/html', html
+            except KeyError as error:
+                status, content_type = 404, 'text/plain'
+                content = str(error).strip('\'"').encode()
+            except (ValueError, TypeError) as error:
+                status, content_type, content = 400, 'text/plain', str(
+                    error).encode()
+            except Exception as error:
+                status, content_type, content = 500, 'text/plain', str(
+                    error).encode()
+        elif url.path == '/tables':
+            status, content_type = 200, 'application/json'
+            content = json.dumps({name: {'rows': len(table),
+            'shape_feature_name': shape_feature_name,
+            'columns': [str(column) for column in table.columns]}
+            for name, (table, shape_feature_name, feature_text) in
+            service.tables.items()}).encode()
+        elif url.path == '/metrics':
+            status, content_type = 200, 'application/json'
+            content = json.dumps(service.metrics()).encode()
+        else:
+            status, content_type, content = 404, 'text/plain', b'Not found'
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        if url.path == '/map':
+            service.record_request(status, time.perf_counter() - start_time,
+            cache_hit)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Serves maps created by \
+census_folium_viewer.generate_map on localhost.')
+    parser.add_argument('--port', type = int, default = 8766)
+    parser.add_argument('--cache-size', type = int, default = 128)
+    parser.add_argument('--table', nargs = 4, action = 'append',
+    metavar = ('NAME', 'PATH', 'SHAPE_FEATURE_NAME', 'FEATURE_TEXT'),
+    required = True, help = 'A prepared table to load (this argument can \
+be repeated).')
+    args = parser.parse_args()
+
+    service = MapService({name: (path, shape_feature_name, feature_text)
+    for name, path, shape_feature_name, feature_text in args.table},
+    cache_size = args.cache_size, port = args.port)
+    print("Serving maps at", service.url('/map'))
+    service.serve_forever()
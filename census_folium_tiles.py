@@ -0,0 +1,310 @@
+# Census Folium Tiles:
+# A local, size-bounded tile cache and a localhost tile server for the maps
+# created by census_folium_viewer.generate_map.
+# Released under the MIT license
+
+# Each time a map's .html file is opened (including when generate_map
+# takes a screenshot of it), its background tiles are downloaded from the
+# tile provider. This adds several seconds of network latency (and some
+# variance) to every screenshot. The tile server within this file instead
+# serves tiles from an on-disk cache, downloading (and caching) only the
+# tiles that it hasn't seen before. Once the cache has been filled (e.g.
+# via seed_tiles), maps can be rendered and screenshotted entirely offline.
+
+# The cache stores tiles as <cache_folder>/<provider>/<z>/<x>/<y>.png, so it
+# can also be passed to generate_map's basemap_tiles_path argument
+# (e.g. 'tile_cache/stamen_toner/{z}/{x}/{y}.png') when using the
+# 'matplotlib' image backend.
+
+# Example usage (run from the project's root folder):
+# python census_folium_tiles.py --port 8765 --max-mb 2000
+# python census_folium_tiles.py --seed stamen_toner 3 7
+# Within Python:
+# server = census_folium_tiles.TileServer()
+# server.start()
+# generate_map(..., tiles = server.tile_url('stamen_toner'),
+# tiles_attribution = census_folium_tiles.PROVIDERS['stamen_toner'][1])
+
+import argparse
+import collections
+import concurrent.futures
+import http.server
+import json
+import math
+import os
+import threading
+import urllib.request
+
+# The upstream URL and the attribution text for each tile provider. (Stamen's
+# tiles are now hosted by Stadia Maps, which may require an API key for
+# non-local use.)
+PROVIDERS = {
+    'stamen_toner': ('https://tiles.stadiamaps.com/tiles/stamen_toner/\
+{z}/{x}/{y}.png', 'Map tiles by <a href="http://stamen.com">Stamen Design\
+</a>, under <a href="http://creativecommons.org/licenses/by/3.0">CC BY 3.0\
+</a>. Data by &copy; <a href="http://openstreetmap.org">OpenStreetMap</a>, \
+under <a href="http://www.openstreetmap.org/copyright">ODbL</a>.'),
+    'openstreetmap': ('https://tile.openstreetmap.org/{z}/{x}/{y}.png',
+    'Data by &copy; <a href="http://openstreetmap.org">OpenStreetMap</a>, \
+under <a href="http://www.openstreetmap.org/copyright">ODbL</a>.')
+}
+
+# Tile providers ask that requests identify the application making them.
+USER_AGENT = 'census_folium_tutorial tile cache'
+
+
+class TileCache:
+    '''An on-disk cache of map tiles that deletes its least recently used
+    tiles once its total size exceeds max_bytes.
+
+    The last time each tile was used is stored as the tile file's
+    modification time, so the eviction order is preserved when the cache
+    is reopened.'''
+
+    def __init__(self, cache_folder = 'tile_cache',
+    max_bytes = 2 * 1024 ** 3):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # _entries maps each tile's path to its size, ordered from least
+        # to most recently used.
+        entries = []
+        for folder, subfolders, file_names in os.walk(cache_folder):
+            for file_name in file_names:
+                if file_name.endswith('.tmp'):
+                    continue
+                path = os.path.join(folder, file_name)
+                status = os.stat(path)
+                entries.append((status.st_mtime, path, status.st_size))
+        self._entries = collections.OrderedDict(
+            (path, size) for mtime, path, size in sorted(entries))
+        self.total_bytes = sum(self._entries.values())
+
+    def tile_path(self, provider, z, x, y):
+        return os.path.join(self.cache_folder, provider, str(z), str(x),
+        str(y)+'.png')
+
+    def get(self, provider, z, x, y):
+        '''Returns the tile's contents, or None if it isn't cached.'''
+        path = self.tile_path(provider, z, x, y)
+        with self.lock:
+            if path not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(path)
+        try:
+            with open(path, 'rb') as file:
+                content = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.total_bytes -= self._entries.pop(path, 0)
+            return None
+        return content
+
+    def put(self, provider, z, x, y, content):
+        '''Adds a tile to the cache, then evicts the least recently used
+        tiles if the cache has grown beyond max_bytes.'''
+        path = self.tile_path(provider, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        # The tile is written to a temporary file and then renamed so that
+        # other threads never read a partially written tile.
+        temp_path = path+'.'+str(threading.get_ident())+'.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.total_bytes += len(content) - self._entries.pop(path, 0)
+            self._entries[path] = len(content)
+            evicted_paths = []
+            while self.total_bytes > self.max_bytes and len(
+                self._entries) > 1:
+                evicted_path, size = self._entries.popitem(last = False)
+                self.total_bytes -= size
+                self.evictions += 1
+                evicted_paths.append(evicted_path)
+        for evicted_path in evicted_paths:
+            try:
+                os.remove(evicted_path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {'tiles': len(self._entries),
+            'total_bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+            'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions}
+
+
+def fetch_tile(provider, z, x, y, timeout = 10):
+    '''Downloads a single tile from its provider.'''
+    request = urllib.request.Request(PROVIDERS[provider][0].format(z = z,
+    x = x, y = y), headers = {'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(request, timeout = timeout) as response:
+        return response.read()
+
+
+def get_tile(cache, provider, z, x, y, offline = False):
+    '''Returns a tile from the cache, downloading (and caching) it first
+    if necessary. Returns None if the tile isn't cached and offline is
+    True or the download fails.'''
+    content = cache.get(provider, z, x, y)
+    if content is None and offline == False:
+        try:
+            content = fetch_tile(provider, z, x, y)
+        except OSError:
+            return None
+        cache.put(provider, z, x, y, content)
+    return content
+
+
+class _TileRequestHandler(http.server.BaseHTTPRequestHandler):
+    '''Serves /<provider>/<z>/<x>/<y>.png from the server's TileCache, along
+    with the cache's statistics at /stats.'''
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, 'application/json',
+            json.dumps(self.server.cache.stats()).encode())
+            return
+        parts = self.path.strip('/').split('/')
+        try:
+            provider = parts[0]
+            z, x, y = int(parts[1]), int(parts[2]), int(
+                parts[3].removesuffix('.png'))
+        except (IndexError, ValueError):
+            self._send(404, 'text/plain', b'Not found')
+            return
+        if provider not in PROVIDERS or not (0 <= x < 2 ** z and
+        0 <= y < 2 ** z):
+            self._send(404, 'text/plain', b'Not found')
+            return
+        content = get_tile(self.server.cache, provider, z, x, y,
+        offline = self.server.offline)
+        if content is None:
+            self._send(404, 'text/plain', b'Tile not available')
+        else:
+            self._send(200, 'image/png', content)
+
+    def _send(self, status, content_type, content):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        # The tiles can be loaded by .html files opened from disk.
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # Each tile request would otherwise be printed.
+        pass
+
+
+class TileServer:
+    '''A tile server that runs on localhost (within a background thread)
+    and serves tiles from a TileCache.
+
+    cache: The TileCache to use. If this is None, a TileCache will be
+    created using cache_folder and max_bytes.
+
+    offline: If True, the server never contacts the tile provider; tiles
+    that aren't cached are returned as 404 errors (and display as blank
+    areas on the map).
+
+    port: The port to listen on. If this is 0, a free port is chosen.'''
+
+    def __init__(self, cache = None, cache_folder = 'tile_cache',
+    max_bytes = 2 * 1024 ** 3, offline = False, port = 0,
+    host = '127.0.0.1'):
+        if cache is None:
+            cache = TileCache(cache_folder, max_bytes)
+        self.cache = cache
+        self.httpd = http.server.ThreadingHTTPServer((host, port),
+        _TileRequestHandler)
+        self.httpd.cache = cache
+        self.httpd.offline = offline
+        self.host, self.port = self.httpd.server_address[:2]
+        self.thread = None
+
+    def tile_url(self, provider = 'stamen_toner'):
+        '''The URL template to pass to generate_map's tiles argument.'''
+        return f'http://{self.host}:{self.port}/{provider}/' + \
+            '{z}/{x}/{y}.png'
+
+    def start(self):
+        self.thread = threading.Thread(target = self.httpd.serve_forever,
+        daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+
+def tile_range(bounds, zoom):
+    '''Returns the (x, y) coordinates of every tile at the given zoom level
+    that overlaps bounds, a (min_longitude, min_latitude, max_longitude,
+    max_latitude) tuple.'''
+    def tile_xy(longitude, latitude):
+        latitude = math.radians(max(min(latitude, 85.0511), -85.0511))
+        x = int((longitude + 180) / 360 * 2 ** zoom)
+        y = int((1 - math.asinh(math.tan(latitude)) / math.pi) / 2 *
+        2 ** zoom)
+        return min(max(x, 0), 2 ** zoom - 1), min(max(y, 0), 2 ** zoom - 1)
+    first_x, first_y = tile_xy(bounds[0], bounds[3])
+    last_x, last_y = tile_xy(bounds[2], bounds[1])
+    return [(x, y) for x in range(first_x, last_x + 1)
+    for y in range(first_y, last_y + 1)]
+
+
+def seed_tiles(cache, provider = 'stamen_toner',
+bounds = (-125, 24, -66, 50), zooms = range(3, 8), max_workers = 4):
+    '''Downloads every tile within bounds (by default, the contiguous US)
+    at each of the given zoom levels into cache, skipping tiles that are
+    already cached, so that maps of that area can later be rendered
+    offline. Please keep max_workers low so as not to overload the tile
+    provider. Returns the number of tiles that were downloaded.'''
+    tiles = [(z, x, y) for z in zooms for x, y in tile_range(bounds, z)
+    if not os.path.exists(cache.tile_path(provider, z, x, y))]
+    def download(tile):
+        z, x, y = tile
+        cache.put(provider, z, x, y, fetch_tile(provider, z, x, y))
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers = max_workers) as executor:
+        list(executor.map(download, tiles))
+    return len(tiles)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Serves map tiles from \
+a local cache on localhost.')
+    parser.add_argument('--port', type = int, default = 8765)
+    parser.add_argument('--cache-folder', default = 'tile_cache')
+    parser.add_argument('--max-mb', type = float, default = 2000)
+    parser.add_argument('--offline', action = 'store_true', help = 'Never \
+download tiles that aren\'t already cached.')
+    parser.add_argument('--seed', nargs = 3, metavar = ('PROVIDER',
+    'MIN_ZOOM', 'MAX_ZOOM'), help = 'Download the tiles covering the \
+contiguous US into the cache instead of running the server.')
+    args = parser.parse_args()
+
+    cache = TileCache(args.cache_folder, int(args.max_mb * 1024 ** 2))
+    if args.seed is not None:
+        provider, min_zoom, max_zoom = args.seed
+        print("Downloaded", seed_tiles(cache, provider,
+        zooms = range(int(min_zoom), int(max_zoom) + 1)), "tiles")
+    else:
+        server = TileServer(cache, offline = args.offline, port = args.port)
+        print("Serving tiles at", server.tile_url('<provider>'))
+        server.serve_forever()
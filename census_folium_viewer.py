@@ -20,17 +20,51 @@
 # Thank you, Amodiovalerio!
 
 import geopandas
+import shapely
 import folium
 from folium.plugins import FloatImage
 import pandas as pd
 import time
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 import numpy as np
 import json
-import matplotlib.pyplot as plt
-import matplotlib.patheffects as path_effects
+import base64
+import gzip
+import concurrent.futures
+import os
+import re
+import glob
+import hashlib
+import inspect
+import sys
+import tracemalloc
+import threading
+import urllib.parse
+import pathlib
 import branca.colormap as cm
+from branca.element import MacroElement, Template
+from census_folium_geometry import GeographyStore, write_geometry_store, \
+    MappedGeometryStore, SharedTable
+
+# The module's public functions and classes. The geometry storage classes
+# were originally defined within this module, so they're still exported
+# from here as well.
+__all__ = ['create_vertical_legend', 'StageTimer', 'compact_table',
+'prepare_zip_table', 'prepare_county_table', 'prepare_state_table',
+'prepare_tract_table', 'prepare_block_group_table',
+'prepare_partitioned_table', 'list_table_partitions',
+'iter_partitioned_table', 'read_partitioned_table', 'save_table',
+'load_table', 'PointLookup', 'TimeSeriesPanel', 'generate_map',
+'create_screenshot_driver', 'capture_screenshot', 'capture_screenshots',
+'optimize_screenshots', 'generate_maps', 'load_build_manifest',
+'rebuild_maps', 'old_generate_map', 'GeographyStore',
+'write_geometry_store', 'MappedGeometryStore', 'SharedTable']
+
+# Selenium, matplotlib, and Pillow are only imported within the functions
+# that use them (for screenshots, legends, and static images), since 
+# importing them takes a significant share of this module's import time.
+# Batch workers that only prepare tables or create .html maps therefore
+# don't need to load them. (See measure_import_time within 
+# census_folium_benchmarks.py.)
 
 def create_vertical_legend(bins, data_variable_text, map_name, path_to_legends, 
 color_list, variable_decimals):
@@ -39,6 +73,8 @@ color_list, variable_decimals):
     room for data labels than does the default horizontal legend. In addition,
     this legend should remain mostly readable against both dark
     and light backgrounds.'''
+    import matplotlib.pyplot as plt
+    import matplotlib.patheffects as path_effects
 
     y_axes_max = 4 # The highest length of the y axes
     bar_count = len(color_list) # The number of color bars that will be plotted
@@ -112,8 +148,207 @@ color_list, variable_decimals):
     # plt.show()
 
 
+class StageTimer:
+    '''This class records how long each stage of a function (e.g. reading
+    shape data, simplifying it, rendering a map, or saving it) takes, along
+    with the size of any files that the function writes. It's used within
+    generate_map and the prepare_*_table functions, but it can also be used
+    within your own code.
+
+    When the function finishes, the timer produces a record (a dictionary)
+    in the following format:
+    {'function': 'generate_map', 'label': 'state_median_hh_income_acs5_2021',
+    'started_at': '2023-01-01 12:00:00', 'total_seconds': 5.2,
+    'stages': [{'stage': 'Saving map', 'seconds': 1.3,
+    'peak_memory_bytes': 52428800}, ...],
+    'outputs': {'path/to/map.html': 2097152}, 'output_bytes': 2097152,
+    'peak_rss_bytes': 524288000}
+
+    Variables:
+
+    function_name: The name of the function being timed.
+
+    label: An optional label for the call (such as the map name).
+
+    verbose: Whether to print the name of each stage as it begins (as the
+    prepare_*_table functions and generate_map's debug option already did).
+
+    callback: An optional function that will be passed the record once
+    the timed function finishes.
+
+    log_path: An optional path to a .jsonl file. If provided, each record
+    will be appended to this file as a single line of JSON.
+
+    profile_memory: Whether to record the peak amount of memory allocated
+    by Python during each stage (via the tracemalloc module). This can slow
+    down the timed function considerably, so it's turned off by default.
+    peak_rss_bytes, which reflects the peak memory usage of the entire
+    process so far, is recorded regardless (on systems that support the 
+    resource module).
+    '''
+
+    def __init__(self, function_name, label = None, verbose = False,
+    callback = None, log_path = None, profile_memory = False):
+        self.verbose = verbose
+        self.callback = callback
+        self.log_path = log_path
+        self.profile_memory = profile_memory
+        self.record = {'function': function_name, 'label': label,
+        'started_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'stages': [],
+        'outputs': {}}
+        self._stage_name = None
+        self._start_time = time.perf_counter()
+        self._stop_tracemalloc = False
+        if self.profile_memory == True and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._stop_tracemalloc = True
+
+    def start_stage(self, stage_name):
+        '''Ends the current stage (if any) and begins a new one.'''
+        self._end_stage()
+        if self.verbose == True:
+            print(stage_name)
+        self._stage_name = stage_name.rstrip(':')
+        self._stage_start_time = time.perf_counter()
+        if self.profile_memory == True:
+            tracemalloc.reset_peak()
+
+    def _end_stage(self):
+        if self._stage_name is None:
+            return
+        stage_record = {'stage': self._stage_name, 
+        'seconds': time.perf_counter() - self._stage_start_time}
+        if self.profile_memory == True:
+            stage_record['peak_memory_bytes'] = tracemalloc.get_traced_memory(
+                )[1]
+        self.record['stages'].append(stage_record)
+        self._stage_name = None
+
+    def add_output(self, path):
+        '''Records the size of a file written by the timed function.'''
+        if os.path.exists(path):
+            self.record['outputs'][path] = os.path.getsize(path)
+
+    def finish(self):
+        '''Ends the final stage, completes the record, and passes it to the
+        callback and/or log file. The record is also returned.'''
+        self._end_stage()
+        self.record['total_seconds'] = time.perf_counter() - self._start_time
+        self.record['output_bytes'] = sum(self.record['outputs'].values())
+        try:
+            import resource
+            # ru_maxrss is reported in kilobytes on Linux and in bytes
+            # on macOS.
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.record['peak_rss_bytes'] = peak_rss if sys.platform == \
+                'darwin' else peak_rss * 1024
+        except ImportError: # The resource module isn't available on Windows.
+            self.record['peak_rss_bytes'] = None
+        if self._stop_tracemalloc == True:
+            tracemalloc.stop()
+        if self.log_path is not None:
+            with open(self.log_path, 'a') as file:
+                file.write(json.dumps(self.record) + '\n')
+        if self.callback is not None:
+            self.callback(self.record)
+        return self.record
+
+
+def compact_table(table, categorical_threshold = 0.5,
+float_tolerance = 1e-6, verbose = True):
+    '''Reduces the memory used by a prepared table by storing its columns
+    in smaller data types wherever this doesn't change the values that
+    maps display:
+
+    Float columns that only contain whole numbers (and no missing values)
+    are stored as 32-bit integers if they fit within that range.
+    Other float columns are stored as 32-bit floats if doing so changes
+    each value by no more than float_tolerance (relative to that value).
+    (Whole-number columns with missing values are only converted if all of
+    their values can be represented exactly as 32-bit floats.)
+
+    64-bit integer columns are stored as 32-bit integers if they fit
+    within that range.
+
+    Text columns in which the number of distinct values is less than
+    categorical_threshold times the number of rows (such as state codes
+    or names within county tables) are stored as categoricals.
+
+    The geometry column isn't modified. The table is modified in place and
+    returned along with a report of its memory usage (in bytes) before and
+    after compaction and the columns that were converted. generate_map
+    converts 32-bit columns back to 64-bit floats and integers before
+    multiplying and rounding them, so compaction doesn't affect the maps'
+    bins or the precision of their tooltips. (Whole-number columns stored
+    as integers will appear as e.g. 5 rather than 5.0.)'''
+    memory_before = int(table.memory_usage(deep = True).sum())
+    int32_range = np.iinfo(np.int32)
+    geometry_column = table.geometry.name if isinstance(
+        table, geopandas.GeoDataFrame) else None
+    converted_columns = {}
+    for column in table.columns:
+        values = table[column]
+        # Text columns may be stored as NumPy object columns or (as is the
+        # default within pandas 3) as pandas string columns, so both are
+        # checked before extension types are skipped.
+        is_text = pd.api.types.is_string_dtype(values.dtype) and not \
+            isinstance(values.dtype, pd.CategoricalDtype)
+        # Geometry, categorical, and other nullable (extension) columns are
+        # left as they are.
+        if column == geometry_column or not (is_text or isinstance(
+            values.dtype, np.dtype)):
+            continue
+        kind = values.dtype.kind
+        new_dtype = None
+        if kind == 'f':
+            array = values.to_numpy()
+            finite_values = array[np.isfinite(array)]
+            whole_numbers = np.array_equal(finite_values,
+            np.round(finite_values))
+            in_int32_range = len(finite_values) > 0 and (
+                finite_values.min() >= int32_range.min) and (
+                finite_values.max() <= int32_range.max)
+            if whole_numbers and in_int32_range and len(
+                finite_values) == len(array):
+                new_dtype = 'int32'
+            elif whole_numbers:
+                # Every integer up to 2^24 can be stored exactly as a
+                # 32-bit float.
+                if len(finite_values) == 0 or np.abs(
+                    finite_values).max() <= 2 ** 24:
+                    new_dtype = 'float32'
+            else:
+                compacted_values = finite_values.astype('float32').astype(
+                    'float64')
+                if np.all(np.abs(compacted_values - finite_values) <=
+                float_tolerance * np.abs(finite_values)):
+                    new_dtype = 'float32'
+        elif kind in 'iu' and values.dtype.itemsize > 4:
+            if len(values) > 0 and values.min() >= int32_range.min and (
+                values.max() <= int32_range.max):
+                new_dtype = 'int32'
+        elif is_text and len(values) > 0:
+            if pd.api.types.infer_dtype(values, skipna = True) == 'string' \
+            and values.nunique() < categorical_threshold * len(values):
+                new_dtype = 'category'
+        if new_dtype is not None:
+            table[column] = values.astype(new_dtype)
+            converted_columns[column] = str(values.dtype)+' -> '+new_dtype
+    memory_after = int(table.memory_usage(deep = True).sum())
+    report = {'memory_before_bytes': memory_before,
+    'memory_after_bytes': memory_after,
+    'converted_columns': converted_columns}
+    if verbose == True:
+        print("Compacted", len(converted_columns), "columns; memory usage \
+went from", round(memory_before / 1024 ** 2, 1), "MB to",
+        round(memory_after / 1024 ** 2, 1), "MB.")
+    return table, report
+
+
 def prepare_zip_table(shapefile_path, shape_feature_name, 
-data_path, data_feature_name, tolerance = 0.005, dropna_geometry = True):
+data_path, data_feature_name, tolerance = 0.005, dropna_geometry = True,
+stats_callback = None, stats_log_path = None, profile_memory = False,
+compact_dtypes = False):
     '''This function merges US Census zip code shapefile data with
     Census zip-code-level demographic data in order to create a DataFrame 
     that can be used to generate choropleth maps.
@@ -145,9 +380,28 @@ data_path, data_feature_name, tolerance = 0.005, dropna_geometry = True):
     column. This helps avoid 'NoneType' errors when producing maps. It 
     requires the geometry column to be named 'geometry.'
 
+    stats_callback, stats_log_path, and profile_memory: Optional settings
+    for recording the time (and, if profile_memory is True, the memory)
+    used by each stage of this function. stats_callback is a function that
+    will be passed the resulting record, and stats_log_path is a .jsonl file
+    to which the record will be appended. See StageTimer for details.
+
+    compact_dtypes: Whether to store the table's columns in smaller data
+    types (e.g. 32-bit floats and categoricals) via compact_table. This
+    can greatly reduce the memory used by large tables, such as the zip
+    code table. The table's memory usage before and after compaction is
+    printed and added to the stats record as 'compaction'.
+
+    This function processes the entire shapefile at once. If that requires
+    too much memory, prepare_partitioned_table can prepare the same table
+    in chunks (and in parallel).
+
     '''
 
-    print("Reading shape data:")
+    timer = StageTimer('prepare_zip_table', label = data_path, 
+    verbose = True, callback = stats_callback, log_path = stats_log_path, 
+    profile_memory = profile_memory)
+    timer.start_stage("Reading shape data:")
     shape_data = geopandas.read_file(shapefile_path)
     shape_data[shape_feature_name] = shape_data[
         shape_feature_name].astype(str).str.pad(5, fillchar = '0')
@@ -166,10 +420,10 @@ data_path, data_feature_name, tolerance = 0.005, dropna_geometry = True):
     # https://geopandas.org/en/stable/docs/reference/api/geopandas.GeoSeries.simplify.html
     # and (for more detail)
     # https://shapely.readthedocs.io/en/latest/manual.html#object.simplify .
-    print("Simplifying shape data:") # This can take a little while
+    timer.start_stage("Simplifying shape data:") # This can take a little while
     shape_data['geometry'] = shape_data.simplify(tolerance = tolerance)
     # The function next imports census data.
-    print("Reading census data:")
+    timer.start_stage("Reading census data:")
     census_data = pd.read_csv(data_path)
     census_data[data_feature_name] = census_data[data_feature_name].astype(
         str).str.pad(5, fillchar = '0')
@@ -179,7 +433,7 @@ data_path, data_feature_name, tolerance = 0.005, dropna_geometry = True):
     # will help with the merging process. (str.zfill(5) would also work.)
     # Next, to make it easier to create choropleth maps, the function merges
     # the shapefile and census data tables.
-    print("Merging shape and data tables:")
+    timer.start_stage("Merging shape and data tables:")
     merged_shape_data_table = pd.merge(shape_data, census_data, 
     left_on = shape_feature_name, right_on = data_feature_name, how = 'outer')
 
@@ -190,11 +444,17 @@ data_path, data_feature_name, tolerance = 0.005, dropna_geometry = True):
 
     if dropna_geometry == True:
         merged_shape_data_table.dropna(subset = 'geometry', inplace = True)
+    if compact_dtypes == True:
+        timer.start_stage("Compacting data types:")
+        merged_shape_data_table, timer.record['compaction'] = compact_table(
+            merged_shape_data_table)
+    timer.finish()
     return merged_shape_data_table
 
 def prepare_county_table(shapefile_path, shape_state_code_column, 
 shape_county_code_column, tolerance, data_path, data_state_code_column, 
-data_county_code_column, dropna_geometry = True):
+data_county_code_column, dropna_geometry = True, stats_callback = None,
+stats_log_path = None, profile_memory = False, compact_dtypes = False):
     '''This function merges US Census county shapefile data with
     Census county-level demographic data in order to create a DataFrame 
     that can be used to generate choropleth maps.
@@ -209,7 +469,10 @@ data_county_code_column, dropna_geometry = True):
     See the documentation for prepare_zip_table for more information on
     this function.'''
 
-    print("Reading shape data:")
+    timer = StageTimer('prepare_county_table', label = data_path, 
+    verbose = True, callback = stats_callback, log_path = stats_log_path, 
+    profile_memory = profile_memory)
+    timer.start_stage("Reading shape data:")
     shape_data = geopandas.read_file(shapefile_path)
     # The merge process for county-level data is based on state and county
     # codes because the 'NAME' value for the data and shape DataFrames
@@ -228,45 +491,1415 @@ data_county_code_column, dropna_geometry = True):
         shape_state_code_column].astype(int)
     shape_data[shape_county_code_column] = shape_data[
         shape_county_code_column].astype(int)
-    print("Simplifying shape data:") 
+    timer.start_stage("Simplifying shape data:") 
     shape_data['geometry'] = shape_data.simplify(tolerance = tolerance)
-    print("Reading census data:")
+    timer.start_stage("Reading census data:")
     census_data = pd.read_csv(data_path)
     census_data[data_state_code_column] = census_data[
         data_state_code_column].astype(int)
     census_data[data_county_code_column] = census_data[
         data_county_code_column].astype(int)
-    print("Merging shape and data tables:")
+    timer.start_stage("Merging shape and data tables:")
     merged_shape_data_table = pd.merge(shape_data, census_data, left_on = [
         shape_state_code_column, shape_county_code_column], right_on = [
             data_state_code_column, data_county_code_column], how = 'outer')
     if dropna_geometry == True:
         merged_shape_data_table.dropna(subset = 'geometry', inplace = True)
+    if compact_dtypes == True:
+        timer.start_stage("Compacting data types:")
+        merged_shape_data_table, timer.record['compaction'] = compact_table(
+            merged_shape_data_table)
+    timer.finish()
     return merged_shape_data_table
 
 
 def prepare_state_table(shapefile_path, shape_feature_name, tolerance,
-data_path, data_feature_name, dropna_geometry = True):
+data_path, data_feature_name, dropna_geometry = True, stats_callback = None,
+stats_log_path = None, profile_memory = False, compact_dtypes = False):
     '''This function merges US Census state shapefile data with
     Census state-level demographic data in order to create a DataFrame 
     that can be used to generate choropleth maps.
 
     See the documentation for prepare_zip_table for more information on
     this function.'''
-    print("Reading shape data:")
+    timer = StageTimer('prepare_state_table', label = data_path, 
+    verbose = True, callback = stats_callback, log_path = stats_log_path, 
+    profile_memory = profile_memory)
+    timer.start_stage("Reading shape data:")
     shape_data = geopandas.read_file(shapefile_path)
-    print("Simplifying shape data:")
+    timer.start_stage("Simplifying shape data:")
     shape_data['geometry'] = shape_data.simplify(tolerance = tolerance)
-    print("Reading census data:")
+    timer.start_stage("Reading census data:")
     census_data = pd.read_csv(data_path)
-    print("Merging shape and data tables:")
+    timer.start_stage("Merging shape and data tables:")
     merged_shape_data_table = pd.merge(shape_data, census_data, 
     left_on = shape_feature_name, right_on = data_feature_name, how = 'outer')
     if dropna_geometry == True:
         merged_shape_data_table.dropna(subset = 'geometry', inplace = True)
+    if compact_dtypes == True:
+        timer.start_stage("Compacting data types:")
+        merged_shape_data_table, timer.record['compaction'] = compact_table(
+            merged_shape_data_table)
+    timer.finish()
     return merged_shape_data_table
 
 
+def _prepare_partition(shapefile_path, data_table, geoid_column, tolerance,
+dropna_geometry, output_folder):
+    '''Reads, simplifies, and merges a single partition (e.g. the tract
+    shapefile for one state), then writes it to output_folder. This
+    function is run within worker processes by _prepare_partitioned_table.
+    Returns the partition's path and row count, or (None, 0) if the 
+    partition contains no shapes.'''
+    shape_data = geopandas.read_file(shapefile_path)
+    shape_data['geometry'] = shape_data.simplify(tolerance = tolerance)
+    merged_shape_data_table = pd.merge(shape_data, data_table,
+    left_on = geoid_column, right_on = 'DATA_GEOID', how = 'outer')
+    if dropna_geometry == True:
+        merged_shape_data_table.dropna(subset = 'geometry', inplace = True)
+    # Each partition is named after the state it contains (e.g. 51.parquet
+    # for Virginia). Shapefiles without any shapes (and therefore without
+    # a state code) are skipped.
+    state_codes = merged_shape_data_table['STATEFP'].dropna()
+    if len(state_codes) == 0:
+        return None, 0
+    partition_name = state_codes.iloc[0]
+    partition_path = os.path.join(output_folder, partition_name+'.parquet')
+    merged_shape_data_table.to_parquet(partition_path)
+    return partition_path, len(merged_shape_data_table)
+
+
+def _clear_partition_folder(output_folder, extensions = ('.parquet', 
+'.piece')):
+    '''Deletes the partitions (and pieces of partitions) within 
+    output_folder, so that files left by an earlier or failed run aren't
+    mistaken for part of the table being prepared.'''
+    for extension in extensions:
+        for path in glob.glob(os.path.join(output_folder, '*'+extension)):
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def _read_census_data_with_geoid(data_path, code_columns):
+    '''Reads a .csv file of census data and adds a DATA_GEOID column that
+    combines its code columns (e.g. {'state': 2, 'county': 3}), each padded
+    with leading zeros to the given width, so that it matches the GEOID
+    column within the TIGER shapefiles.'''
+    census_data = pd.read_csv(data_path, dtype = {
+        column: str for column in code_columns})
+    census_data['DATA_GEOID'] = ''
+    for column, width in code_columns.items():
+        census_data['DATA_GEOID'] += census_data[column].str.zfill(width)
+    return census_data
+
+
+def _prepare_partitioned_table(shapefile_paths, data_path, output_folder,
+code_columns, geoid_column, tolerance, dropna_geometry, max_workers, 
+timer):
+    '''Prepares a table whose shapes are stored in one shapefile per state
+    (as is the case for the Census' tract and block group shapefiles). See
+    prepare_tract_table for more information.'''
+    if isinstance(shapefile_paths, str):
+        shapefile_paths = sorted(glob.glob(shapefile_paths))
+    if len(shapefile_paths) == 0:
+        raise ValueError('Error: no shapefiles were found.')
+    os.makedirs(output_folder, exist_ok = True)
+    _clear_partition_folder(output_folder)
+
+    timer.start_stage("Reading census data:")
+    # The census data is read only once, then split by state so that each
+    # worker only receives the rows it needs.
+    census_data = _read_census_data_with_geoid(data_path, code_columns)
+    state_column = list(code_columns.keys())[0]
+    census_data_by_state = {state: table for state, table in
+    census_data.groupby(census_data[state_column].str.zfill(2))}
+
+    timer.start_stage("Preparing partitions:")
+    # Each state's shapefile is processed as a separate chunk within a pool
+    # of worker processes, so only a few states' shapes are held in memory
+    # at any given time. The state code within each TIGER file name
+    # (e.g. tl_2021_51_tract.shp) is used to select that state's data.
+    partition_paths = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers = max_workers) as executor:
+        futures = []
+        for shapefile_path in shapefile_paths:
+            state_match = re.search(r'_(\d{2})_', os.path.basename(
+                shapefile_path))
+            data_table = census_data_by_state.get(
+                state_match.group(1) if state_match else None,
+                census_data.iloc[0:0])
+            futures.append(executor.submit(_prepare_partition, 
+            shapefile_path, data_table, geoid_column, tolerance,
+            dropna_geometry, output_folder))
+        for completed_count, future in enumerate(
+            concurrent.futures.as_completed(futures)):
+            partition_path, row_count = future.result()
+            if partition_path is None:
+                print(f"Skipped a shapefile without any shapes \
+({completed_count + 1} of {len(futures)} shapefiles)")
+                continue
+            partition_paths.append(partition_path)
+            print(f"Wrote {row_count} rows to {partition_path} \
+({completed_count + 1} of {len(futures)} shapefiles)")
+            timer.add_output(partition_path)
+    timer.finish()
+    return output_folder
+
+
+def prepare_tract_table(shapefile_paths, data_path, output_folder,
+tolerance = 0.001, data_state_code_column = 'state', 
+data_county_code_column = 'county', data_tract_code_column = 'tract',
+dropna_geometry = True, max_workers = None, stats_callback = None,
+stats_log_path = None, profile_memory = False):
+    '''This function merges US Census tract shapefile data with Census
+    tract-level demographic data. Since there are roughly 85,000 tracts in
+    the US, the Census stores their shapes within one shapefile per state.
+    This function processes those shapefiles in parallel (one state at a
+    time per worker process) and writes each merged state to its own
+    GeoParquet file within output_folder. This keeps memory usage much
+    lower than merging the entire country at once.
+
+    Variables:
+
+    shapefile_paths: Either a list of paths to the per-state .shp files or
+    a glob pattern that matches them (e.g. 
+    'C:/Users/kburc/Downloads/tracts/tl_2021_*_tract.shp').
+
+    data_path: The path to a .csv file containing tract-level US Census data
+    for one or more states.
+
+    output_folder: The folder in which the partitions (e.g. 51.parquet)
+    will be saved. Any partitions already within this folder (e.g. from an
+    earlier run) are deleted first.
+
+    data_state_code_column, data_county_code_column, and 
+    data_tract_code_column: The columns within the .csv file that store the
+    state, county, and tract codes. These will be combined into a GEOID
+    that matches the GEOID column within the shapefiles.
+
+    max_workers: The number of worker processes to use. If None, one
+    worker per CPU core will be used.
+
+    See the documentation for prepare_zip_table for more information on
+    the remaining variables.
+
+    The function returns output_folder, which can be passed to generate_map
+    (as merged_data_table) or to read_partitioned_table.'''
+    timer = StageTimer('prepare_tract_table', label = data_path, 
+    verbose = True, callback = stats_callback, log_path = stats_log_path, 
+    profile_memory = profile_memory)
+    return _prepare_partitioned_table(shapefile_paths, data_path,
+    output_folder, code_columns = {data_state_code_column: 2, 
+    data_county_code_column: 3, data_tract_code_column: 6},
+    geoid_column = 'GEOID', tolerance = tolerance,
+    dropna_geometry = dropna_geometry, max_workers = max_workers,
+    timer = timer)
+
+
+def prepare_block_group_table(shapefile_paths, data_path, output_folder,
+tolerance = 0.0005, data_state_code_column = 'state', 
+data_county_code_column = 'county', data_tract_code_column = 'tract',
+data_block_group_code_column = 'block group', dropna_geometry = True,
+max_workers = None, stats_callback = None, stats_log_path = None,
+profile_memory = False):
+    '''This function merges US Census block group shapefile data
+    (e.g. tl_2021_51_bg.shp) with Census block-group-level demographic data.
+    There are roughly 240,000 block groups in the US, so, as with
+    prepare_tract_table, each state is processed separately (and in
+    parallel) and written to its own GeoParquet file within output_folder.
+
+    data_block_group_code_column: The column within the .csv file that
+    stores the block group code (a single digit).
+
+    See the documentation for prepare_tract_table for more information
+    on this function.'''
+    timer = StageTimer('prepare_block_group_table', label = data_path, 
+    verbose = True, callback = stats_callback, log_path = stats_log_path, 
+    profile_memory = profile_memory)
+    return _prepare_partitioned_table(shapefile_paths, data_path,
+    output_folder, code_columns = {data_state_code_column: 2, 
+    data_county_code_column: 3, data_tract_code_column: 6,
+    data_block_group_code_column: 1}, geoid_column = 'GEOID', 
+    tolerance = tolerance, dropna_geometry = dropna_geometry, 
+    max_workers = max_workers, timer = timer)
+
+
+def _count_features(shapefile_path):
+    '''Returns the number of shapes within a shapefile without reading
+    them.'''
+    try:
+        import pyogrio
+        return pyogrio.read_info(shapefile_path)['features']
+    except ImportError: # Older versions of geopandas use fiona instead.
+        import fiona
+        with fiona.open(shapefile_path) as collection:
+            return len(collection)
+
+
+def _prepare_chunk(shapefile_path, rows, shape_key_column, key_width,
+data_table, tolerance, partition_column, grid_size, output_folder, 
+chunk_number):
+    '''Reads, simplifies, and merges a single chunk of rows from a
+    shapefile, then splits the result into partitions and writes each
+    partition's piece of the chunk to output_folder. This function is run
+    within worker processes by prepare_partitioned_table. Returns the
+    partition name and path of each piece.'''
+    shape_data = geopandas.read_file(shapefile_path, rows = slice(*rows))
+    if key_width is not None:
+        shape_data[shape_key_column] = shape_data[shape_key_column].astype(
+            str).str.zfill(key_width)
+    shape_data['geometry'] = shape_data.simplify(tolerance = tolerance)
+    # A left join on the shapes is equivalent to the outer join (followed by
+    # the removal of rows without shapes) used by the other prepare 
+    # functions.
+    merged_shape_data_table = pd.merge(shape_data, data_table,
+    left_on = shape_key_column, right_on = 'DATA_GEOID', how = 'left')
+    merged_shape_data_table.dropna(subset = 'geometry', inplace = True)
+
+    if partition_column is not None:
+        partition_names = merged_shape_data_table[partition_column].astype(
+            str)
+    else:
+        # Each shape is assigned to the grid cell that contains a point
+        # within it, so shapes that cross cell boundaries still belong to
+        # a single partition.
+        points = shapely.point_on_surface(np.asarray(
+            merged_shape_data_table.geometry.values))
+        # (Empty shapes, which have no such point, are placed in cell -1.)
+        cell_x = np.nan_to_num(np.floor((shapely.get_x(points) + 180) / 
+        grid_size), nan = -1)
+        cell_y = np.nan_to_num(np.floor((shapely.get_y(points) + 90) / 
+        grid_size), nan = -1)
+        partition_names = pd.Series(['grid_'+str(int(x)).zfill(3)+'_'+
+        str(int(y)).zfill(3) for x, y in zip(cell_x, cell_y)],
+        index = merged_shape_data_table.index)
+
+    pieces = []
+    for partition_name, partition in merged_shape_data_table.groupby(
+        partition_names):
+        # Pieces don't use the .parquet extension, so they're never
+        # mistaken for finished partitions.
+        piece_path = os.path.join(output_folder, partition_name+'.'+
+        str(chunk_number).zfill(5)+'.piece')
+        partition.to_parquet(piece_path)
+        pieces.append((partition_name, piece_path))
+    return pieces
+
+
+def _combine_pieces(partition_name, piece_paths, output_folder):
+    '''Combines the pieces of a partition (one from each chunk that 
+    contained its shapes) into a single file, then deletes the pieces.
+    Returns the partition's path and row count.'''
+    partition = pd.concat([geopandas.read_parquet(piece_path) 
+    for piece_path in sorted(piece_paths)], ignore_index = True)
+    partition_path = os.path.join(output_folder, partition_name+'.parquet')
+    partition.to_parquet(partition_path)
+    for piece_path in piece_paths:
+        os.remove(piece_path)
+    return partition_path, len(partition)
+
+
+def prepare_partitioned_table(shapefile_path, data_path, output_folder,
+shape_key_column, data_key_columns, key_width = None, tolerance = 0.005,
+partition_column = None, grid_size = 5, chunk_size = 5000, 
+max_workers = None, stats_callback = None, stats_log_path = None, 
+profile_memory = False):
+    '''This function prepares a national shapefile (such as the zip code
+    or county shapefiles used by prepare_zip_table and prepare_county_table)
+    in chunks rather than all at once. prepare_zip_table holds the entire
+    shapefile, its simplified copy, and the merged table in memory at the
+    same time; this function instead reads, simplifies, and merges 
+    chunk_size shapes at a time (within a pool of max_workers worker
+    processes), so its peak memory usage depends on chunk_size rather than
+    on the number of shapes within the shapefile.
+
+    The merged shapes are written to output_folder as partitions (one 
+    GeoParquet file per state or per grid cell). In a second step, the
+    pieces of each partition produced by different chunks are combined
+    (again in parallel), so only one partition per worker is held in memory
+    at a time.
+
+    Variables:
+
+    shapefile_path: The path to the national .shp file.
+
+    data_path: The path to the .csv file containing US Census data.
+
+    output_folder: The folder in which the partitions will be saved.
+
+    shape_key_column: The column within the shapefile that will be used to
+    merge the shapes with the census data (e.g. 'ZCTA5CE20' for zip codes
+    or 'GEOID' for counties).
+
+    data_key_columns: The column (or columns) within the .csv file that
+    will be matched with shape_key_column. For zip codes, this is a single
+    column name (e.g. 'NAME'). Multiple code columns can be passed as a
+    dictionary of column names and widths, e.g. {'state': 2, 'county': 3}
+    for counties; these will be combined into a GEOID (e.g. '51059').
+
+    key_width: For a single data key column, the number of digits to which
+    both key columns will be padded with leading zeros (e.g. 5 for zip
+    codes). 
+
+    tolerance: See prepare_zip_table.
+
+    partition_column: A column within the shapefile by which to partition
+    the output (e.g. 'STATEFP', which produces partitions such as 
+    06.parquet that generate_map's states argument can select). If this is
+    None (e.g. for zip codes, whose shapefile doesn't include state codes),
+    the shapes are instead partitioned into a grid of grid_size-degree
+    cells (e.g. grid_017_025.parquet).
+
+    Rows within the census data that don't match any shape are not included
+    in the output. Any partitions already within output_folder (e.g. from
+    an earlier run) are deleted before the new ones are written.
+
+    The function returns output_folder, which can be passed to generate_map
+    (as merged_data_table) or to read_partitioned_table.'''
+    timer = StageTimer('prepare_partitioned_table', label = data_path,
+    verbose = True, callback = stats_callback, log_path = stats_log_path,
+    profile_memory = profile_memory)
+    os.makedirs(output_folder, exist_ok = True)
+    _clear_partition_folder(output_folder)
+
+    timer.start_stage("Reading census data:")
+    if isinstance(data_key_columns, dict):
+        data_table = _read_census_data_with_geoid(data_path, 
+        data_key_columns)
+    else:
+        data_table = pd.read_csv(data_path, dtype = {data_key_columns: str})
+        data_table['DATA_GEOID'] = data_table[data_key_columns]
+        if key_width is not None:
+            data_table['DATA_GEOID'] = data_table['DATA_GEOID'].str.zfill(
+                key_width)
+
+    timer.start_stage("Preparing chunks:")
+    feature_count = _count_features(shapefile_path)
+    chunks = [(start, min(start + chunk_size, feature_count)) 
+    for start in range(0, feature_count, chunk_size)]
+    pieces = {}
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers = max_workers) as executor:
+            try:
+                # The (comparatively small) census data table is sent to 
+                # every worker along with its chunk.
+                futures = [executor.submit(_prepare_chunk, shapefile_path,
+                rows, shape_key_column, key_width if not isinstance(
+                    data_key_columns, dict) else None, data_table, 
+                tolerance, partition_column, grid_size, output_folder,
+                chunk_number) for chunk_number, rows in enumerate(chunks)]
+                for completed_count, future in enumerate(
+                    concurrent.futures.as_completed(futures)):
+                    for partition_name, piece_path in future.result():
+                        pieces.setdefault(partition_name, []).append(
+                            piece_path)
+                    print(f"Prepared {completed_count + 1} of \
+{len(chunks)} chunks")
+
+                timer.start_stage("Combining partitions:")
+                futures = [executor.submit(_combine_pieces, partition_name,
+                piece_paths, output_folder) for partition_name, piece_paths
+                in pieces.items()]
+                for future in concurrent.futures.as_completed(futures):
+                    partition_path, row_count = future.result()
+                    print(f"Wrote {row_count} rows to {partition_path}")
+                    timer.add_output(partition_path)
+            except BaseException:
+                # If a chunk fails, the chunks that haven't started yet
+                # are cancelled rather than run to completion.
+                executor.shutdown(cancel_futures = True)
+                raise
+    finally:
+        # Pieces are deleted as they're combined, so any that remain at
+        # this point were left behind by a failed chunk or combination.
+        _clear_partition_folder(output_folder, extensions = ('.piece',))
+    timer.finish()
+    return output_folder
+
+
+def list_table_partitions(partition_folder, partitions = None):
+    '''Returns the paths to the partitions within a folder created by
+    prepare_tract_table, prepare_block_group_table, or 
+    prepare_partitioned_table. partitions can be
+    a list of state codes (e.g. ['51', '24']) to return only those states.'''
+    partition_paths = sorted(glob.glob(os.path.join(partition_folder,
+    '*.parquet')))
+    if partitions is not None:
+        partition_paths = [path for path in partition_paths if 
+        os.path.basename(path).replace('.parquet', '') in partitions]
+    return partition_paths
+
+
+def iter_partitioned_table(partition_folder, partitions = None,
+columns = None):
+    '''Yields the partitions within partition_folder one at a time as
+    GeoDataFrames. columns can be used to read only certain columns 
+    (which should include 'geometry' if the shapes are needed).'''
+    for partition_path in list_table_partitions(partition_folder, 
+    partitions):
+        if (columns is not None) and ('geometry' not in columns):
+            yield pd.read_parquet(partition_path, columns = columns)
+        else:
+            yield geopandas.read_parquet(partition_path, columns = columns)
+
+
+def read_partitioned_table(partition_folder, partitions = None,
+columns = None):
+    '''Combines the partitions within partition_folder into a single
+    table. See iter_partitioned_table for more details.'''
+    return pd.concat(list(iter_partitioned_table(partition_folder,
+    partitions = partitions, columns = columns)), ignore_index = True)
+
+
+def save_table(table, path, compression = 'zstd'):
+    '''Saves a prepared table (e.g. one returned by prepare_zip_table) as a
+    GeoParquet file. This is much faster to write and read than the
+    .geojson files used within the tutorial notebooks, and the resulting
+    file is far smaller, since its columns are stored in binary form and
+    compressed. (Any categorical or 32-bit columns created by compact_table
+    are preserved.) Returns path.
+
+    compression: The Parquet compression codec ('zstd', 'snappy', 'gzip',
+    or None).'''
+    table.to_parquet(path, compression = compression)
+    return path
+
+
+def load_table(path, columns = None):
+    '''Loads a table saved by save_table. Since Parquet files store each
+    column separately, columns can be used to read only the columns that
+    a map needs (e.g. ['NAME', 'Median_household_income', 'geometry']),
+    which saves both time and memory. If 'geometry' isn't included within
+    columns, a DataFrame (rather than a GeoDataFrame) is returned.
+
+    Files in other formats (such as .geojson files) are read via
+    geopandas.read_file, then limited to columns.'''
+    if not path.endswith('.parquet'):
+        table = geopandas.read_file(path)
+        return table if columns is None else table[columns]
+    if (columns is not None) and ('geometry' not in columns):
+        return pd.read_parquet(path, columns = columns)
+    return geopandas.read_parquet(path, columns = columns)
+
+
+class PointLookup:
+    '''This class assigns points (such as customer addresses or facility
+    locations) to the shapes within a prepared table (e.g. the zip code
+    or county tables created by prepare_zip_table and prepare_county_table),
+    then counts or sums them by shape so that they can be mapped via
+    generate_map.
+
+    The lookups use a spatial index (an STRtree) that is built the first
+    time it's needed and then reused for every subsequent batch of points.
+    Points are processed in vectorized batches, so millions of points can
+    be assigned without looping over them in Python.
+
+    Variables:
+
+    merged_data_table: The GeoDataFrame containing the shapes.
+
+    key_column: The column within merged_data_table that uniquely identifies
+    each shape (e.g. 'ZCTA5CE20' or 'GEOID').
+
+    Longitudes and latitudes should use the same coordinate reference system
+    as merged_data_table (NAD83 for the Census shapefiles, which is close
+    enough to WGS84/GPS coordinates for these purposes).
+
+    Example:
+    lookup = PointLookup(zip_and_census_table, 'ZCTA5CE20')
+    customer_counts = lookup.count(customers['lon'], customers['lat'],
+    column_name = 'customer_count')
+    store.attach(customer_counts, key_column = 'ZCTA5CE20')
+    '''
+
+    def __init__(self, merged_data_table, key_column):
+        table = merged_data_table.dropna(subset = 'geometry')
+        self.key_column = key_column
+        self.keys = table[key_column].to_numpy()
+        self.geometry = np.asarray(table.geometry.values)
+        self._tree = None
+
+    @property
+    def tree(self):
+        '''The STRtree for the table's shapes (built on first use).'''
+        if self._tree is None:
+            # Preparing the shapes speeds up the point-in-polygon tests that
+            # follow each STRtree query.
+            shapely.prepare(self.geometry)
+            self._tree = shapely.STRtree(self.geometry)
+        return self._tree
+
+    def assign_positions(self, longitudes, latitudes, batch_size = 1000000):
+        '''Returns, for each point, the position (within the table) of the
+        shape that contains it, or -1 if no shape contains it. Points that
+        fall exactly on a border between two shapes are assigned to the 
+        first of those shapes (in table order).'''
+        longitudes = np.asarray(longitudes, dtype = 'float64')
+        latitudes = np.asarray(latitudes, dtype = 'float64')
+        positions = np.full(len(longitudes), -1, dtype = 'int64')
+        for start in range(0, len(longitudes), batch_size):
+            end = start + batch_size
+            points = shapely.points(longitudes[start:end], 
+            latitudes[start:end])
+            # query() returns two arrays: the positions of the points and
+            # the positions of the shapes that they intersect. ('within'
+            # would exclude points on a shape's boundary.)
+            point_positions, shape_positions = self.tree.query(points,
+            predicate = 'intersects')
+            # The matches are sorted by point and then by shape so that
+            # the first match for each point is its first shape.
+            order = np.lexsort((shape_positions, point_positions))
+            point_positions = point_positions[order]
+            shape_positions = shape_positions[order]
+            point_positions, first_matches = np.unique(point_positions, 
+            return_index = True)
+            positions[start + point_positions] = shape_positions[
+                first_matches]
+        return positions
+
+    def assign(self, longitudes, latitudes, batch_size = 1000000):
+        '''Returns the key (e.g. the zip code) of the shape that contains
+        each point, or None for points outside every shape.'''
+        positions = self.assign_positions(longitudes, latitudes, 
+        batch_size = batch_size)
+        keys = self.keys.astype(object)[positions]
+        keys[positions == -1] = None
+        return keys
+
+    def count(self, longitudes, latitudes, weights = None, 
+    column_name = 'point_count', batch_size = 1000000):
+        '''Counts the points within each shape (or, if weights is provided,
+        sums the weights of those points). Returns a DataFrame with one
+        row per shape, containing the key column and column_name, which
+        can be attached to a GeographyStore or merged into the table and
+        passed to generate_map. Shapes without any points receive 0.'''
+        positions = self.assign_positions(longitudes, latitudes, 
+        batch_size = batch_size)
+        matched = positions != -1
+        if weights is not None:
+            weights = np.asarray(weights, dtype = 'float64')[matched]
+        totals = np.bincount(positions[matched], weights = weights,
+        minlength = len(self.keys))
+        return pd.DataFrame({self.key_column: self.keys,
+        column_name: totals})
+
+
+class TimeSeriesPanel:
+    '''This class stores multiple years of Census data for a single geography
+    level (states, counties, or zip codes) within a geography x year x
+    variable panel. Each variable (e.g. 'acs5_population' or
+    'acs5_median_home_val') is stored as a 2D NumPy array with one row per
+    geography and one column per year; missing values are stored as NaN.
+
+    This allows period-over-period change columns to be calculated for any
+    pair of years without hand-merging multiple .csv files and renaming
+    their columns. Geographies are identified by a GEOID string that
+    matches the GEOID columns within the Census TIGER shapefiles:
+    a 2-digit state code for states, a 5-digit state + county code for
+    counties, and a 5-digit zip code for ZCTAs.
+
+    Example:
+    county_panel = TimeSeriesPanel.from_csv_files('county')
+    county_growth = county_panel.change_table(
+        [('acs5_population', 2016, 2021), ('census_population', 2000, 2020)])
+    '''
+
+    # The following patterns identify the survey and geography of each
+    # file name (e.g. 'acs5_county_pop_2011_2016_2021.csv'), and the variable
+    # and year of each column name (e.g. 'population_2016'). Change columns
+    # stored within the .csv files (e.g. '2016_to_2021_population_chg')
+    # don't match the column pattern, since the panel recalculates them.
+    file_pattern = re.compile(r'^(acs1|acs5|census)_(state|county|zip)_')
+    column_pattern = re.compile(r'^([A-Za-z][A-Za-z_]*)_(\d{4})$')
+
+    def __init__(self, geoids, years, values, names = None):
+        self.geoids = pd.Index(geoids, name = 'GEOID')
+        self.years = np.asarray(years)
+        self.values = values
+        self.names = names
+
+    @staticmethod
+    def _create_geoids(df, geography):
+        '''Converts the state, county, and/or zip code columns found within
+        the Census .csv files into GEOID strings.'''
+        if geography == 'state':
+            return df['state'].str.zfill(2)
+        elif geography == 'county':
+            return df['state'].str.zfill(2) + df['county'].str.zfill(3)
+        elif geography == 'zip':
+            return df['NAME'].str.zfill(5)
+        raise ValueError('Error: geography should be \'state\', \'county\', \
+or \'zip\'.')
+
+    @classmethod
+    def from_csv_files(cls, geography, data_folder = 'census_data',
+    file_paths = None):
+        '''Reads every population and home value .csv file for the
+        specified geography (e.g. census_data/acs5_county_pop_2011_2016_2021.csv
+        and census_data/census_county_population_2000_to_2020.csv) into
+        a single panel. Each file is read only once.
+
+        geography: 'state', 'county', or 'zip'.
+
+        data_folder: The folder containing the .csv files.
+
+        file_paths: An optional list of specific files to read. If this
+        value is None, all matching files within data_folder will be read.
+
+        When multiple files contain the same survey, variable, and year,
+        the value from the file whose name sorts last (which generally
+        corresponds to the most recent download) takes precedence.'''
+        if file_paths is None:
+            file_paths = []
+            for pattern in ['*_pop_*.csv', '*_population_*.csv',
+            '*_home_val_*.csv']:
+                file_paths.extend(glob.glob(os.path.join(
+                    data_folder, pattern)))
+        file_paths = sorted(set(file_paths), reverse = True)
+
+        # Each file is first read into a (geoid, {(variable, year): values})
+        # pair. The panel's dimensions can then be determined before any
+        # arrays are allocated.
+        file_data = []
+        names = {}
+        for file_path in file_paths:
+            file_match = cls.file_pattern.match(os.path.basename(file_path))
+            if (file_match is None) or (file_match.group(2) != geography):
+                continue
+            survey = file_match.group(1)
+            df = pd.read_csv(file_path, dtype = {'NAME': str, 'state': str,
+            'county': str})
+            # Some files contain rows without state or county codes (e.g.
+            # counties that were only present within one of the years that
+            # were merged together). These rows can't be matched to a
+            # GEOID, so they're skipped.
+            geoids = cls._create_geoids(df, geography)
+            df = df[geoids.notna()]
+            geoids = geoids[geoids.notna()].to_numpy(dtype = object)
+            for geoid, name in zip(geoids, df['NAME']):
+                names.setdefault(geoid, name)
+            columns = {}
+            for column in df.columns:
+                column_match = cls.column_pattern.match(column)
+                if column_match is None:
+                    continue
+                variable = survey + '_' + column_match.group(1)
+                columns[(variable, int(column_match.group(2)))] = pd.to_numeric(
+                    df[column], errors = 'coerce').to_numpy(dtype = 'float64')
+            file_data.append((geoids, columns))
+
+        if len(file_data) == 0:
+            raise ValueError(f'Error: no {geography} data files were found.')
+
+        all_geoids = pd.Index(np.unique(np.concatenate(
+            [geoids for geoids, columns in file_data])))
+        years = np.array(sorted({year for geoids, columns in file_data
+        for (variable, year) in columns}))
+        year_positions = {year: i for i, year in enumerate(years)}
+
+        values = {}
+        for geoids, columns in file_data:
+            # get_indexer maps each row of the file to its row in the panel,
+            # allowing the file's values to be copied in with a single
+            # vectorized assignment per column.
+            rows = all_geoids.get_indexer(geoids)
+            for (variable, year), column_values in columns.items():
+                if variable not in values:
+                    values[variable] = np.full((len(all_geoids), len(years)),
+                    np.nan)
+                target = values[variable][:, year_positions[year]]
+                # Values that were already filled in by a file with higher
+                # precedence are left as is.
+                fill = np.isnan(target[rows])
+                target[rows[fill]] = column_values[fill]
+
+        return cls(all_geoids, years, values, names = pd.Series(names).reindex(
+            all_geoids).to_numpy())
+
+    def series(self, variable, year):
+        '''Returns the values of a variable for a single year (one value
+        per geography).'''
+        return self.values[variable][:, self._year_position(year)]
+
+    def _year_position(self, year):
+        positions = np.flatnonzero(self.years == year)
+        if len(positions) == 0:
+            raise KeyError(f'Error: {year} is not present within the panel.')
+        return positions[0]
+
+    def change(self, variable, start_year, end_year):
+        '''Calculates the proportional change in a variable between
+        start_year and end_year for every geography at once. Geographies
+        with a missing or zero starting value receive NaN.'''
+        start = self.series(variable, start_year)
+        end = self.series(variable, end_year)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            change = (end - start) / start
+        change[~np.isfinite(change)] = np.nan
+        return change
+
+    @staticmethod
+    def change_column_name(variable, start_year, end_year):
+        '''Returns a change column name in the format used within the
+        tutorial notebooks (e.g. 'acs5_2016_to_2021_population_chg').'''
+        survey, measure = variable.split('_', 1)
+        return f'{survey}_{start_year}_to_{end_year}_{measure}_chg'
+
+    def change_table(self, changes, include_values = False):
+        '''Returns a DataFrame containing a GEOID column, a NAME column,
+        and one change column for each (variable, start_year, end_year)
+        tuple within changes. If include_values is True, the starting and
+        ending values for each change will be included as well (e.g.
+        'acs5_population_2016' and 'acs5_population_2021').'''
+        columns = {'GEOID': self.geoids.to_numpy(), 'NAME': self.names}
+        for variable, start_year, end_year in changes:
+            if include_values == True:
+                for year in [start_year, end_year]:
+                    columns[f'{variable}_{year}'] = self.series(variable, year)
+            columns[self.change_column_name(
+                variable, start_year, end_year)] = self.change(
+                    variable, start_year, end_year)
+        return pd.DataFrame(columns)
+
+    def attach_to(self, store, changes, key_column = 'GEOID',
+    include_values = False):
+        '''Attaches the change columns specified in changes to a
+        GeographyStore whose key column contains GEOIDs (such as the GEOID
+        column within the Census TIGER shapefiles). The store's view() method
+        can then be passed to generate_map.'''
+        table = self.change_table(changes, include_values = include_values)
+        table = table.drop(columns = 'NAME').rename(
+            columns = {'GEOID': key_column})
+        return store.attach(table, key_column = key_column, overwrite = True)
+
+
+class _TimeSliderLayer(MacroElement):
+    '''This class adds a choropleth layer with a time slider to a Folium map.
+    The layer's geometry is serialized only once; each time period then adds
+    only an array of values (one per shape) to the page. Colors are assigned
+    within the browser using the same bins and colors as the map's legend.
+    '''
+
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var geojson = {{ this.geojson }};
+            var labels = {{ this.labels }};
+            var values = {{ this.values }};
+            var bins = {{ this.bins }};
+            var colors = {{ this.colors }};
+            var nameField = {{ this.name_field }};
+            var featureText = {{ this.feature_text }};
+            var popupText = {{ this.popup_text }};
+            var current = 0;
+            geojson.features.forEach(function(feature, i) {
+                feature.i = i;
+            });
+
+            // This function replicates branca's StepColormap, which is used
+            // to color the shapes within non-slider maps.
+            function getColor(value) {
+                for (var i = 1; i < bins.length - 1; i++) {
+                    if (value < bins[i]) {
+                        return colors[i - 1];
+                    }
+                }
+                return colors[colors.length - 1];
+            }
+
+            function style(feature) {
+                var value = values[current][feature.i];
+                if (value === null) {
+                    return {weight: 0.5, color: 'black', fillOpacity: 0};
+                }
+                return {weight: 0.5, color: 'black',
+                    fillColor: getColor(value), fillOpacity: 0.75};
+            }
+
+            var layer = L.geoJson(geojson, {style: style}).addTo(
+                {{ this._parent.get_name() }});
+            layer.bindTooltip(function(shape) {
+                var value = values[current][shape.feature.i];
+                return '<b>' + featureText + ':</b> ' +
+                    shape.feature.properties[nameField] + '<br><b>' +
+                    popupText + ' (' + labels[current] + '):</b> ' +
+                    (value === null ? 'N/A' : value);
+            }, {sticky: true});
+
+            var control = L.control({position: 'topright'});
+            control.onAdd = function() {
+                var div = L.DomUtil.create('div');
+                div.style.cssText = 'background: white; padding: 6px 10px; ' +
+                    'font: 16px Arial; border: 1px solid black;';
+                var label = L.DomUtil.create('div', '', div);
+                var slider = L.DomUtil.create('input', '', div);
+                slider.type = 'range';
+                slider.min = 0;
+                slider.max = labels.length - 1;
+                slider.step = 1;
+                slider.value = 0;
+                var button = L.DomUtil.create('button', '', div);
+                button.innerHTML = 'Play';
+                var timer = null;
+                function setFrame(i) {
+                    current = i;
+                    slider.value = i;
+                    label.innerHTML = labels[i];
+                    layer.setStyle(style);
+                }
+                slider.addEventListener('input', function() {
+                    setFrame(parseInt(slider.value));
+                });
+                button.addEventListener('click', function() {
+                    if (timer !== null) {
+                        clearInterval(timer);
+                        timer = null;
+                        button.innerHTML = 'Play';
+                        return;
+                    }
+                    button.innerHTML = 'Pause';
+                    timer = setInterval(function() {
+                        setFrame((current + 1) % labels.length);
+                    }, {{ this.interval }});
+                });
+                L.DomEvent.disableClickPropagation(div);
+                setFrame(0);
+                return div;
+            };
+            control.addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+        """)
+
+    def __init__(self, merged_data_table, shape_feature_name, time_variables,
+    bins, color_list, feature_text, popup_variable_text, interval = 1000):
+        super().__init__()
+        self._name = 'TimeSliderLayer'
+        # Only the name column and the geometry are serialized as GeoJSON.
+        # The values for each time period are stored separately as plain
+        # arrays, which are far smaller than additional copies of the
+        # geometry would be.
+        self.geojson = merged_data_table[
+            [shape_feature_name, merged_data_table.geometry.name]].to_json(
+                drop_id = True)
+        self.labels = json.dumps([str(label) for label in time_variables])
+        self.values = json.dumps([[None if pd.isna(value) else value for value
+        in merged_data_table[column].tolist()]
+        for column in time_variables.values()])
+        self.bins = json.dumps([float(value) for value in bins])
+        self.colors = json.dumps(list(color_list))
+        self.name_field = json.dumps(shape_feature_name)
+        self.feature_text = json.dumps(feature_text)
+        self.popup_text = json.dumps(popup_variable_text)
+        self.interval = int(interval)
+
+
+class _CompressedChoroplethLayer(MacroElement):
+    '''This class adds a choropleth layer whose GeoJSON is stored within
+    the page gzip-compressed (either inline as base64 text or within a
+    sidecar file) rather than as plain text. The browser decompresses it
+    via DecompressionStream, then colors the shapes using the same bins and
+    colors as the map's legend.
+    '''
+
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var bins = {{ this.bins }};
+            var colors = {{ this.colors }};
+            var nameField = {{ this.name_field }};
+            var valueField = {{ this.value_field }};
+            var featureText = {{ this.feature_text }};
+            var popupText = {{ this.popup_text }};
+
+            // This function replicates branca's StepColormap, which is used
+            // to color the shapes within uncompressed maps.
+            function getColor(value) {
+                for (var i = 1; i < bins.length - 1; i++) {
+                    if (value < bins[i]) {
+                        return colors[i - 1];
+                    }
+                }
+                return colors[colors.length - 1];
+            }
+
+            function style(feature) {
+                var value = feature.properties[valueField];
+                if (value === null) {
+                    return {weight: 0.5, color: 'black', fillOpacity: 0};
+                }
+                return {weight: 0.5, color: 'black',
+                    fillColor: getColor(value), fillOpacity: 0.75};
+            }
+
+            // Inline payloads are stored as data: URLs, so both kinds of
+            // payload can be read via fetch.
+            fetch({{ this.payload_url }}).then(function(response) {
+                return new Response(response.body.pipeThrough(
+                    new DecompressionStream('gzip'))).json();
+            }).then(function(geojson) {
+                var layer = L.geoJson(geojson, {style: style}).addTo(
+                    {{ this._parent.get_name() }});
+                layer.bindTooltip(function(shape) {
+                    var value = shape.feature.properties[valueField];
+                    return '<b>' + featureText + ':</b> ' +
+                        shape.feature.properties[nameField] + '<br><b>' +
+                        popupText + ':</b> ' +
+                        (value === null ? 'N/A' : value);
+                }, {sticky: true});
+            });
+        })();
+        {% endmacro %}
+        """)
+
+    def __init__(self, merged_data_table, shape_feature_name, data_variable,
+    bins, color_list, feature_text, popup_variable_text, sidecar_path = None,
+    html_path = None):
+        super().__init__()
+        self._name = 'CompressedChoroplethLayer'
+        # mtime is set to 0 so that the same table always produces the same
+        # payload (and therefore the same .html file).
+        payload = gzip.compress(merged_data_table[[shape_feature_name,
+        data_variable, merged_data_table.geometry.name]].to_json(
+            drop_id = True).encode(), compresslevel = 9, mtime = 0)
+        if sidecar_path is None:
+            self.payload_url = json.dumps('data:application/octet-stream;\
+base64,'+base64.b64encode(payload).decode())
+        else:
+            with open(sidecar_path, 'wb') as file:
+                file.write(payload)
+            # The sidecar file is referenced relative to the .html file,
+            # in the same way as the files created by partition_files.
+            self.payload_url = json.dumps(_relative_url(sidecar_path,
+            html_path))
+        self.bins = json.dumps([float(value) for value in bins])
+        self.colors = json.dumps(list(color_list))
+        self.name_field = json.dumps(shape_feature_name)
+        self.value_field = json.dumps(data_variable)
+        self.feature_text = json.dumps(feature_text)
+        self.popup_text = json.dumps(popup_variable_text)
+
+
+def _relative_url(path, html_path):
+    '''Returns the URL of path relative to the .html file at html_path,
+    for use within that file. (Characters such as the backslashes that
+    generate_map places between html_save_path and map_name are
+    percent-encoded, so the URL refers to the same file on every system.)'''
+    return urllib.parse.quote(os.path.relpath(path, os.path.dirname(
+        html_path) or '.').replace(os.sep, '/'))
+
+
+class _PartitionFilesLayer(MacroElement):
+    '''This class adds a choropleth layer whose shapes are stored within
+    one GeoJSON file per partition rather than within the page. Each file is
+    only downloaded once the partition's bounds overlap the visible part of
+    the map, and the shapes are colored using the same bins and colors as
+    the map's legend.
+    '''
+
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var partitions = {{ this.partitions }};
+            var bins = {{ this.bins }};
+            var colors = {{ this.colors }};
+            var nameField = {{ this.name_field }};
+            var valueField = {{ this.value_field }};
+            var featureText = {{ this.feature_text }};
+            var popupText = {{ this.popup_text }};
+
+            // This function replicates branca's StepColormap, which is used
+            // to color the shapes within other maps.
+            function getColor(value) {
+                for (var i = 1; i < bins.length - 1; i++) {
+                    if (value < bins[i]) {
+                        return colors[i - 1];
+                    }
+                }
+                return colors[colors.length - 1];
+            }
+
+            function style(feature) {
+                var value = feature.properties[valueField];
+                if (value === null) {
+                    return {weight: 0.5, color: 'black', fillOpacity: 0};
+                }
+                return {weight: 0.5, color: 'black',
+                    fillColor: getColor(value), fillOpacity: 0.75};
+            }
+
+            function loadVisiblePartitions() {
+                var view = map.getBounds();
+                partitions.forEach(function(partition) {
+                    if (partition.loaded ||
+                        !view.intersects(L.latLngBounds(partition.bounds))) {
+                        return;
+                    }
+                    partition.loaded = true;
+                    fetch(partition.url).then(function(response) {
+                        return response.json();
+                    }).then(function(geojson) {
+                        var layer = L.geoJson(geojson, {style: style}).addTo(
+                            map);
+                        layer.bindTooltip(function(shape) {
+                            var value = shape.feature.properties[valueField];
+                            return '<b>' + featureText + ':</b> ' +
+                                shape.feature.properties[nameField] +
+                                '<br><b>' + popupText + ':</b> ' +
+                                (value === null ? 'N/A' : value);
+                        }, {sticky: true});
+                    });
+                });
+            }
+
+            map.on('moveend', loadVisiblePartitions);
+            // The first partitions are loaded once the rest of the page's
+            // scripts (which may zoom the map to a region) have run.
+            setTimeout(loadVisiblePartitions, 0);
+        })();
+        {% endmacro %}
+        """)
+
+    def __init__(self, partitions, shape_feature_name, data_variable,
+    bins, color_list, feature_text, popup_variable_text):
+        super().__init__()
+        self._name = 'PartitionFilesLayer'
+        # partitions is a list of (url, bounds) tuples, in which bounds is
+        # a (min_longitude, min_latitude, max_longitude, max_latitude)
+        # tuple.
+        self.partitions = json.dumps([{'url': url, 'bounds': [[
+            float(bounds[1]), float(bounds[0])], [float(bounds[3]),
+            float(bounds[2])]]} for url, bounds in partitions])
+        self.bins = json.dumps([float(value) for value in bins])
+        self.colors = json.dumps(list(color_list))
+        self.name_field = json.dumps(shape_feature_name)
+        self.value_field = json.dumps(data_variable)
+        self.feature_text = json.dumps(feature_text)
+        self.popup_text = json.dumps(popup_variable_text)
+
+
+def _write_precompressed_copies(path, formats):
+    '''Writes gzip (.gz) and/or brotli (.br) copies of a file next to it
+    so that static web servers (e.g. nginx's gzip_static and brotli_static
+    options) can serve them directly. Returns the paths of the copies.'''
+    with open(path, 'rb') as file:
+        content = file.read()
+    copy_paths = []
+    for compression_format in formats:
+        if compression_format == 'gzip':
+            compressed = gzip.compress(content, compresslevel = 9, mtime = 0)
+            copy_path = path+'.gz'
+        else:
+            try:
+                import brotli
+            except ImportError:
+                raise ImportError('Error: brotli copies require the brotli \
+package (pip install brotli).')
+            compressed = brotli.compress(content, quality = 11)
+            copy_path = path+'.br'
+        with open(copy_path, 'wb') as file:
+            file.write(compressed)
+        copy_paths.append(copy_path)
+    return copy_paths
+
+
+def _dot_density_points(geometry, values, dot_value, seed = 0, 
+max_rounds = 20):
+    '''Generates dot density points for an array of shapes. Each shape 
+    receives one dot per dot_value units of its value (with any remainder
+    rounded up or down at random, so that the total number of dots matches
+    the total value on average). Returns arrays of longitudes and latitudes.
+
+    The dots are placed at random locations within each shape's bounding 
+    box, then kept only if they fall inside the shape. This is done for all
+    shapes at once using NumPy arrays, with further rounds for any shapes
+    that still need more dots. Dots that still haven't been placed after
+    max_rounds (which can happen for very thin shapes) are placed at a point
+    within the shape. If no shape receives any dots (e.g. because every
+    value is 0 or negative, or less than dot_value), empty arrays are 
+    returned.'''
+    rng = np.random.default_rng(seed)
+    geometry = np.asarray(geometry)
+    values = np.nan_to_num(np.asarray(values, dtype = 'float64'), 
+    nan = 0).clip(min = 0) / dot_value
+    counts = np.floor(values).astype('int64')
+    counts += rng.random(len(values)) < (values - counts)
+    bounds = shapely.bounds(geometry)
+    counts[np.isnan(bounds).any(axis = 1)] = 0
+
+    # The share of each bounding box that's covered by its shape determines
+    # how many candidate points are needed to fill that shape.
+    box_areas = (bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])
+    coverage = np.divide(shapely.area(geometry), box_areas, 
+    out = np.zeros(len(geometry)), where = box_areas > 0).clip(0.01, 1)
+    shapely.prepare(geometry)
+
+    # The lists start with empty arrays so that they can always be 
+    # concatenated, even if no dots are placed.
+    longitudes, latitudes = [np.empty(0)], [np.empty(0)]
+    remaining = counts.copy()
+    for _ in range(max_rounds):
+        if remaining.sum() == 0:
+            break
+        attempts = np.ceil(remaining / coverage * 1.2).astype('int64')
+        owners = np.repeat(np.arange(len(geometry)), attempts)
+        x = rng.uniform(bounds[owners, 0], bounds[owners, 2])
+        y = rng.uniform(bounds[owners, 1], bounds[owners, 3])
+        inside = shapely.contains_xy(geometry[owners], x, y)
+        owners, x, y = owners[inside], x[inside], y[inside]
+        # owners is sorted, so each point's rank within its shape is its
+        # distance from the first point belonging to that shape. Only as
+        # many points as each shape still needs are kept.
+        rank = np.arange(len(owners)) - np.searchsorted(owners, owners)
+        keep = rank < remaining[owners]
+        longitudes.append(x[keep])
+        latitudes.append(y[keep])
+        remaining -= np.bincount(owners[keep], minlength = len(geometry))
+
+    if remaining.sum() > 0:
+        fallback_points = shapely.point_on_surface(geometry[remaining > 0])
+        longitudes.append(np.repeat(shapely.get_x(fallback_points), 
+        remaining[remaining > 0]))
+        latitudes.append(np.repeat(shapely.get_y(fallback_points), 
+        remaining[remaining > 0]))
+
+    return np.concatenate(longitudes), np.concatenate(latitudes)
+
+
+def _proportional_symbols(geometry, values, max_radius):
+    '''Returns the longitudes, latitudes, and radii (in pixels) of
+    proportional symbols for an array of shapes. Each symbol is placed at a
+    point within its shape, and its area is proportional to the absolute 
+    value of that shape's value.'''
+    points = shapely.point_on_surface(np.asarray(geometry))
+    magnitudes = np.abs(np.asarray(values, dtype = 'float64'))
+    largest = np.nanmax(magnitudes) if len(magnitudes) > 0 else 0
+    if largest > 0:
+        radii = max_radius * np.sqrt(magnitudes / largest)
+    else:
+        radii = np.zeros(len(magnitudes))
+    return shapely.get_x(points), shapely.get_y(points), radii
+
+
+class _PointLayer(MacroElement):
+    '''This class adds a set of points (dot density dots or proportional
+    symbols) to a Folium map. The points are stored as plain arrays of
+    coordinates and drawn onto a canvas, which is far faster and smaller 
+    than adding a separate Marker for each point.
+
+    Dot density dots are drawn directly onto a single canvas that is 
+    redrawn whenever the map moves. Proportional symbols, of which there 
+    is only one per shape, are added as circle markers on Leaflet's canvas 
+    renderer so that they can display tooltips.
+    '''
+
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var lons = {{ this.lons }};
+            var lats = {{ this.lats }};
+            var radii = {{ this.radii }};
+            var colorIndexes = {{ this.color_indexes }};
+            var colors = {{ this.colors }};
+            var names = {{ this.names }};
+            var values = {{ this.values }};
+            var featureText = {{ this.feature_text }};
+            var popupText = {{ this.popup_text }};
+            var caption = {{ this.caption }};
+
+            function colorOf(i) {
+                return colorIndexes === null ? colors[0] :
+                    colors[colorIndexes[i]];
+            }
+
+            if (names === null) {
+                var DotLayer = L.Layer.extend({
+                    onAdd: function(map) {
+                        // The leaflet-zoom-hide class hides the canvas
+                        // during zoom animations; it's redrawn afterwards.
+                        this._canvas = L.DomUtil.create('canvas',
+                            'leaflet-zoom-hide');
+                        map.getPanes().overlayPane.appendChild(this._canvas);
+                        map.on('moveend', this._draw, this);
+                        this._draw();
+                    },
+                    onRemove: function(map) {
+                        L.DomUtil.remove(this._canvas);
+                        map.off('moveend', this._draw, this);
+                    },
+                    _draw: function() {
+                        var size = map.getSize();
+                        var canvas = this._canvas;
+                        canvas.width = size.x;
+                        canvas.height = size.y;
+                        L.DomUtil.setPosition(canvas,
+                            map.containerPointToLayerPoint([0, 0]));
+                        var context = canvas.getContext('2d');
+                        for (var i = 0; i < lons.length; i++) {
+                            var point = map.latLngToContainerPoint(
+                                [lats[i], lons[i]]);
+                            if (point.x < -radii || point.y < -radii ||
+                                point.x > size.x + radii ||
+                                point.y > size.y + radii) {
+                                continue;
+                            }
+                            context.fillStyle = colorOf(i);
+                            context.beginPath();
+                            context.arc(point.x, point.y, radii, 0,
+                                2 * Math.PI);
+                            context.fill();
+                        }
+                    }
+                });
+                new DotLayer().addTo(map);
+            } else {
+                var renderer = L.canvas({padding: 0.5});
+                for (var i = 0; i < lons.length; i++) {
+                    L.circleMarker([lats[i], lons[i]], {renderer: renderer,
+                        radius: radii[i], weight: 0.5, color: 'black',
+                        fillColor: colorOf(i), fillOpacity: 0.75}
+                    ).bindTooltip('<b>' + featureText + ':</b> ' + names[i] +
+                        '<br><b>' + popupText + ':</b> ' +
+                        (values[i] === null ? 'N/A' : values[i]),
+                        {sticky: true}).addTo(map);
+                }
+            }
+
+            if (caption !== null) {
+                var control = L.control({position: 'bottomright'});
+                control.onAdd = function() {
+                    var div = L.DomUtil.create('div');
+                    div.style.cssText = 'background: white; ' +
+                        'padding: 6px 10px; font: 16px Arial; ' +
+                        'border: 1px solid black;';
+                    div.innerHTML = caption;
+                    return div;
+                };
+                control.addTo(map);
+            }
+        })();
+        {% endmacro %}
+        """)
+
+    def __init__(self, longitudes, latitudes, radii, colors, 
+    color_indexes = None, names = None, values = None, feature_text = '',
+    popup_text = '', caption = None):
+        super().__init__()
+        self._name = 'PointLayer'
+        # Coordinates are rounded to 5 decimals (roughly 1 meter), which
+        # keeps the arrays compact without visibly moving any points.
+        self.lons = json.dumps(np.round(longitudes, 5).tolist())
+        self.lats = json.dumps(np.round(latitudes, 5).tolist())
+        if np.ndim(radii) == 0:
+            self.radii = json.dumps(float(radii))
+        else:
+            self.radii = json.dumps(np.round(radii, 1).tolist())
+        self.colors = json.dumps(list(colors))
+        self.color_indexes = json.dumps(None if color_indexes is None 
+        else [int(index) for index in color_indexes])
+        self.names = json.dumps(None if names is None else
+        [str(name) for name in names])
+        self.values = json.dumps(None if values is None else
+        [None if pd.isna(value) else value for value in values])
+        self.feature_text = json.dumps(feature_text)
+        self.popup_text = json.dumps(popup_text)
+        self.caption = json.dumps(caption)
+
+
+def _select_region(table, bounding_box = None, states = None,
+state_column = 'state'):
+    '''Returns the rows of table that fall within bounding_box and/or
+    belong to one of the states in states. Shapes that cross the edge of
+    bounding_box are clipped to it, which keeps the .html file from
+    including the parts of those shapes that won't be visible anyway.'''
+    if bounding_box is not None:
+        # table.sindex is a spatial index (an STRtree) that allows the shapes
+        # within the bounding box to be found without checking every shape.
+        # Geopandas caches this index on the table, so subsequent regional
+        # maps created from the same table can reuse it.
+        positions = table.sindex.query(shapely.geometry.box(*bounding_box),
+        predicate = 'intersects')
+        table = table.iloc[np.sort(positions)].copy()
+        table[table.geometry.name] = table.geometry.clip_by_rect(
+            *bounding_box)
+        table = table[~table.geometry.is_empty]
+    if states is not None:
+        state_codes = pd.to_numeric(pd.Series(states), errors = 'coerce')
+        if state_codes.notna().all():
+            # The state column may store codes as strings ('06'), integers
+            # (6), or floats (6.0), so codes are compared numerically.
+            table = table[pd.to_numeric(table[state_column],
+            errors = 'coerce').isin(state_codes)]
+        else:
+            table = table[table[state_column].isin(states)]
+    return table
+
+
+def _state_partitions(states, partition_folder):
+    '''Converts a list of state codes into the partition names used by
+    prepare_tract_table and prepare_block_group_table (e.g. 6 -> '06').
+    Partitioned tables are named after state codes, so state names
+    can't be used to select partitions; neither can the grid partitions
+    created by prepare_partitioned_table.'''
+    if states is None:
+        return None
+    if any(os.path.basename(path).startswith('grid_') for path in 
+    list_table_partitions(partition_folder)):
+        raise ValueError('Error: '+partition_folder+' is partitioned into \
+grid cells rather than states, so states can\'t be used to select \
+partitions. Use bounding_box instead.')
+    state_codes = pd.to_numeric(pd.Series(states), errors = 'coerce')
+    if state_codes.isna().any():
+        raise ValueError('Error: partitioned tables can only be limited \
+to states using state codes (e.g. 51 or \'51\'), not '+str(
+            list(pd.Series(states)[state_codes.isna()]))+'.')
+    return [str(int(code)).zfill(2) for code in state_codes]
+
+
+def _prepare_map_values(table, value_columns, multiply_data_by,
+variable_decimals, rows_to_map):
+    '''Applies generate_map's data preparation steps (removing missing
+    values, multiplying, rounding, and limiting the number of rows) to a copy
+    of table.'''
+    # The function will first drop rows in the table 
+    # whose data variable column value is missing. (For time slider maps,
+    # only rows that are missing values for every period are dropped.)
+    merged_data_table_copy = table.copy().dropna(
+        subset = value_columns, how = 'all') 
+
+    for value_column in value_columns:
+        #It will then multiply all values in the data variable column by
+        # the amount specified in multiply_data_by.
+        # (Numeric columns are converted to 64-bit types first, since
+        # tables compacted via compact_table may store them as 32-bit
+        # floats or integers. Rounding 32-bit floats would leave small
+        # errors within the tooltips, and multiplying 32-bit integers
+        # could overflow.)
+        kind = merged_data_table_copy[value_column].dtype.kind
+        if kind in 'fiu':
+            merged_data_table_copy[value_column] = merged_data_table_copy[
+                value_column].astype('float64' if kind == 'f' else 'int64')
+        merged_data_table_copy[value_column] = merged_data_table_copy[
+            value_column]*multiply_data_by
+
+        # Next, the values will get rounded by the value specified
+        # in variable_decimals.
+        merged_data_table_copy[value_column] = round(
+            merged_data_table_copy[value_column], variable_decimals) 
+            # Rounds the data to be mapped. This needs to be
+            # executed before the bins are calculated below in order to avoid
+            # errors in which some data falls outside the bin dimensions.
+
+    # The following lines limit the data to be mapped if a limit was entered
+    # into the rows_to_map parameter. 
+    if rows_to_map != 0: # A value of 0 means that all rows will be mapped.
+        merged_data_table_copy = merged_data_table_copy.copy()[0:rows_to_map]
+    return merged_data_table_copy
+
 
 def generate_map(merged_data_table, shape_feature_name, 
     data_variable, feature_text, map_name, html_save_path, 
@@ -275,7 +1908,14 @@ def generate_map(merged_data_table, shape_feature_name,
     fill_color = 'Blues', rows_to_map = 0, bin_count = 8, 
     bin_type = 'percentiles', tiles = 'Stamen Toner', generate_image = True,
     multiply_data_by = 1, vertical_legend = False, 
-    debug = False):
+    debug = False, time_variables = None, stats_callback = None,
+    stats_log_path = None, profile_memory = False, bounding_box = None,
+    states = None, state_column = 'state', render_mode = 'choropleth',
+    dot_value = None, dot_radius = 1, dot_seed = 0, max_symbol_radius = 25,
+    show_boundaries = True, prefer_canvas = False, 
+    image_backend = 'selenium', basemap_tiles_path = None,
+    tiles_attribution = None, payload_compression = None,
+    precompressed_formats = (), partition_files = False):
     '''
     This function uses a merged data table created through prepare_zip_table,
     prepare_county_table, or prepare_zip_table to generate an interactive
@@ -285,7 +1925,12 @@ def generate_map(merged_data_table, shape_feature_name,
     Explanations of variables:
 
     merged_data_table: The merged data table created via prepare_zip_table,
-    prepare_county_table, or prepare_zip_table
+    prepare_county_table, or prepare_zip_table. This can also be the path
+    to a folder of partitions created by prepare_tract_table or
+    prepare_block_group_table, in which case the partitions will be
+    read and added to the map one at a time. (rows_to_map will then apply
+    to each partition.) See partition_files for a way to keep these maps'
+    .html files small.
 
     shape_feature_name: The name of the column within the GeoDataFrame 
     containing unique IDs for each feature. It's very important that these are
@@ -312,6 +1957,13 @@ def generate_map(merged_data_table, shape_feature_name,
     debug: When set to True, this function prints information about 
     what the function is about to perform.
 
+    stats_callback, stats_log_path, and profile_memory: Optional settings
+    for recording the time (and, if profile_memory is True, the memory)
+    used by each stage of this function, along with the sizes of the files
+    it creates. stats_callback is a function that will be passed the
+    resulting record, and stats_log_path is a .jsonl file to which the record
+    will be appended. See StageTimer for details.
+
     Important note: If you choose to use vertical legends, 
     I recommend choosing '' for the HTML save path, which ensures that the map
     will be saved in the project's root folder. This is because the vertical 
@@ -389,6 +2041,16 @@ def generate_map(merged_data_table, shape_feature_name,
     you can insert a different tile provider if you wish. Some additional
     options are listed at:
     https://deparkes.co.uk/2016/06/10/folium-map-tiles/ 
+    This can also be a URL template, such as the one returned by 
+    TileServer.tile_url within census_folium_tiles.py, which serves tiles
+    from a local cache (so that screenshots don't need to wait for tiles
+    to download, and maps can be rendered offline). When using a
+    TileServer for maps built via rebuild_maps, give it a fixed port so
+    that the tiles argument doesn't change between runs.
+
+    tiles_attribution: The attribution text to display for custom tile
+    URLs (see census_folium_tiles.PROVIDERS). This is required by Folium
+    when tiles is a URL.
 
     generate_image: Specifies whether a .png version of the map should also
     be created. You can set it to false if you are having issues getting
@@ -411,6 +2073,117 @@ def generate_map(merged_data_table, shape_feature_name,
     vertical legends. I recommend keeping this at '' (e.g. the same path as
     your root folder) for simplicity's sake.
 
+    bounding_box: An optional (min_longitude, min_latitude, max_longitude,
+    max_latitude) tuple, e.g. (-80.5, 37, -66.9, 47.5) for the Northeast.
+    If provided, only the shapes within this box will be included in the
+    map (with shapes along its edges clipped to it), and the map will be
+    zoomed to fit the box. This makes regional maps much faster to create
+    and much smaller than national ones, and it doesn't require the table
+    to be re-prepared.
+
+    states: An optional list of state codes (e.g. [9, 23, 25, 33, 44, 50])
+    or, if state_column contains state names, state names. If provided,
+    only shapes within these states will be mapped, and the map will be
+    zoomed to fit them. For partitioned tables, only the partitions for
+    these states will be read.
+
+    state_column: The column within merged_data_table that stores each 
+    shape's state code (or name). The default, 'state', matches the
+    column within the Census data tables.
+
+    time_variables: An optional dictionary that maps time period labels to
+    columns within merged_data_table, e.g. {'2010-2015': 
+    'acs5_2010_to_2015_population_chg', '2015-2020':
+    'acs5_2015_to_2020_population_chg'}. When this dictionary is provided,
+    the function creates a single map with a time slider (and a 'Play' button)
+    that switches between these columns, and data_variable is ignored. 
+    The bins are calculated using the values for all periods so that colors
+    can be compared across periods. The shapes are only stored once within
+    the .html file; each additional period only adds one value per shape.
+
+    render_mode: 'choropleth' (the default) colors each shape based on
+    its data_variable value. 'dot_density' instead places one dot within a
+    shape for every dot_value units of data_variable (e.g. one dot per 1,000
+    residents), and 'proportional_symbols' places a circle within each shape
+    whose area is proportional to its value (and whose color is based on
+    the same bins as a choropleth map). Both of these modes show magnitudes
+    that choropleth maps hide, and both draw their points onto a canvas
+    rather than adding an individual marker for each point, so they remain
+    fast even for zip code maps. (Dot density maps ignore negative values.)
+    These modes can't be combined with time_variables or partitioned tables.
+
+    dot_value: The number of units represented by each dot within dot 
+    density maps. If this is left as None, a value that produces roughly
+    100,000 dots will be chosen.
+
+    dot_radius: The radius, in pixels, of each dot within dot density maps.
+
+    dot_seed: The random seed used to place the dots, which ensures that the
+    same data will always produce the same map.
+
+    max_symbol_radius: The radius, in pixels, of the largest circle within
+    proportional symbol maps.
+
+    show_boundaries: Whether to draw the outlines of the shapes (which also
+    display each shape's value when hovered over) beneath the dots or 
+    circles of dot density and proportional symbol maps. Setting this to
+    False makes the .html file much smaller.
+
+    prefer_canvas: Whether to draw the shapes onto a single canvas rather
+    than as individual SVG elements. Leaflet's default SVG renderer creates
+    a separate element for each shape, which makes maps with many shapes
+    (such as zip code maps) slow to pan and to screenshot; the canvas 
+    renderer avoids this. Tooltips still appear when hovering over shapes
+    drawn on a canvas. See compare_renderers within 
+    census_folium_benchmarks.py for a comparison of the two renderers.
+
+    image_backend: The method used to create the .png version of the map
+    (if generate_image is True). 'selenium' (the default) takes a 
+    screenshot of the .html map within Chrome. 'matplotlib' instead draws
+    the same shapes, colors, and legend directly onto a 3000x1687 image 
+    without starting a browser, which is much faster and allows many maps
+    to be rendered in parallel (see generate_maps). The tile background
+    is only included if basemap_tiles_path is provided. (Time slider maps
+    are rendered using their first period.)
+
+    basemap_tiles_path: For the 'matplotlib' image backend, a path 
+    containing {z}, {x}, and {y} placeholders (e.g. 
+    'tile_cache/{z}/{x}/{y}.png') from which cached basemap tiles will be
+    read. Tiles that aren't present within the cache are left blank.
+
+    payload_compression: How to store the shapes within the .html file.
+    By default (None), they're stored as plain GeoJSON text, which makes up
+    nearly all of the file's size. 'inline' instead stores them
+    gzip-compressed (as base64 text) within the page, and 'sidecar' stores
+    them within a separate gzip-compressed file (map_name.geojson.gz) next
+    to the .html file. In both cases, the browser decompresses the shapes
+    when the page loads. This typically makes zip code maps several times
+    smaller. Sidecar files can only be loaded when the map is viewed through
+    a web server (not when it's opened directly from disk), so they can't
+    be combined with the 'selenium' image backend. These options only apply
+    to standard choropleth maps (not to time slider, dot density, or
+    proportional symbol maps or to partitioned tables).
+
+    precompressed_formats: Any of 'gzip' and 'brotli'. For each format, a
+    compressed copy of the .html file (map_name.html.gz or
+    map_name.html.br) is saved next to it so that static web servers can
+    send the compressed copy to browsers directly. ('brotli' requires the
+    brotli package.)
+
+    partition_files: For partitioned tables, whether to save each 
+    partition's shapes within its own GeoJSON file (inside a 
+    map_name_partitions folder next to the .html file) rather than within
+    the .html file itself. The page then downloads only the partitions that
+    overlap the visible part of the map, loading others as the map is
+    panned or zoomed, so the .html file stays small. This also limits the
+    memory used while creating the map, since each partition is written to
+    disk as soon as it has been prepared. (Otherwise, Folium converts each
+    partition to GeoJSON as it's added to the map, so the shapes for every
+    partition remain in memory until the map is saved.) Like sidecar
+    payloads, these files can only be loaded when the map is viewed through
+    a web server, so this option can't be combined with the 'selenium' 
+    image backend.
+
     Note: a sizeable portion of the following code, particularly the custom 
     choropleth mapping function and the code for the interactive overlay, 
     came from Amodiovalerio Verde's excellent interactive
@@ -430,40 +2203,105 @@ def generate_map(merged_data_table, shape_feature_name,
 
     '''
 
-    if debug == True:
-        print("Starting function")
-
-    # The function will first drop rows in the table 
-    # whose data variable column value is missing.
-    merged_data_table_copy = merged_data_table.copy().dropna(
-        subset = [data_variable]) 
-
-    #It will then multiply all values in the data variable column by
-    # the amount specified in multiply_data_by.
-    merged_data_table_copy[data_variable] = merged_data_table_copy[
-        data_variable]*multiply_data_by
-
-    # Next, the values will get rounded by the value specified
-    # in variable_decimals.
-    merged_data_table_copy[data_variable] = round(
-        merged_data_table_copy[data_variable], variable_decimals) 
-        # Rounds the data to be mapped. This needs to be
-        # executed before the bins are calculated below in order to avoid
-        # errors in which some data falls outside the bin dimensions.
-
-    # merged_data_table_copy['Tooltip'] = [merged_data_table_copy[shape_feature_name][i] + ": " + str(merged_data_table_copy[data_variable]) for i in range(len(merged_data_table_copy))]
-
-
-    # The following lines limit the data to be mapped if a limit was entered
-    # into the rows_to_map parameter. 
-    if rows_to_map != 0: # A value of 0 means that all rows will be mapped.
-        merged_data_table_copy = merged_data_table_copy.copy()[0:rows_to_map]
-    #print("Rows to plot:",len(merged_data_table_copy))
+    timer = StageTimer('generate_map', label = map_name, verbose = debug,
+    callback = stats_callback, log_path = stats_log_path, 
+    profile_memory = profile_memory)
+    timer.start_stage("Preparing data")
+
+    if image_backend not in ['selenium', 'matplotlib']:
+        raise ValueError('Error: image backend not recognized. Image \
+backend should be \'selenium\' or \'matplotlib\'.')
+    if render_mode not in ['choropleth', 'dot_density', 
+    'proportional_symbols']:
+        raise ValueError('Error: render mode not recognized. Render mode \
+should be \'choropleth\', \'dot_density\', or \'proportional_symbols\'.')
+    if render_mode != 'choropleth' and (time_variables is not None or
+    isinstance(merged_data_table, str)):
+        raise ValueError('Error: dot density and proportional symbol maps \
+can\'t be created from partitioned tables or with time sliders.')
+    if payload_compression not in [None, 'inline', 'sidecar']:
+        raise ValueError('Error: payload compression not recognized. \
+Payload compression should be None, \'inline\', or \'sidecar\'.')
+    if payload_compression is not None and (render_mode != 'choropleth' or
+    time_variables is not None or isinstance(merged_data_table, str)):
+        raise ValueError('Error: compressed payloads are only supported for \
+standard choropleth maps of in-memory tables.')
+    if payload_compression == 'sidecar' and generate_image == True and (
+        image_backend == 'selenium'):
+        raise ValueError('Error: sidecar payloads can\'t be loaded by maps \
+opened from disk, so they require the \'matplotlib\' image backend.')
+    if not set(precompressed_formats) <= {'gzip', 'brotli'}:
+        raise ValueError('Error: precompressed formats should be \'gzip\' \
+and/or \'brotli\'.')
+    if partition_files == True and not isinstance(merged_data_table, str):
+        raise ValueError('Error: partition_files requires a partitioned \
+table.')
+    if partition_files == True and generate_image == True and (
+        image_backend == 'selenium'):
+        raise ValueError('Error: partition files can\'t be loaded by maps \
+opened from disk, so they require the \'matplotlib\' image backend.')
+
+    # When a time slider map is requested, each of the columns within
+    # time_variables will be processed in the same way as data_variable.
+    if time_variables is not None:
+        value_columns = list(time_variables.values())
+    else:
+        value_columns = [data_variable]
+
+    # If merged_data_table is the path to a folder of partitions (created
+    # by prepare_tract_table or prepare_block_group_table), only the name
+    # and value columns are read at this point; these are sufficient for
+    # calculating the bins. The shapes are read later, one partition
+    # at a time.
+    if isinstance(merged_data_table, str):
+        if time_variables is not None:
+            raise ValueError('Error: time slider maps can\'t be created \
+from partitioned tables.')
+        state_partitions = _state_partitions(states, merged_data_table)
+        partition_paths = list_table_partitions(merged_data_table,
+        partitions = state_partitions)
+        # The shapes are only needed at this point if they will be used
+        # to select the shapes within bounding_box.
+        partition_columns = [shape_feature_name] + value_columns
+        if bounding_box is not None:
+            partition_columns.append('geometry')
+        merged_data_table_copy = pd.concat([_prepare_map_values(
+            _select_region(partition, bounding_box = bounding_box),
+            value_columns, multiply_data_by, variable_decimals, rows_to_map)
+            for partition in iter_partitioned_table(merged_data_table, 
+            partitions = state_partitions, 
+            columns = partition_columns)])
+    else:
+        partition_paths = None
+        # If a bounding box or list of states was provided, the table
+        # is limited to that region before any other processing takes place.
+        if (bounding_box is not None) or (states is not None):
+            merged_data_table = _select_region(merged_data_table,
+            bounding_box = bounding_box, states = states, 
+            state_column = state_column)
+        # Only the columns that the map uses are kept, so that the other
+        # columns aren't copied or serialized into the map's GeoJSON.
+        map_columns = list(dict.fromkeys([shape_feature_name] + 
+            value_columns)) + [merged_data_table.geometry.name]
+        merged_data_table_copy = _prepare_map_values(
+            merged_data_table[map_columns], value_columns, multiply_data_by,
+            variable_decimals, rows_to_map)
+
+    timer.start_stage("Calculating bins")
 
     # Next, the bins for the map will be calculated. These bins can either
     # be percentile-based or equally spaced. In either case, bin_count is 
     # used to determine the number of bins into which the data will fall.
 
+    # The bins are based on all of the values that will be mapped (which,
+    # for time slider maps, includes the values for every period).
+    bin_values = pd.concat([merged_data_table_copy[value_column] 
+    for value_column in value_columns]).dropna()
+    if len(bin_values) == 0:
+        raise ValueError('Error: there are no values to map. (The data \
+variable may be missing for every shape, or the selected region may not \
+contain any shapes.)')
+
     if bin_type == 'percentiles':
         # First, a list of percentiles (e.g. [0, 25, 50, 75, 100] will be
         # calculated.]
@@ -471,16 +2309,15 @@ def generate_map(merged_data_table, shape_feature_name,
         # 101 is used instead of 100 so that the 100th percentile will also
         # be included in these bins.
 
-        bins = np.percentile(merged_data_table_copy[data_variable].dropna(), 
-        quant_bins)
+        bins = np.percentile(bin_values, quant_bins)
         # print("Bins at this point:",bins)
         # https://numpy.org/doc/stable/reference/generated/numpy.percentile.html
     # This option creates bins that correspond to different percentiles
     # of the data.
 
     elif bin_type == 'equally_spaced':
-        min_val = merged_data_table_copy[data_variable].min()
-        max_val = merged_data_table_copy[data_variable].max()
+        min_val = bin_values.min()
+        max_val = bin_values.max()
         increment = (max_val - min_val)/bin_count
         bins = list(np.arange(min_val, max_val, increment))
         bins.append(max_val)
@@ -491,8 +2328,7 @@ either \'percentiles\' or \'equally spaced.\'')
 
     # Next, the color scheme for the map will get loaded into the project.
 
-    if debug == True:
-        print("Creating color dict")
+    timer.start_stage("Creating color dict")
 
     with open('color_schemes_from_branca.json') as file:
         color_file = file.read()
@@ -521,10 +2357,30 @@ either \'percentiles\' or \'equally spaced.\'')
     # print("Colors will be assigned based on the following bins:",bins)
 
     # Next, the code will generate the actual choropleth map.
-    m = folium.Map(location=[38.7, -95], zoom_start=6, tiles = tiles)
+    m = folium.Map(location=[38.7, -95], zoom_start=6, tiles = tiles,
+    attr = tiles_attribution, prefer_canvas = prefer_canvas)
     # The map starts out relatively zoomed in so that the screenshot of the 
     # map generated later will have more detail.
 
+    # Regional maps are instead zoomed to fit the region. (For partitioned
+    # tables without a bounding box, the bounds are determined once the
+    # partitions have been read below.)
+    region_bounds = None
+    if bounding_box is not None:
+        region_bounds = bounding_box
+    elif (states is not None) and (partition_paths is None):
+        region_bounds = merged_data_table_copy.total_bounds
+    if region_bounds is not None:
+        m.fit_bounds([[region_bounds[1], region_bounds[0]], 
+        [region_bounds[3], region_bounds[2]]])
+
+    # If the .png version of the map will be drawn via matplotlib, each 
+    # layer is drawn onto it as it's added to the map.
+    if (generate_image == True) and (image_backend == 'matplotlib'):
+        static_image = _StaticMapImage()
+    else:
+        static_image = None
+
     # Although Folium has a choropleth library, I wasn't able to find a way
     # to disable the default legend. Therefore, I am instead using a custom
     # choropleth mapping function. Much of this function is based on 
@@ -538,33 +2394,181 @@ either \'percentiles\' or \'equally spaced.\'')
     # coordinate data within the 'geometry' column of merged_data_table_copy,
     # but I could be wrong. I'm just glad it works!
 
-    if debug == True:
-        print("Creating style function")
-
-    style_function = lambda x: {'weight':0.5, 'color': 'black', 
-    'fillColor':stepped_cm(x['properties'][data_variable]), 'fillOpacity':0.75}
-    # fillOpacity is set to 0.75 so that city and state names can be viewed
-    # underneath the colored shapes.
-
-    if debug == True:
-        print("Creating tooltip")
-
-
-    # Next, I'll create a GeoJsonTooltip object that will display the region
-    # name and data value for that region when the user hovers over it.
-    tooltip = folium.features.GeoJsonTooltip(fields=[shape_feature_name,data_variable], aliases = [feature_text, popup_variable_text])
-    # See https://python-visualization.github.io/folium/modules.html#folium.features.GeoJsonTooltip
-    # and https://python-visualization.github.io/folium/modules.html#folium.features.GeoJson
-
-    if debug == True:
-        print("Rendering map")
-
-    geojson_object = folium.features.GeoJson(merged_data_table_copy, 
-    style_function = style_function, tooltip = tooltip)
-
-
-
-    geojson_object.add_to(m)
+    if render_mode != 'choropleth':
+        timer.start_stage("Rendering " + render_mode.replace('_', ' ') +
+        " map")
+        if show_boundaries == True:
+            folium.features.GeoJson(merged_data_table_copy[
+                [shape_feature_name, data_variable, 
+                merged_data_table_copy.geometry.name]],
+            style_function = lambda x: {'weight': 0.5, 'color': 'black',
+            'fillOpacity': 0},
+            tooltip = folium.features.GeoJsonTooltip(
+                fields = [shape_feature_name, data_variable],
+                aliases = [feature_text, popup_variable_text])).add_to(m)
+            if static_image is not None:
+                static_image.add_shapes(merged_data_table_copy)
+
+        if render_mode == 'dot_density':
+            if dot_value is None:
+                # The default dot value is a round number (e.g. 500 or 1000)
+                # that produces roughly 100,000 dots.
+                total = max(bin_values.clip(lower = 0).sum() / 100000, 1)
+                magnitude = 10 ** np.floor(np.log10(total))
+                dot_value = magnitude * min([step for step in [1, 2, 5, 10]
+                if step * magnitude >= total])
+            longitudes, latitudes = _dot_density_points(
+                merged_data_table_copy.geometry.values,
+                merged_data_table_copy[data_variable], dot_value, 
+                seed = dot_seed)
+            _PointLayer(longitudes, latitudes, dot_radius, 
+            colors = [color_list[-1]], caption = '1 dot = ' + 
+            f'{dot_value:,g} ' + data_variable_text).add_to(m)
+            if static_image is not None:
+                static_image.add_points(longitudes, latitudes, dot_radius,
+                color_list[-1])
+                static_image.add_caption('1 dot = ' + f'{dot_value:,g} ' + 
+                data_variable_text)
+
+        else:
+            # Larger circles are drawn first so that they don't hide 
+            # smaller ones.
+            symbol_table = merged_data_table_copy.dropna(
+                subset = [data_variable])
+            longitudes, latitudes, radii = _proportional_symbols(
+                symbol_table.geometry.values, symbol_table[data_variable],
+                max_symbol_radius)
+            order = np.argsort(-radii, kind = 'stable')
+            # Each circle's color is based on its bin, as with choropleth 
+            # maps (see getColor within _TimeSliderLayer).
+            color_indexes = _bin_color_indexes(symbol_table[data_variable],
+            bins, len(color_list))
+            _PointLayer(longitudes[order], latitudes[order], radii[order],
+            colors = color_list, color_indexes = color_indexes[order],
+            names = symbol_table[shape_feature_name].to_numpy()[order],
+            values = symbol_table[data_variable].to_numpy()[order].tolist(),
+            feature_text = feature_text, 
+            popup_text = popup_variable_text).add_to(m)
+            if static_image is not None:
+                static_image.add_points(longitudes[order], latitudes[order],
+                radii[order], np.array(color_list)[color_indexes[order]])
+
+    elif time_variables is not None:
+        timer.start_stage("Rendering time slider map")
+        _TimeSliderLayer(merged_data_table_copy, 
+        shape_feature_name = shape_feature_name, 
+        time_variables = time_variables, bins = bins, color_list = color_list,
+        feature_text = feature_text, 
+        popup_variable_text = popup_variable_text).add_to(m)
+        if static_image is not None:
+            static_image.add_shapes(merged_data_table_copy, value_columns[0],
+            bins, color_list)
+
+    # Otherwise, the function creates a standard choropleth layer.
+    else:
+        timer.start_stage("Creating style function")
+
+        style_function = lambda x: {'weight':0.5, 'color': 'black', 
+        'fillColor':stepped_cm(x['properties'][data_variable]), 'fillOpacity':0.75}
+        # fillOpacity is set to 0.75 so that city and state names can be viewed
+        # underneath the colored shapes.
+
+        timer.start_stage("Creating tooltip")
+
+
+        # Next, I'll create a GeoJsonTooltip object that will display the region
+        # name and data value for that region when the user hovers over it.
+        tooltip = folium.features.GeoJsonTooltip(fields=[shape_feature_name,data_variable], aliases = [feature_text, popup_variable_text])
+        # See https://python-visualization.github.io/folium/modules.html#folium.features.GeoJsonTooltip
+        # and https://python-visualization.github.io/folium/modules.html#folium.features.GeoJson
+
+        timer.start_stage("Rendering map")
+
+        if partition_paths is None and payload_compression is not None:
+            sidecar_path = None
+            if payload_compression == 'sidecar':
+                sidecar_path = html_save_path+'\\'+map_name+'.geojson.gz'
+            _CompressedChoroplethLayer(merged_data_table_copy,
+            shape_feature_name = shape_feature_name,
+            data_variable = data_variable, bins = bins,
+            color_list = color_list, feature_text = feature_text,
+            popup_variable_text = popup_variable_text,
+            sidecar_path = sidecar_path, 
+            html_path = html_save_path+'\\'+map_name+'.html').add_to(m)
+            if sidecar_path is not None:
+                timer.add_output(sidecar_path)
+            if static_image is not None:
+                static_image.add_shapes(merged_data_table_copy, 
+                data_variable, bins, color_list)
+
+        elif partition_paths is None:
+            geojson_object = folium.features.GeoJson(merged_data_table_copy, 
+            style_function = style_function, tooltip = tooltip)
+
+            geojson_object.add_to(m)
+            if static_image is not None:
+                static_image.add_shapes(merged_data_table_copy, 
+                data_variable, bins, color_list)
+
+        # For partitioned tables, each partition is read (along with its
+        # shapes) and prepared one at a time. If partition_files is True,
+        # each one is then written to its own GeoJSON file, so only one
+        # partition's shapes are held in memory at once. Otherwise, each is
+        # added to the map as its own layer; Folium converts these layers
+        # to GeoJSON right away, so every partition's shapes remain in
+        # memory (and are all written to the .html file).
+        else:
+            partition_bounds = []
+            partition_urls = []
+            html_path = html_save_path+'\\'+map_name+'.html'
+            partition_folder = html_save_path+'\\'+map_name+'_partitions'
+            if partition_files == True:
+                os.makedirs(partition_folder, exist_ok = True)
+            for partition_path, partition in zip(partition_paths, 
+            iter_partitioned_table(merged_data_table,
+            partitions = state_partitions,
+            columns = [shape_feature_name] + value_columns + ['geometry'])):
+                partition = _prepare_map_values(_select_region(partition,
+                bounding_box = bounding_box), value_columns,
+                multiply_data_by, variable_decimals, rows_to_map)
+                if len(partition) == 0:
+                    continue
+                partition_bounds.append(partition.total_bounds)
+                if partition_files == True:
+                    partition_file_path = os.path.join(partition_folder, 
+                    os.path.basename(partition_path).replace('.parquet', 
+                    '.geojson'))
+                    with open(partition_file_path, 'w') as file:
+                        file.write(partition[[shape_feature_name, 
+                        data_variable, 'geometry']].to_json(
+                            drop_id = True))
+                    timer.add_output(partition_file_path)
+                    partition_urls.append(_relative_url(
+                        partition_file_path, html_path))
+                else:
+                    folium.features.GeoJson(partition, 
+                    style_function = style_function,
+                    tooltip = folium.features.GeoJsonTooltip(
+                        fields = [shape_feature_name, data_variable], 
+                        aliases = [feature_text, popup_variable_text])
+                    ).add_to(m)
+                if static_image is not None:
+                    static_image.add_shapes(partition, data_variable, bins,
+                    color_list)
+            if partition_files == True:
+                _PartitionFilesLayer(list(zip(partition_urls, 
+                partition_bounds)), shape_feature_name = shape_feature_name,
+                data_variable = data_variable, bins = bins,
+                color_list = color_list, feature_text = feature_text,
+                popup_variable_text = popup_variable_text).add_to(m)
+            if (states is not None) and (bounding_box is None) and (
+                len(partition_bounds) > 0):
+                partition_bounds = np.array(partition_bounds)
+                region_bounds = [partition_bounds[:, 0].min(), 
+                partition_bounds[:, 1].min(), partition_bounds[:, 2].max(),
+                partition_bounds[:, 3].max()]
+                m.fit_bounds([[region_bounds[1], region_bounds[0]], 
+                [region_bounds[3], region_bounds[2]]])
 
     
 
@@ -595,16 +2599,20 @@ either \'percentiles\' or \'equally spaced.\'')
     # m.keep_in_front(data_popup)
     # folium.LayerControl().add_to(m)
 
-    if debug == True:
-        print("Creating vertical legend (if requested)")
+    timer.start_stage("Creating vertical legend (if requested)")
 
     # The function next calls create_vertical_legend to add a vertical
-    # legend to the map (if requested).
-    if vertical_legend == True:
+    # legend to the map (if requested). (Dot density maps use the caption
+    # added by _PointLayer as their legend instead.)
+    if render_mode == 'dot_density':
+        pass
+
+    elif vertical_legend == True:
         create_vertical_legend(color_list = color_list, bins = bins, 
         map_name = map_name, data_variable_text = data_variable_text, 
         path_to_legends = html_save_path, 
         variable_decimals = variable_decimals)
+        timer.add_output(html_save_path+'\\'+map_name+'_legend.svg')
         # stepped_cm.colors can be used in place of color_list, but
         # they should have the same values anyway
         # print("Loading from:",path_to_legends+map_name+'_legend.svg')
@@ -625,17 +2633,32 @@ either \'percentiles\' or \'equally spaced.\'')
         stepped_cm.caption = data_variable_text
         stepped_cm.add_to(m)
 
-    if debug == True:
-        print("Saving map")
+    timer.start_stage("Saving map")
 
 
     m.save(html_save_path+'\\'+map_name+'.html')
+    timer.add_output(html_save_path+'\\'+map_name+'.html')
+    for copy_path in _write_precompressed_copies(
+        html_save_path+'\\'+map_name+'.html', precompressed_formats):
+        timer.add_output(copy_path)
+
+    timer.start_stage("Generating screenshot")
+
+    if static_image is not None:
+        # The matplotlib backend draws the legend itself rather than
+        # rendering the map's legend within a browser.
+        if render_mode != 'dot_density':
+            static_image.add_legend(bins, color_list, data_variable_text,
+            variable_decimals, vertical = vertical_legend)
+        if len(screenshot_save_path) > 0:
+            image_path = screenshot_save_path+'\\'+map_name+'.png'
+        else:
+            image_path = map_name+'.png'
+        static_image.save(image_path, bounds = region_bounds, 
+        basemap_tiles_path = basemap_tiles_path)
+        timer.add_output(image_path)
 
-    if debug == True:
-        print("Generating screenshot")
-
-
-    if generate_image == True:
+    elif generate_image == True:
 
         # Finally, the function uses the Selenium library to create a screenshot 
         # of the map so that it can be shared as a .png file.
@@ -655,53 +2678,705 @@ either \'percentiles\' or \'equally spaced.\'')
         # respond differently to the set_window_size option, so the Chrome
         # images ended up having a lower resolution.
 
-        # This section uses code from https://www.selenium.dev/documentation/webdriver/drivers/options/ 
-        options = Options() 
-        # The following two lines come from user 'undetected Selenium' at:
-        # # Based on https://stackoverflow.com/a/55016352/13097194
-        options.add_argument("--headless") # This ended up being necessary
-        # in order to set the width and height (as verified by get_window_size()
-        # below() equal to window_width and window_height. Without headless
-        # mode, the window ended up being significantly smaller.)
-        # options.add_argument(f"window-size={window_width},{window_height}")
-        ff_driver = webdriver.Chrome(options=options)
-
-        window_width = 3000 # This produces a large window that can better
-        # capture small details (such as zip code shapefiles).
-        window_height = window_width * 9/16
-
-        ff_driver.set_window_size(window_width,window_width*(9/16))
-        # Based on https://stackoverflow.com/a/55016352/13097194
-        print(ff_driver.get_window_size())
-
-        ff_driver.get(html_save_path+'\\'+map_name+'.html') 
-        # See https://www.selenium.dev/documentation/webdriver/browser/navigation/
-        time.sleep(2) # This gives the page sufficient
-        # time to load the map tiles before the screenshot is taken. 
-        # You can also experiment with longer sleep times.
-
+        # The Chrome-specific code is found within create_screenshot_driver and
+        # capture_screenshot below. (capture_screenshots, also below, can
+        # take screenshots of many saved maps at once.)
         if len(screenshot_save_path) > 0:
-            screenshot_image = ff_driver.get_screenshot_as_file(
-            screenshot_save_path+'\\'+map_name+'.png') 
-
-        # Based on:
-        # https://www.selenium.dev/selenium/docs/api/java/org/openqa/selenium/TakesScreenshot.html
+            image_path = screenshot_save_path+'\\'+map_name+'.png'
+        else:
+            image_path = map_name+'.png'
         # If specifying a screenshot save path, you must create this path
         # within your directory before the function is run; otherwise,
         # it won't return an image. Relative paths (e.g. 
         # 'folium_map_screenshots') should work fine.
 
-        else: 
-            ff_driver.get_screenshot_as_file(map_name+'.png') 
+        ff_driver = create_screenshot_driver()
+        try:
+            capture_screenshot(ff_driver, html_save_path+'\\'+map_name+'.html',
+            image_path)
+        finally:
+            ff_driver.quit()
+            # Based on: https://www.selenium.dev/documentation/webdriver/browser/windows/
+        timer.add_output(image_path)
 
+    timer.finish()
 
-        ff_driver.quit()
-        # Based on: https://www.selenium.dev/documentation/webdriver/browser/windows/
+    return m
 
-    if debug == True:
-        print("Returning map")
 
-    return m
+def create_screenshot_driver(window_width = 3000, verbose = True):
+    '''Starts a headless Chrome window for taking screenshots of maps.
+    The window's height is 9/16 of its width. Call the driver's quit()
+    method once you're finished with it.'''
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    # This section uses code from https://www.selenium.dev/documentation/webdriver/drivers/options/ 
+    options = Options() 
+    # The following two lines come from user 'undetected Selenium' at:
+    # # Based on https://stackoverflow.com/a/55016352/13097194
+    options.add_argument("--headless") # This ended up being necessary
+    # in order to set the width and height (as verified by get_window_size()
+    # below() equal to window_width and window_height. Without headless
+    # mode, the window ended up being significantly smaller.)
+    # options.add_argument(f"window-size={window_width},{window_height}")
+    ff_driver = webdriver.Chrome(options=options)
+
+    # The default window_width of 3000 produces a large window that can 
+    # better capture small details (such as zip code shapefiles).
+    window_height = window_width * 9/16
+
+    ff_driver.set_window_size(window_width,window_height)
+    # Based on https://stackoverflow.com/a/55016352/13097194
+    if verbose == True:
+        print(ff_driver.get_window_size())
+    return ff_driver
+
+
+def capture_screenshot(driver, html_path, image_path, load_seconds = 2):
+    '''Opens the map at html_path within driver (created by 
+    create_screenshot_driver) and saves a screenshot of it to image_path.
+    Returns False if the screenshot couldn't be saved (e.g. because the
+    folder within image_path doesn't exist).'''
+    # Browsers expect a URL rather than a file path, so local paths are
+    # converted into file:// URLs first.
+    if '://' not in html_path:
+        html_path = pathlib.Path(html_path).resolve().as_uri()
+    driver.get(html_path) 
+    # See https://www.selenium.dev/documentation/webdriver/browser/navigation/
+    time.sleep(load_seconds) # This gives the page sufficient
+    # time to load the map tiles before the screenshot is taken. 
+    # You can also experiment with longer sleep times.
+
+    return driver.get_screenshot_as_file(image_path)
+    # Based on:
+    # https://www.selenium.dev/selenium/docs/api/java/org/openqa/selenium/TakesScreenshot.html
+
+
+def _available_memory_bytes():
+    '''Returns the amount of memory available for new processes, or None
+    if it can't be determined.'''
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def capture_screenshots(html_paths, image_paths = None, max_browsers = None,
+memory_per_browser = 768 * 1024 ** 2, retries = 2, load_seconds = 2,
+window_width = 3000, verbose = True):
+    '''Takes screenshots of many saved .html maps at once, using several
+    headless Chrome windows that each work through the queue of maps.
+    Each window is reused for all of the maps it captures, which avoids the
+    cost of starting Chrome for every map.
+
+    html_paths: The paths to the .html maps.
+
+    image_paths: The paths to which the screenshots should be saved. By 
+    default, each screenshot is saved alongside its map (with a .png 
+    extension).
+
+    max_browsers: The maximum number of Chrome windows to run at once. If
+    this is None, the number of CPU cores is used, reduced if necessary so
+    that each window has memory_per_browser bytes of the currently 
+    available memory. (3000-pixel-wide screenshots of zip code maps can
+    require several hundred MB per window.)
+
+    retries: The number of additional attempts to make for each map if
+    Chrome fails to capture it. The window is restarted before each retry.
+
+    Returns a DataFrame listing each map's status ('captured' or 'failed'),
+    number of attempts, latency in seconds, and error (if any). If verbose
+    is True, the overall throughput and latency percentiles are also
+    printed.'''
+    from selenium.common.exceptions import WebDriverException
+    html_paths = list(html_paths)
+    if image_paths is None:
+        image_paths = [os.path.splitext(html_path)[0]+'.png' 
+        for html_path in html_paths]
+    if max_browsers is None:
+        max_browsers = os.cpu_count() or 1
+        available_memory = _available_memory_bytes()
+        if available_memory is not None:
+            max_browsers = min(max_browsers, 
+            available_memory // memory_per_browser)
+    max_browsers = max(1, min(int(max_browsers), len(html_paths)))
+
+    # Each thread keeps its own Chrome window between maps. All windows are
+    # also tracked in drivers so that they can be closed at the end.
+    thread_data = threading.local()
+    drivers = []
+    drivers_lock = threading.Lock()
+
+    def get_driver():
+        if getattr(thread_data, 'driver', None) is None:
+            thread_data.driver = create_screenshot_driver(window_width,
+            verbose = False)
+            with drivers_lock:
+                drivers.append(thread_data.driver)
+        return thread_data.driver
+
+    def discard_driver():
+        driver = thread_data.driver
+        thread_data.driver = None
+        with drivers_lock:
+            if driver in drivers:
+                drivers.remove(driver)
+        try:
+            driver.quit()
+        except (WebDriverException, OSError):
+            pass
+
+    def capture(job):
+        html_path, image_path = job
+        start_time = time.perf_counter()
+        error = None
+        for attempt in range(1, retries + 2):
+            try:
+                if not capture_screenshot(get_driver(), html_path, 
+                image_path, load_seconds = load_seconds):
+                    raise OSError('Error: the screenshot couldn\'t be \
+saved to '+image_path+'.')
+                error = None
+                break
+            except (OSError, WebDriverException) as exception:
+                # The window may have crashed or been left in a bad state,
+                # so it's restarted before the next attempt.
+                error = repr(exception)
+                if getattr(thread_data, 'driver', None) is not None:
+                    discard_driver()
+        return {'html_path': html_path, 'image_path': image_path,
+        'status': 'captured' if error is None else 'failed',
+        'attempts': attempt, 
+        'seconds': time.perf_counter() - start_time, 'error': error}
+
+    start_time = time.perf_counter()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers = max_browsers) as executor:
+            results = list(executor.map(capture, 
+            zip(html_paths, image_paths)))
+    finally:
+        for driver in drivers:
+            try:
+                driver.quit()
+            except (WebDriverException, OSError):
+                pass
+    total_seconds = time.perf_counter() - start_time
+
+    results = pd.DataFrame(results)
+    if verbose == True and len(results) > 0:
+        print(f"Captured {(results['status'] == 'captured').sum()} of \
+{len(results)} maps in {total_seconds:.1f} s using {max_browsers} browsers \
+({len(results) / total_seconds:.2f} maps/s); latency median \
+{results['seconds'].median():.2f} s, p95 \
+{results['seconds'].quantile(0.95):.2f} s")
+    return results
+
+
+def _optimize_screenshot(image_path, output_folder, formats, quality,
+thumbnail_width, png_colors):
+    '''Re-encodes a single screenshot in each of the requested formats and
+    creates its thumbnail. Returns one record per file written.'''
+    from PIL import Image
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    original_bytes = os.path.getsize(image_path)
+    records = []
+    with Image.open(image_path) as image:
+        # Chrome's screenshots include an (unused) alpha channel, which 
+        # JPEG doesn't support and which only adds to the other formats'
+        # sizes.
+        image = image.convert('RGB')
+        outputs = []
+        for image_format in formats:
+            if image_format == 'png':
+                # Maps contain relatively few distinct colors, so reducing
+                # them to a palette (if png_colors is set) shrinks PNGs 
+                # considerably.
+                png_image = image if png_colors is None else image.quantize(
+                    colors = png_colors)
+                outputs.append(('png', os.path.join(output_folder, 
+                stem+'_optimized.png'), png_image, {'optimize': True}))
+            elif image_format == 'webp':
+                outputs.append(('webp', os.path.join(output_folder,
+                stem+'_q'+str(quality)+'.webp'), image, 
+                {'quality': quality, 'method': 6}))
+            elif image_format == 'jpg':
+                outputs.append(('jpg', os.path.join(output_folder,
+                stem+'_q'+str(quality)+'.jpg'), image, 
+                {'quality': quality, 'optimize': True, 
+                'progressive': True}))
+            else:
+                raise ValueError('Error: image format not recognized. \
+Image formats should be \'png\', \'webp\', or \'jpg\'.')
+        if thumbnail_width is not None:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((thumbnail_width, thumbnail_width))
+            if len(outputs) > 0:
+                thumbnail_format, save_options = outputs[0][0], outputs[0][3]
+            else:
+                thumbnail_format, save_options = 'png', {'optimize': True}
+            outputs.append(('thumbnail', os.path.join(output_folder, 
+            stem+'_thumb.'+thumbnail_format), thumbnail, save_options))
+        for kind, output_path, output_image, save_options in outputs:
+            output_image.save(output_path, **save_options)
+            output_bytes = os.path.getsize(output_path)
+            records.append({'image_path': image_path, 'kind': kind,
+            'output_path': output_path, 'original_bytes': original_bytes,
+            'output_bytes': output_bytes, 
+            'bytes_saved': original_bytes - output_bytes})
+    return records
+
+
+def optimize_screenshots(image_paths = 'census_folium_map_screenshots', 
+output_folder = None, formats = ('png', 'webp'), quality = 80,
+thumbnail_width = 600, png_colors = None, max_workers = None, 
+verbose = True):
+    '''Creates smaller versions of map screenshots (which are 2-3.5 MB each
+    at a width of 3000 pixels) for publishing. The screenshots are 
+    processed in parallel across all CPU cores (or max_workers processes).
+
+    image_paths: A list of .png screenshots, or the path to a folder of
+    them. (Files created by this function are skipped when a folder is
+    passed.)
+
+    output_folder: The folder in which to save the new files. By default,
+    each file is saved alongside its screenshot.
+
+    formats: The formats to create: 'png' (an optimized PNG, saved as
+    <name>_optimized.png), 'webp', and/or 'jpg' (saved as 
+    <name>_q<quality>.webp or .jpg).
+
+    quality: The quality setting (0-100) for WebP and JPEG files.
+
+    thumbnail_width: The width of the thumbnail (saved as <name>_thumb,
+    in the first of the formats) to create for each screenshot, or None
+    to skip thumbnails.
+
+    png_colors: If set (e.g. to 256), optimized PNGs are reduced to a 
+    palette of this many colors, which makes them several times smaller
+    at the cost of slight color changes within the tile background.
+
+    Returns a DataFrame listing each file created along with its size and
+    the number of bytes saved relative to the original screenshot.'''
+    if isinstance(image_paths, str):
+        image_paths = [path for path in sorted(glob.glob(os.path.join(
+            image_paths, '*.png'))) if not re.search(
+                r'(_optimized|_thumb)\.png$', path)]
+    jobs = []
+    for image_path in image_paths:
+        folder = output_folder if output_folder is not None else \
+            os.path.dirname(image_path)
+        if len(folder) > 0:
+            os.makedirs(folder, exist_ok = True)
+        jobs.append((image_path, folder, tuple(formats), quality,
+        thumbnail_width, png_colors))
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers = max_workers) as executor:
+        records = [record for image_records in executor.map(
+            _optimize_screenshot, *zip(*jobs)) for record in image_records
+            ] if len(jobs) > 0 else []
+
+    report = pd.DataFrame(records, columns = ['image_path', 'kind',
+    'output_path', 'original_bytes', 'output_bytes', 'bytes_saved'])
+    if verbose == True:
+        for kind, kind_report in report.groupby('kind'):
+            original_bytes = kind_report['original_bytes'].sum()
+            output_bytes = kind_report['output_bytes'].sum()
+            print(f"{kind}: {len(kind_report)} files, {original_bytes:,} \
+bytes -> {output_bytes:,} bytes ({original_bytes / max(output_bytes, 1):.1f}x \
+smaller)")
+    return report
+
+
+def _bin_color_indexes(values, bins, color_count):
+    '''Returns the position (within the color list) of the color for each
+    value, matching branca's StepColormap (and getColor within 
+    _TimeSliderLayer).'''
+    return np.clip(np.searchsorted(np.asarray(bins)[1:-1], 
+    np.asarray(values, dtype = 'float64'), side = 'right'), 0, 
+    color_count - 1)
+
+
+class _StaticMapImage:
+    '''This class draws a map directly onto a matplotlib figure (using the
+    Agg backend) rather than taking a screenshot of the .html map within
+    Chrome. By default, the image covers the same area, at the same
+    resolution, as generate_map's 3000x1687 screenshots (i.e. a 
+    Web Mercator view centered on [38.7, -95] at zoom level 6).
+
+    Shapes and points are added via add_shapes and add_points; the image is
+    then written by save, which also adds any basemap tiles that are 
+    available within a local tile cache.'''
+
+    earth_radius = 6378137
+    # The width, in meters, of a single 256-pixel tile at zoom level 0
+    world_width = 2 * np.pi * earth_radius
+
+    def __init__(self, width = 3000, height = 1687, center = (38.7, -95),
+    zoom = 6):
+        self.width = width
+        self.height = height
+        self.center = center
+        self.zoom = zoom
+        # The figure is created without pyplot so that images can be
+        # rendered within several processes (or threads) at once.
+        from matplotlib.figure import Figure
+        self.figure = Figure(figsize = (width / 100, height / 100), 
+        dpi = 100)
+        self.axes = self.figure.add_axes([0, 0, 1, 1])
+        self.axes.set_axis_off()
+
+    @classmethod
+    def _to_mercator(cls, longitudes, latitudes):
+        longitudes = np.radians(np.asarray(longitudes, dtype = 'float64'))
+        latitudes = np.radians(np.clip(np.asarray(latitudes, 
+        dtype = 'float64'), -85.0511, 85.0511))
+        return (cls.earth_radius * longitudes, 
+        cls.earth_radius * np.log(np.tan(np.pi / 4 + latitudes / 2)))
+
+    def add_shapes(self, table, value_column = None, bins = None, 
+    color_list = None):
+        '''Draws the shapes within table, colored based on value_column
+        (or, if value_column is None, as outlines only).'''
+        shapes = table[[table.geometry.name]]
+        if shapes.crs is None:
+            shapes = shapes.set_crs(4326)
+        shapes = shapes.to_crs(3857)
+        if value_column is None:
+            face_colors = 'none'
+        else:
+            values = table[value_column].to_numpy(dtype = 'float64')
+            face_colors = np.array(color_list, dtype = object)[
+                _bin_color_indexes(values, bins, len(color_list))]
+            face_colors[np.isnan(values)] = 'none'
+        # These settings match the style_function within generate_map.
+        # (Leaflet's 0.5-pixel lines are equivalent to 0.36 points at
+        # 100 DPI.)
+        shapes.plot(ax = self.axes, color = face_colors, edgecolor = 'black',
+        linewidth = 0.36, alpha = 0.75 if value_column is not None else 1)
+
+    def add_points(self, longitudes, latitudes, radii, colors):
+        '''Draws circles (dot density dots or proportional symbols) whose
+        radii are specified in pixels.'''
+        x, y = self._to_mercator(longitudes, latitudes)
+        # scatter sizes are areas in points squared (at 100 DPI, one pixel
+        # is 0.72 points).
+        self.axes.scatter(x, y, s = np.pi * (np.asarray(radii) * 0.72) ** 2,
+        c = colors, edgecolors = 'none', zorder = 3)
+
+    def add_legend(self, bins, color_list, data_variable_text, 
+    variable_decimals, vertical = False):
+        '''Adds a legend in the same position as the map's legend: a 
+        horizontal color bar in the top right corner or, if vertical is True,
+        a vertical legend towards the bottom right (where generate_map
+        places the FloatImage created by create_vertical_legend).'''
+        labels = [round(value, variable_decimals) for value in bins]
+        if vertical == True:
+            legend_axes = self.figure.add_axes([0.85, 0.2, 0.02, 0.4])
+            legend_axes.barh(y = range(len(color_list)), width = 1, 
+            height = 1, color = color_list)
+            legend_axes.set_yticks(np.arange(len(bins)) - 0.5, labels = labels,
+            fontweight = 'bold', size = 12)
+            legend_axes.yaxis.tick_right()
+            legend_axes.set_title(data_variable_text, size = 12, wrap = True)
+        else:
+            legend_axes = self.figure.add_axes([0.7, 0.94, 0.28, 0.015])
+            legend_axes.barh(y = 0, width = 1, height = 1, 
+            left = range(len(color_list)), color = color_list)
+            legend_axes.set_xticks(np.arange(len(bins)), labels = labels,
+            size = 10)
+            legend_axes.set_title(data_variable_text, size = 10, loc = 'left')
+            legend_axes.set_yticks([])
+        legend_axes.set_facecolor('white')
+        for spine in legend_axes.spines.values():
+            spine.set_visible(False)
+
+    def add_caption(self, text):
+        '''Adds a caption (such as the dot value of a dot density map) in 
+        the bottom right corner.'''
+        self.axes.text(0.99, 0.02, text, transform = self.axes.transAxes,
+        ha = 'right', va = 'bottom', size = 16, zorder = 4,
+        bbox = {'facecolor': 'white', 'edgecolor': 'black'})
+
+    def _add_basemap(self, tiles_path, left, right, bottom, top):
+        '''Draws any tiles within the view that exist within tiles_path, 
+        a path containing {z}, {x}, and {y} placeholders 
+        (e.g. 'tile_cache/{z}/{x}/{y}.png'). Missing tiles are skipped.'''
+        meters_per_pixel = (right - left) / self.width
+        zoom = int(np.clip(np.round(np.log2(self.world_width / 256 / 
+        meters_per_pixel)), 0, 19))
+        import matplotlib.image
+        tile_width = self.world_width / 2 ** zoom
+        origin = self.world_width / 2
+        first_x, last_x = [int((value + origin) // tile_width) for value 
+        in [left, right]]
+        first_y, last_y = [int((origin - value) // tile_width) for value 
+        in [top, bottom]]
+        for tile_x in range(max(first_x, 0), min(last_x, 2 ** zoom - 1) + 1):
+            for tile_y in range(max(first_y, 0), 
+            min(last_y, 2 ** zoom - 1) + 1):
+                tile_path = tiles_path.format(z = zoom, x = tile_x, 
+                y = tile_y)
+                if not os.path.exists(tile_path):
+                    continue
+                tile_left = tile_x * tile_width - origin
+                tile_top = origin - tile_y * tile_width
+                self.axes.imshow(matplotlib.image.imread(tile_path), 
+                extent = [tile_left, tile_left + tile_width, 
+                tile_top - tile_width, tile_top], 
+                interpolation = 'bilinear', zorder = 0)
+
+    def save(self, image_path, bounds = None, basemap_tiles_path = None):
+        '''Saves the image as a .png file. If bounds (a (min_longitude,
+        min_latitude, max_longitude, max_latitude) tuple) is provided, the 
+        image is fitted to those bounds; otherwise, it shows the default
+        view described above.'''
+        if bounds is None:
+            center_x, center_y = self._to_mercator(self.center[1], 
+            self.center[0])
+            meters_per_pixel = self.world_width / 256 / 2 ** self.zoom
+            half_width = self.width / 2 * meters_per_pixel
+            half_height = self.height / 2 * meters_per_pixel
+        else:
+            x, y = self._to_mercator([bounds[0], bounds[2]], 
+            [bounds[1], bounds[3]])
+            center_x, center_y = x.mean(), y.mean()
+            # The view is expanded along one axis so that the image isn't 
+            # stretched.
+            half_width = max(x[1] - x[0], (y[1] - y[0]) * self.width / 
+            self.height) / 2 * 1.02
+            half_height = half_width * self.height / self.width
+        left, right = center_x - half_width, center_x + half_width
+        bottom, top = center_y - half_height, center_y + half_height
+        if basemap_tiles_path is not None:
+            self._add_basemap(basemap_tiles_path, left, right, bottom, top)
+        self.axes.set_xlim(left, right)
+        self.axes.set_ylim(bottom, top)
+        self.figure.savefig(image_path, dpi = 100, facecolor = 'white')
+
+
+def _generate_map_worker(map_spec):
+    '''Calls generate_map within a worker process and returns the record
+    created by its StageTimer.'''
+    if isinstance(map_spec['merged_data_table'], SharedTable):
+        map_spec = dict(map_spec, 
+        merged_data_table = map_spec['merged_data_table'].table())
+    records = []
+    generate_map(**map_spec, stats_callback = records.append)
+    return records[0]
+
+
+def generate_maps(map_specs, max_workers = None, share_tables = False):
+    '''Calls generate_map for each of the maps within map_specs (a list of
+    dictionaries of generate_map arguments) in parallel, using up to
+    max_workers processes. This works best with image_backend = 
+    'matplotlib', as each process can then render its own .png image
+    without starting a copy of Chrome.
+
+    share_tables: If True, each distinct merged_data_table is placed into 
+    shared memory (see SharedTable) once, rather than being pickled and
+    sent to the workers along with every map that uses it. This can 
+    greatly reduce the workers' startup time and memory usage for large
+    tables (see compare_table_handoff within census_folium_benchmarks.py).
+
+    Returns a DataFrame containing the StageTimer record for each map.'''
+    map_specs = [{key: value for key, value in map_spec.items() 
+    if key != 'stats_callback'} for map_spec in map_specs]
+    shared_tables = {}
+    try:
+        if share_tables == True:
+            for map_spec in map_specs:
+                table = map_spec['merged_data_table']
+                if isinstance(table, geopandas.GeoDataFrame):
+                    if id(table) not in shared_tables:
+                        shared_tables[id(table)] = SharedTable(table)
+                    map_spec['merged_data_table'] = shared_tables[id(table)]
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers = max_workers) as executor:
+            records = list(executor.map(_generate_map_worker, map_specs))
+    finally:
+        for shared_table in shared_tables.values():
+            shared_table.unlink()
+    return pd.DataFrame(records)
+
+
+def _map_output_paths(map_arguments):
+    '''Returns the paths of the files that generate_map will create for the
+    given (fully bound) generate_map arguments.'''
+    html_save_path = map_arguments['html_save_path']
+    map_name = map_arguments['map_name']
+    output_paths = [html_save_path+'\\'+map_name+'.html']
+    if map_arguments['partition_files'] == True:
+        output_paths.append(html_save_path+'\\'+map_name+'_partitions')
+    if map_arguments['payload_compression'] == 'sidecar':
+        output_paths.append(html_save_path+'\\'+map_name+'.geojson.gz')
+    output_paths.extend([html_save_path+'\\'+map_name+'.html'+extension
+    for compression_format, extension in [('gzip', '.gz'), 
+    ('brotli', '.br')] if compression_format in map_arguments[
+        'precompressed_formats']])
+    if map_arguments['vertical_legend'] == True:
+        output_paths.append(html_save_path+'\\'+map_name+'_legend.svg')
+    if map_arguments['generate_image'] == True:
+        if len(map_arguments['screenshot_save_path']) > 0:
+            output_paths.append(
+                map_arguments['screenshot_save_path']+'\\'+map_name+'.png')
+        else:
+            output_paths.append(map_name+'.png')
+    return output_paths
+
+
+def _hash_map_inputs(map_arguments):
+    '''Calculates hashes of the four inputs that determine a map's output:
+    the merged data table, the other generate_map parameters, the color
+    scheme, and the source code of this module.'''
+    table = map_arguments['merged_data_table']
+    if isinstance(table, str):
+        # For partitioned tables, the partition files themselves are hashed.
+        table_hash = hashlib.sha256()
+        for partition_path in list_table_partitions(table):
+            table_hash.update(os.path.basename(partition_path).encode())
+            with open(partition_path, 'rb') as file:
+                table_hash.update(file.read())
+        table = None
+    if map_arguments['time_variables'] is not None:
+        value_columns = list(map_arguments['time_variables'].values())
+    else:
+        value_columns = [map_arguments['data_variable']]
+    # Only the columns that generate_map actually uses are hashed, so adding
+    # unrelated columns to a table won't cause its maps to be rebuilt.
+    attribute_columns = [map_arguments['shape_feature_name']] + value_columns
+    # The state column determines which rows a states filter keeps, so it's
+    # hashed as well when that filter is used.
+    if map_arguments['states'] is not None:
+        attribute_columns.append(map_arguments['state_column'])
+    if table is not None:
+        table_hash = hashlib.sha256()
+        table_hash.update(json.dumps([attribute_columns, [str(dtype) for 
+        dtype in table[attribute_columns].dtypes]]).encode())
+        table_hash.update(pd.util.hash_pandas_object(
+            table[attribute_columns], index = False).to_numpy().tobytes())
+        table_hash.update(pd.util.hash_pandas_object(
+            table.geometry.to_wkb(), index = False).to_numpy().tobytes())
+
+    # Arguments that only affect logging are excluded from the hash.
+    parameters = {key: value for key, value in map_arguments.items()
+    if key not in ['merged_data_table', 'debug', 'stats_callback', 
+    'stats_log_path', 'profile_memory']}
+    parameter_hash = hashlib.sha256(json.dumps(parameters, sort_keys = True,
+    default = str).encode())
+
+    with open('color_schemes_from_branca.json') as file:
+        color_dict = dict(json.loads(file.read()))
+    color_list = color_dict.get(map_arguments['fill_color']+'_'+str(
+        map_arguments['bin_count']).zfill(2))
+    color_hash = hashlib.sha256(json.dumps(color_list).encode())
+
+    with open(__file__, 'rb') as file:
+        module_hash = hashlib.sha256(file.read())
+
+    return {'merged_table': table_hash.hexdigest(),
+    'map_parameters': parameter_hash.hexdigest(),
+    'color_scheme': color_hash.hexdigest(),
+    'module_version': module_hash.hexdigest()}
+
+
+def load_build_manifest(manifest_path = 'build_manifest.json'):
+    '''Reads the build manifest written by rebuild_maps. An empty manifest
+    is returned if the file doesn't exist yet.'''
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as file:
+        return json.loads(file.read())
+
+
+def rebuild_maps(map_specs, manifest_path = 'build_manifest.json',
+force = False, verbose = True):
+    '''This function calls generate_map for each map whose inputs have
+    changed since it was last built, and skips the rest. This allows the
+    tutorial notebooks to be re-run without recreating every .html map,
+    legend, and screenshot when only one dataset has changed.
+
+    map_specs: A list of dictionaries, each of which contains the arguments
+    to pass to generate_map for a given map (including merged_data_table).
+
+    manifest_path: The path to a .json file that records, for each map
+    (identified by the path to its .html file, since maps with the same
+    name can be saved to different folders), hashes of its merged data
+    table, its other generate_map parameters, its color scheme, and this
+    module's source code, along with the list of files it produced. A map
+    is considered up to date if all four hashes match the manifest and all
+    of its output files still exist.
+
+    force: Set to True to rebuild every map regardless of the manifest.
+
+    verbose: When True, the function prints the action taken for each
+    map along with the reason for that action.
+
+    The function returns a DataFrame listing each map, whether it was
+    rebuilt or skipped, and why.
+    '''
+    manifest = load_build_manifest(manifest_path)
+    signature = inspect.signature(generate_map)
+    report = []
+
+    for map_spec in map_specs:
+        # Binding the arguments to generate_map's signature fills in any
+        # default values, so changes to those defaults are also detected.
+        map_arguments = signature.bind(**map_spec)
+        map_arguments.apply_defaults()
+        map_arguments = dict(map_arguments.arguments)
+        map_name = map_arguments['map_name']
+        input_hashes = _hash_map_inputs(map_arguments)
+        output_paths = _map_output_paths(map_arguments)
+        # The first output path is the .html file itself.
+        manifest_key = output_paths[0]
+        previous_build = manifest.get(manifest_key)
+
+        if force == True:
+            reason = 'rebuild forced'
+        elif previous_build is None:
+            reason = 'no previous build recorded'
+        else:
+            changed_inputs = [input_name for input_name in input_hashes 
+            if input_hashes[input_name] != previous_build['inputs'].get(
+                input_name)]
+            missing_outputs = [output_path for output_path in output_paths 
+            if not os.path.exists(output_path)]
+            if len(changed_inputs) > 0:
+                reason = 'changed inputs: '+', '.join(changed_inputs)
+            elif len(missing_outputs) > 0:
+                reason = 'missing outputs: '+', '.join(missing_outputs)
+            else:
+                reason = None
+
+        if reason is None:
+            action = 'skipped'
+            reason = 'inputs unchanged and outputs present (built '+\
+                previous_build['built_at']+')'
+        else:
+            action = 'rebuilt'
+            generate_map(**map_spec)
+            manifest[manifest_key] = {'inputs': input_hashes,
+            'outputs': output_paths,
+            'built_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+            # The manifest is saved after each map so that progress isn't
+            # lost if a later map fails.
+            with open(manifest_path, 'w') as file:
+                file.write(json.dumps(manifest, indent = 2))
+
+        if verbose == True:
+            print(f"{map_name}: {action} ({reason})")
+        report.append({'map_name': map_name, 'action': action,
+        'reason': reason})
+
+    return pd.DataFrame(report)
 
 
 def old_generate_map(merged_data_table, shape_feature_name, 
@@ -840,6 +3515,7 @@ def old_generate_map(merged_data_table, shape_feature_name,
 
     if generate_image == True:
 
+        from selenium import webdriver
         ff_driver = webdriver.Firefox() 
         # See https://www.selenium.dev/documentation/webdriver/getting_started/open_browser/
         # For more information on using Selenium to get screenshots of .html 
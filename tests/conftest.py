@@ -0,0 +1,7 @@
+# The modules being tested live within the project's root folder rather
+# than within a package, so that folder is added to the import path.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
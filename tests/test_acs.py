@@ -0,0 +1,119 @@
+import http.server
+import json
+import threading
+import urllib.parse
+
+import pytest
+
+import census_folium_acs
+
+
+class _StubCensusHandler(http.server.BaseHTTPRequestHandler):
+    '''Mimics the Census API: each variable's value is its number within
+    the variable code (e.g. 61 for B01001_061E) plus the row number.
+    Requests for 2009 match no data, and the first two requests for 2019
+    are answered as though the API were busy.'''
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        year = url.path.split('/')[1]
+        with self.server.lock:
+            self.server.requests.append(query)
+            self.server.attempts[year] = self.server.attempts.get(
+                year, 0) + 1
+            attempt = self.server.attempts[year]
+        if year == '2019' and attempt <= 2:
+            self._send([429, 503][attempt - 1], b'busy')
+            return
+        if year == '2009':
+            self._send(204, b'')
+            return
+        codes = query['get'][0].split(',')[1:]
+        rows = [['NAME'] + codes + ['state', 'county']]
+        for row, (name, state, county) in enumerate([
+            ('Autauga County, Alabama', '01', '001'),
+            ('Stark County, Ohio', '39', '151')]):
+            rows.append([name] + [str(int(code[7:10]) + row)
+            for code in codes] + [state, county])
+        self._send(200, json.dumps(rows).encode())
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+    _StubCensusHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.attempts = {}
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _client(server, cache_folder):
+    return census_folium_acs.CensusClient(
+        base_url = 'http://127.0.0.1:'+str(server.server_port),
+        cache_folder = str(cache_folder), requests_per_second = 1000,
+        backoff_seconds = 0)
+
+
+def test_large_queries_are_split_and_merged(stub_server, tmp_path):
+    codes = ['B01001_'+str(number).zfill(3)+'E' for number in range(1, 61)]
+    table = _client(stub_server, tmp_path).fetch_all([{'year': 2021,
+    'variables': codes, 'geography': 'county'}])[0]
+    # 60 variables require two requests (49 variables, then 11).
+    assert sorted(len(query['get'][0].split(',')) for query in
+    stub_server.requests) == [12, 50]
+    assert all(query['in'] == ['state:*'] for query in stub_server.requests)
+    assert list(table.columns) == ['NAME', 'Year', 'state', 'county'] + codes
+    assert list(table['state']) == [1, 39]
+    assert list(table['Year']) == [2021, 2021]
+    assert list(table['B01001_001E']) == [1, 2]
+    assert list(table['B01001_060E']) == [60, 61]
+
+
+def test_busy_responses_are_retried(stub_server, tmp_path):
+    client = _client(stub_server, tmp_path)
+    table = client.fetch_all([{'year': 2019, 'variables': {
+        'B01003_001E': 'Total_population'}, 'geography': 'county'}])[0]
+    assert list(table['Total_population']) == [1, 2]
+    assert client.stats == {'requests': 3, 'cache_hits': 0, 'retries': 2}
+
+
+def test_queries_without_data_return_empty_tables(stub_server, tmp_path):
+    table = _client(stub_server, tmp_path).fetch_all([{'year': 2009,
+    'variables': {'B01003_001E': 'Total_population'},
+    'geography': 'county'}])[0]
+    assert len(table) == 0
+    assert list(table.columns) == ['NAME', 'Year', 'Total_population']
+
+
+def test_responses_are_cached(stub_server, tmp_path):
+    query = {'year': 2021, 'variables': ['B01003_001E'],
+    'geography': 'county'}
+    first_table = _client(stub_server, tmp_path).fetch_all([query])[0]
+    client = _client(stub_server, tmp_path)
+    second_table = client.fetch_all([query])[0]
+    assert second_table.equals(first_table)
+    assert client.stats['cache_hits'] == 1
+    assert client.stats['requests'] == 0
+    assert len(stub_server.requests) == 1
+
+
+def test_tracts_require_within(stub_server, tmp_path):
+    with pytest.raises(ValueError, match = 'within'):
+        _client(stub_server, tmp_path).fetch_all([{'year': 2021,
+        'variables': ['B01003_001E'], 'geography': 'tract'}])
+    assert len(stub_server.requests) == 0
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+import census_folium_benchmarks
+
+
+def _combined_chunks(chunk_size, schema_path = None):
+    shape_tables, data_tables = zip(*census_folium_benchmarks.
+    generate_synthetic_geography_chunks(2000, 'county', seed = 7,
+    schema_path = schema_path, chunk_size = chunk_size))
+    return pd.concat(shape_tables, ignore_index = True), pd.concat(
+        data_tables, ignore_index = True)
+
+
+def test_chunk_size_does_not_change_output():
+    shapes, data = _combined_chunks(100000)
+    chunked_shapes, chunked_data = _combined_chunks(300)
+    assert len(shapes) == len(data) == 2000
+    assert shapes.geom_equals_exact(chunked_shapes, tolerance = 0).all()
+    assert data.equals(chunked_data)
+
+
+def test_chunk_size_does_not_change_output_without_schema(tmp_path):
+    # If the schema file doesn't exist, a few basic columns are created
+    # instead.
+    schema_path = str(tmp_path / 'missing.csv')
+    shapes, data = _combined_chunks(100000, schema_path = schema_path)
+    chunked_shapes, chunked_data = _combined_chunks(300,
+    schema_path = schema_path)
+    assert data.equals(chunked_data)
+
+
+def test_run_in_fresh_process_reports_a_crashed_child():
+    # _run_case doesn't recognize this kind of case, so the child exits
+    # with an error before sending a result.
+    with pytest.raises(RuntimeError, match = 'exited with status 1'):
+        census_folium_benchmarks._run_in_fresh_process({'name': 'broken',
+        'kind': 'unknown'})
+
+
+def test_compare_table_formats():
+    comparison = census_folium_benchmarks.compare_table_formats(
+        polygon_count = 50, repeat = 1)
+    assert list(comparison.index) == [('zip_50', 'geojson'), 
+    ('zip_50', 'geoparquet')]
+    assert comparison['rows'].nunique() == 1
+    assert (comparison['file_bytes'] > 0).all()
+    # Only GeoParquet files can be read one column at a time.
+    assert comparison['median_projected_read_seconds'].isna().tolist() == [
+        True, False]
@@ -0,0 +1,75 @@
+import pickle
+
+import geopandas
+import shapely
+
+import census_folium_geometry
+
+
+def _mixed_table():
+    '''A table containing a Polygon, a MultiPolygon, a missing shape, and
+    an empty shape.'''
+    return geopandas.GeoDataFrame({'NAME': ['a', 'b', 'c', 'd'],
+    'value': [1.0, 2.0, 3.0, 4.0]}, geometry = [shapely.box(0, 0, 1, 1),
+    shapely.MultiPolygon([shapely.box(2, 0, 3, 1), shapely.box(4, 0, 5, 1)]),
+    None, shapely.Polygon()], crs = 'EPSG:4269')
+
+
+def _assert_same_shapes(result, expected):
+    for result_shape, expected_shape in zip(result, expected):
+        if expected_shape is None:
+            assert result_shape is None
+        elif expected_shape.is_empty:
+            assert result_shape.is_empty
+        else:
+            assert shapely.equals(result_shape, expected_shape)
+
+
+def test_encode_decode_round_trip():
+    geometry = _mixed_table().geometry.values
+    encoded = census_folium_geometry.encode_geometry(geometry)
+    _assert_same_shapes(census_folium_geometry.decode_geometry(*encoded),
+    geometry)
+
+
+def test_encode_all_missing():
+    encoded = census_folium_geometry.encode_geometry([None, None])
+    assert list(census_folium_geometry.decode_geometry(*encoded)) == [
+        None, None]
+
+
+def test_mapped_store_round_trip(tmp_path):
+    table = _mixed_table()
+    census_folium_geometry.write_geometry_store(table, tmp_path / 'store')
+    store = census_folium_geometry.MappedGeometryStore(tmp_path / 'store')
+    assert len(store) == 4
+    _assert_same_shapes(store.table().geometry, table.geometry)
+    for rows in [[2], [1, 2], [3, 0], []]:
+        result = store.table(rows = rows)
+        assert list(result['NAME']) == list(table['NAME'].iloc[rows])
+        _assert_same_shapes(result.geometry, table.geometry.iloc[rows])
+    assert list(store.rows_within((1.5, -1, 2.5, 2))) == [1]
+
+
+def test_shared_table_round_trip():
+    table = _mixed_table()
+    shared_table = census_folium_geometry.SharedTable(table)
+    try:
+        result = shared_table.table()
+        assert list(result.columns) == list(table.columns)
+        assert list(result['NAME']) == list(table['NAME'])
+        assert list(result['value']) == list(table['value'])
+        _assert_same_shapes(result.geometry, table.geometry)
+    finally:
+        shared_table.unlink()
+
+
+def test_shared_table_pickle_round_trip():
+    # Pickling is how a SharedTable reaches a worker process.
+    table = _mixed_table()
+    shared_table = census_folium_geometry.SharedTable(table)
+    try:
+        received = pickle.loads(pickle.dumps(shared_table))
+        _assert_same_shapes(received.table().geometry, table.geometry)
+    finally:
+        shared_table.unlink()
@@ -0,0 +1,44 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import census_folium_service
+from test_viewer import _two_boxes, _use_color_schemes
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    _use_color_schemes(tmp_path, monkeypatch)
+    service = census_folium_service.MapService({'boxes': (_two_boxes(
+        [1.0, 2.0]), 'NAME', 'Box')}).start()
+    yield service
+    service.stop()
+
+
+def _get(service, path):
+    try:
+        with urllib.request.urlopen(service.url(path)) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as error:
+        return error.code, error.read()
+
+
+def test_maps_are_cached(service):
+    path = '/map?table=boxes&data_variable=value&bin_count=3\
+&tiles=OpenStreetMap'
+    status, html = _get(service, path)
+    assert status == 200 and b'<html>' in html
+    assert _get(service, path) == (200, html)
+    metrics = json.loads(_get(service, '/metrics')[1])
+    assert metrics['cache_hits'] == 1 and metrics['cache_misses'] == 1
+
+
+def test_invalid_arguments(service):
+    assert _get(service, '/map?table=boxes&data_variable=value\
+&fill_color=NotAScheme')[0] == 400
+    assert _get(service, '/map?table=boxes&data_variable=value\
+&bin_count=40')[0] == 400
+    assert _get(service, '/map?table=boxes&data_variable=missing')[0] == 404
+    assert _get(service, '/map?table=unknown&data_variable=value')[0] == 404
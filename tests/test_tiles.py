@@ -0,0 +1,82 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+import census_folium_tiles
+
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as error:
+        return error.code, error.read()
+
+
+def test_cache_evicts_least_recently_used_tiles(tmp_path):
+    cache = census_folium_tiles.TileCache(str(tmp_path), max_bytes = 25)
+    cache.put('openstreetmap', 1, 0, 0, b'a' * 10)
+    cache.put('openstreetmap', 1, 0, 1, b'b' * 10)
+    # Reading the first tile makes the second one the least recently used.
+    assert cache.get('openstreetmap', 1, 0, 0) == b'a' * 10
+    cache.put('openstreetmap', 1, 1, 0, b'c' * 10)
+    assert cache.get('openstreetmap', 1, 0, 1) is None
+    assert not os.path.exists(cache.tile_path('openstreetmap', 1, 0, 1))
+    assert cache.get('openstreetmap', 1, 1, 0) == b'c' * 10
+    assert cache.stats() == {'tiles': 2, 'total_bytes': 20,
+    'max_bytes': 25, 'hits': 2, 'misses': 1, 'evictions': 1}
+    # The remaining tiles are found again when the cache is reopened.
+    reopened_cache = census_folium_tiles.TileCache(str(tmp_path),
+    max_bytes = 25)
+    assert reopened_cache.stats()['tiles'] == 2
+    assert reopened_cache.stats()['total_bytes'] == 20
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = census_folium_tiles.TileCache(str(tmp_path))
+    cache.put('stamen_toner', 1, 0, 1, b'cached tile')
+    return cache
+
+
+def test_offline_server_only_serves_cached_tiles(cache, monkeypatch):
+    def fetch_tile(provider, z, x, y, timeout = 10):
+        raise AssertionError('offline servers shouldn\'t download tiles')
+    monkeypatch.setattr(census_folium_tiles, 'fetch_tile', fetch_tile)
+    server = census_folium_tiles.TileServer(cache, offline = True).start()
+    try:
+        url = server.tile_url('stamen_toner')
+        assert _get(url.format(z = 1, x = 0, y = 1)) == (200,
+        b'cached tile')
+        assert _get(url.format(z = 1, x = 1, y = 1))[0] == 404
+        # Tiles outside of the zoom level's range and unknown providers
+        # are rejected without checking the cache.
+        assert _get(url.format(z = 1, x = 2, y = 0))[0] == 404
+        assert _get(server.tile_url('unknown').format(z = 1, x = 0,
+        y = 1))[0] == 404
+        stats = json.loads(_get(f'http://{server.host}:{server.port}\
+/stats')[1])
+        assert stats['hits'] == 1 and stats['misses'] == 1
+    finally:
+        server.stop()
+
+
+def test_server_downloads_and_caches_missing_tiles(cache, monkeypatch):
+    downloads = []
+    def fetch_tile(provider, z, x, y, timeout = 10):
+        downloads.append((provider, z, x, y))
+        return b'downloaded tile'
+    monkeypatch.setattr(census_folium_tiles, 'fetch_tile', fetch_tile)
+    server = census_folium_tiles.TileServer(cache).start()
+    try:
+        url = server.tile_url('stamen_toner').format(z = 2, x = 1, y = 3)
+        assert _get(url) == (200, b'downloaded tile')
+        assert _get(url) == (200, b'downloaded tile')
+    finally:
+        server.stop()
+    assert downloads == [('stamen_toner', 2, 1, 3)]
+    with open(cache.tile_path('stamen_toner', 2, 1, 3), 'rb') as file:
+        assert file.read() == b'downloaded tile'
@@ -0,0 +1,463 @@
+import base64
+import functools
+import gzip
+import inspect
+import json
+import os
+import re
+import shutil
+import urllib.parse
+
+import geopandas
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import census_folium_viewer
+
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _use_color_schemes(folder, monkeypatch):
+    '''generate_map reads color_schemes_from_branca.json from the current
+    folder, so a copy is placed within folder before switching to it.'''
+    shutil.copy(os.path.join(PROJECT_FOLDER, 
+    'color_schemes_from_branca.json'), folder)
+    monkeypatch.chdir(folder)
+
+
+def _two_boxes(values, column = 'value'):
+    return geopandas.GeoDataFrame({'NAME': ['a', 'b'], column: values},
+    geometry = [shapely.box(0, 0, 1, 1), shapely.box(1, 0, 2, 1)],
+    crs = 'EPSG:4269')
+
+
+def test_dot_density_points_without_any_dots():
+    geometry = _two_boxes([0, 0]).geometry.values
+    for values, dot_value in [([0, -5], 1), ([10, 20], 1e12)]:
+        longitudes, latitudes = census_folium_viewer._dot_density_points(
+            geometry, values, dot_value)
+        assert len(longitudes) == len(latitudes) == 0
+        assert longitudes.dtype == latitudes.dtype == np.float64
+    longitudes, latitudes = census_folium_viewer._dot_density_points(
+        np.array([], dtype = object), [], 1)
+    assert len(longitudes) == 0
+
+
+def test_dot_density_points_fall_within_shapes():
+    geometry = _two_boxes([0, 0]).geometry.values
+    longitudes, latitudes = census_folium_viewer._dot_density_points(
+        geometry, [30, 0], 1)
+    assert len(longitudes) == 30
+    assert shapely.contains_xy(geometry[0], longitudes, latitudes).all()
+
+
+def test_dot_density_map_without_any_dots(tmp_path, monkeypatch):
+    _use_color_schemes(tmp_path, monkeypatch)
+    census_folium_viewer.generate_map(_two_boxes([0.0, -3.0]), 'NAME',
+    'value', 'Area', 'no_dots', '.', fill_color = 'Blues', bin_count = 3,
+    tiles = None, generate_image = False, render_mode = 'dot_density')
+    assert os.path.exists('.\\no_dots.html')
+
+
+def test_dot_density_boundaries_with_renamed_geometry(tmp_path, 
+monkeypatch):
+    _use_color_schemes(tmp_path, monkeypatch)
+    table = _two_boxes([10.0, 20.0]).rename_geometry('shape')
+    census_folium_viewer.generate_map(table, 'NAME', 'value', 'Area', 
+    'renamed', '.', fill_color = 'Blues', bin_count = 3, tiles = None,
+    generate_image = False, render_mode = 'dot_density', dot_value = 1)
+    with open('.\\renamed.html') as file:
+        html = file.read()
+    # The boundaries (and their tooltips) are drawn along with the dots.
+    assert '"NAME": "a"' in html and '"NAME": "b"' in html
+
+
+def test_compact_table_preserves_multiplied_values():
+    table = _two_boxes([39000000.0, 1500000.0], column = 'population')
+    table['share'] = [0.123456, 0.5]
+    table['state'] = pd.Series(['51', '51'], dtype = object, 
+    index = table.index)
+    table['state_name'] = pd.Series(['Virginia', 'Virginia'], 
+    dtype = 'string', index = table.index)
+    table, report = census_folium_viewer.compact_table(table, 
+    categorical_threshold = 0.6, verbose = False)
+    assert table['population'].dtype == np.int32
+    assert table['share'].dtype == np.float32
+    assert str(table['state'].dtype) == 'category'
+    assert str(table['state_name'].dtype) == 'category'
+    assert report['memory_after_bytes'] <= report['memory_before_bytes']
+    prepared = census_folium_viewer._prepare_map_values(table, 
+    ['population', 'share'], 100, 4, 0)
+    assert list(prepared['population']) == [3900000000, 150000000]
+    assert list(prepared['share']) == [12.3456, 50.0]
+
+
+def test_point_lookup_assigns_boundary_points_to_first_shape():
+    lookup = census_folium_viewer.PointLookup(_two_boxes([1, 2]), 'NAME')
+    # The points are inside the first box, on the shared edge, inside
+    # the second box, on the outer edge of the second box, and outside
+    # both boxes.
+    longitudes = [0.5, 1.0, 1.5, 2.0, 3.0]
+    latitudes = [0.5, 0.5, 0.5, 0.5, 0.5]
+    assert list(lookup.assign_positions(longitudes, latitudes)) == [
+        0, 0, 1, 1, -1]
+    assert list(lookup.assign(longitudes, latitudes)) == [
+        'a', 'a', 'b', 'b', None]
+    counts = lookup.count(longitudes, latitudes, batch_size = 2)
+    assert list(counts['point_count']) == [2, 2]
+
+
+def test_state_partitions_validates_states(tmp_path):
+    for name in ['06', '51']:
+        (tmp_path / (name+'.parquet')).touch()
+    assert census_folium_viewer._state_partitions([6, '51.0'], 
+    str(tmp_path)) == ['06', '51']
+    with pytest.raises(ValueError, match = 'Virginia'):
+        census_folium_viewer._state_partitions(['Virginia'], str(tmp_path))
+    (tmp_path / 'grid_017_025.parquet').touch()
+    with pytest.raises(ValueError, match = 'grid cells'):
+        census_folium_viewer._state_partitions([51], str(tmp_path))
+
+
+def test_rebuild_maps_tracks_maps_with_the_same_name(tmp_path, 
+monkeypatch):
+    _use_color_schemes(tmp_path, monkeypatch)
+    built_maps = []
+    # The stand-in keeps generate_map's signature, which rebuild_maps uses
+    # to fill in default arguments.
+    @functools.wraps(census_folium_viewer.generate_map)
+    def fake_generate_map(**map_spec):
+        built_maps.append(map_spec['html_save_path'])
+        with open(map_spec['html_save_path']+'\\'+map_spec['map_name']+
+        '.html', 'w') as file:
+            file.write('')
+    monkeypatch.setattr(census_folium_viewer, 'generate_map', 
+    fake_generate_map)
+    map_specs = [{'merged_data_table': _two_boxes([1, 2]), 
+    'shape_feature_name': 'NAME', 'data_variable': 'value', 
+    'feature_text': 'Box', 'map_name': 'boxes', 'html_save_path': folder,
+    'screenshot_save_path': '', 'generate_image': False} 
+    for folder in ['first', 'second']]
+    first_report = census_folium_viewer.rebuild_maps(map_specs, 
+    verbose = False)
+    assert list(first_report['action']) == ['rebuilt', 'rebuilt']
+    second_report = census_folium_viewer.rebuild_maps(map_specs, 
+    verbose = False)
+    assert list(second_report['action']) == ['skipped', 'skipped']
+    assert built_maps == ['first', 'second']
+
+
+def test_capture_screenshots_restarts_the_window_before_retries(tmp_path,
+monkeypatch):
+    pytest.importorskip('selenium')
+    drivers = []
+    class FakeDriver:
+        def __init__(self):
+            self.urls = []
+            drivers.append(self)
+        def get(self, url):
+            self.urls.append(url)
+        def get_screenshot_as_file(self, image_path):
+            # Only the second window manages to save the screenshot.
+            return len(drivers) > 1
+        def quit(self):
+            pass
+    monkeypatch.setattr(census_folium_viewer, 'create_screenshot_driver',
+    lambda window_width, verbose: FakeDriver())
+    html_path = str(tmp_path / 'map.html')
+    results = census_folium_viewer.capture_screenshots([html_path], 
+    max_browsers = 1, load_seconds = 0, verbose = False)
+    assert list(results['status']) == ['captured']
+    assert list(results['attempts']) == [2]
+    assert len(drivers) == 2
+    assert drivers[0].urls == [(tmp_path / 'map.html').as_uri()]
+
+
+def test_county_panel_from_census_data():
+    panel = census_folium_viewer.TimeSeriesPanel.from_csv_files('county',
+    data_folder = os.path.join(PROJECT_FOLDER, 'census_data'))
+    # Rows without state or county codes are skipped rather than being
+    # given missing GEOIDs.
+    assert panel.geoids.is_unique
+    assert all(isinstance(geoid, str) and len(geoid) == 5 
+    for geoid in panel.geoids)
+    row = panel.geoids.get_loc('39151')
+    assert panel.names[row] == 'Stark County, Ohio'
+    assert panel.series('acs1_population', 2021)[row] == 373834
+    assert panel.series('census_population', 2000)[row] == 378098
+    change_table = panel.change_table([('acs5_population', 2011, 2021)])
+    assert change_table.loc[row, 'acs5_2011_to_2021_population_chg'] == \
+        pytest.approx((374712 - 376142) / 376142)
+
+
+def _write_county_files(folder):
+    '''Writes a shapefile containing three counties within two states, 
+    along with a .csv file of their data.'''
+    geopandas.GeoDataFrame({'GEOID': ['06001', '06003', '51059'],
+    'STATEFP': ['06', '06', '51']}, geometry = [shapely.box(0, 0, 1, 1),
+    shapely.box(1, 0, 2, 1), shapely.box(5, 5, 6, 6)], 
+    crs = 'EPSG:4269').to_file(os.path.join(folder, 'counties.shp'))
+    pd.DataFrame({'state': ['06', '06', '51'], 'county': ['001', '003',
+    '059'], 'value': [1.0, 2.0, 3.0]}).to_csv(os.path.join(folder,
+    'counties.csv'), index = False)
+
+
+def _prepare_counties(folder, output_folder):
+    return census_folium_viewer.prepare_partitioned_table(
+        os.path.join(folder, 'counties.shp'), 
+        os.path.join(folder, 'counties.csv'), output_folder, 'GEOID',
+        {'state': 2, 'county': 3}, partition_column = 'STATEFP',
+        chunk_size = 1, max_workers = 1)
+
+
+def test_prepare_partitioned_table_replaces_earlier_partitions(tmp_path):
+    _write_county_files(tmp_path)
+    output_folder = tmp_path / 'partitions'
+    output_folder.mkdir()
+    # Files left by an earlier run of a grid-partitioned table.
+    (output_folder / 'grid_017_025.parquet').write_bytes(b'')
+    (output_folder / '06.00001.piece').write_bytes(b'')
+    _prepare_counties(tmp_path, str(output_folder))
+    assert sorted(os.listdir(output_folder)) == ['06.parquet', 
+    '51.parquet']
+    table = census_folium_viewer.read_partitioned_table(str(output_folder))
+    assert sorted(table['GEOID']) == ['06001', '06003', '51059']
+    assert sorted(table['value']) == [1.0, 2.0, 3.0]
+
+
+def test_prepare_partitioned_table_removes_pieces_after_failures(tmp_path):
+    _write_county_files(tmp_path)
+    output_folder = tmp_path / 'partitions'
+    # A folder with the name of a partition prevents that partition from
+    # being written after its pieces have been created.
+    (output_folder / '06.parquet').mkdir(parents = True)
+    with pytest.raises(OSError):
+        _prepare_counties(tmp_path, str(output_folder))
+    assert [name for name in os.listdir(output_folder) 
+    if name.endswith('.piece')] == []
+
+
+def test_time_slider_map_stores_shapes_once(tmp_path, monkeypatch):
+    _use_color_schemes(tmp_path, monkeypatch)
+    table = _two_boxes([1.0, np.nan], column = 'value_2016')
+    table['value_2021'] = [2.0, 3.0]
+    census_folium_viewer.generate_map(table, 'NAME', None, 'Box', 
+    'slider', '.', fill_color = 'Blues', bin_count = 3, tiles = None,
+    generate_image = False, time_variables = {'2016': 'value_2016',
+    '2021': 'value_2021'})
+    with open('.\\slider.html') as file:
+        html = file.read()
+    assert 'var labels = ["2016", "2021"];' in html
+    # Each period only adds one value (or null) per shape.
+    assert 'var values = [[1.0, null], [2.0, 3.0]];' in html
+    assert html.count('"coordinates"') == 2
+
+
+def test_partition_files_are_loaded_by_the_page(tmp_path, monkeypatch):
+    _use_color_schemes(tmp_path, monkeypatch)
+    os.mkdir('partitions')
+    for state, offset, values in [('06', 0, [1.0, 2.0]), 
+    ('51', 10, [3.0, 4.0])]:
+        table = _two_boxes(values)
+        table['geometry'] = table.geometry.translate(offset, offset)
+        table.to_parquet(os.path.join('partitions', state+'.parquet'))
+    census_folium_viewer.generate_map('partitions', 'NAME', 'value', 'Box',
+    'parts', '.', fill_color = 'Blues', bin_count = 3, tiles = None,
+    generate_image = False, partition_files = True)
+    with open('.\\parts.html') as file:
+        html = file.read()
+    # The shapes are only stored within the partition files.
+    assert '"coordinates"' not in html
+    partitions = json.loads(re.search(r'var partitions = (.*);', 
+    html).group(1))
+    assert [partition['bounds'] for partition in partitions] == [
+        [[0.0, 0.0], [1.0, 2.0]], [[10.0, 10.0], [11.0, 12.0]]]
+    for partition, values in zip(partitions, [[1.0, 2.0], [3.0, 4.0]]):
+        # Each URL is relative to the .html file, which was saved within
+        # the current folder.
+        with open(urllib.parse.unquote(partition['url'])) as file:
+            geojson = json.loads(file.read())
+        assert [feature['properties'] for feature in geojson['features']
+        ] == [{'NAME': 'a', 'value': values[0]}, 
+        {'NAME': 'b', 'value': values[1]}]
+
+
+def _payload_properties(payload):
+    return [feature['properties'] for feature in json.loads(
+        gzip.decompress(payload))['features']]
+
+
+def test_compressed_payloads_and_precompressed_copies(tmp_path, 
+monkeypatch):
+    _use_color_schemes(tmp_path, monkeypatch)
+    expected_properties = [{'NAME': 'a', 'value': 1.0}, 
+    {'NAME': 'b', 'value': 2.0}]
+    for payload_compression in ['inline', 'sidecar']:
+        census_folium_viewer.generate_map(_two_boxes([1.0, 2.0]), 'NAME',
+        'value', 'Box', payload_compression, '.', fill_color = 'Blues',
+        bin_count = 3, tiles = None, generate_image = False, 
+        payload_compression = payload_compression, 
+        precompressed_formats = ['gzip'])
+        with open('.\\'+payload_compression+'.html', 'rb') as file:
+            html = file.read()
+        assert b'"coordinates"' not in html
+        payload_url = json.loads(re.search(rb'fetch\(("[^"]*")\)', 
+        html).group(1))
+        if payload_compression == 'inline':
+            payload = base64.b64decode(payload_url.split(',', 1)[1])
+        else:
+            with open(urllib.parse.unquote(payload_url), 'rb') as file:
+                payload = file.read()
+        assert _payload_properties(payload) == expected_properties
+        with open('.\\'+payload_compression+'.html.gz', 'rb') as file:
+            assert gzip.decompress(file.read()) == html
+
+
+def test_brotli_precompressed_copies(tmp_path):
+    brotli = pytest.importorskip('brotli')
+    path = str(tmp_path / 'map.html')
+    with open(path, 'w') as file:
+        file.write('<html></html>')
+    assert census_folium_viewer._write_precompressed_copies(path, 
+    ['gzip', 'brotli']) == [path+'.gz', path+'.br']
+    with open(path+'.br', 'rb') as file:
+        assert brotli.decompress(file.read()) == b'<html></html>'
+
+
+def _map_arguments(**map_spec):
+    '''Binds map_spec to generate_map's signature, as rebuild_maps does.'''
+    map_arguments = inspect.signature(census_folium_viewer.generate_map
+    ).bind(**map_spec)
+    map_arguments.apply_defaults()
+    return dict(map_arguments.arguments)
+
+
+def _box_map_spec(table, **options):
+    return dict(merged_data_table = table, shape_feature_name = 'NAME',
+    data_variable = 'value', feature_text = 'Box', map_name = 'boxes',
+    html_save_path = '.', fill_color = 'Blues', bin_count = 3, 
+    tiles = None, generate_image = False, **options)
+
+
+def test_map_output_paths_match_generated_files(tmp_path, monkeypatch):
+    _use_color_schemes(tmp_path, monkeypatch)
+    records = []
+    map_spec = _box_map_spec(_two_boxes([1.0, 2.0]), 
+    payload_compression = 'sidecar', precompressed_formats = ['gzip'],
+    vertical_legend = True, stats_callback = records.append)
+    census_folium_viewer.generate_map(**map_spec)
+    output_paths = census_folium_viewer._map_output_paths(
+        _map_arguments(**map_spec))
+    assert sorted(output_paths) == sorted(records[0]['outputs'])
+    assert all(os.path.exists(path) for path in output_paths)
+
+
+def test_map_input_hashes(tmp_path, monkeypatch):
+    _use_color_schemes(tmp_path, monkeypatch)
+    table = _two_boxes([1.0, 2.0])
+    hashes = census_folium_viewer._hash_map_inputs(_map_arguments(
+        **_box_map_spec(table)))
+    def changed_inputs(table, **options):
+        new_hashes = census_folium_viewer._hash_map_inputs(_map_arguments(
+            **_box_map_spec(table, **options)))
+        return sorted(name for name in hashes 
+        if new_hashes[name] != hashes[name])
+    # Columns that the map doesn't use, and logging options, don't affect
+    # the hashes.
+    assert changed_inputs(table.assign(unused = [5, 6])) == []
+    assert changed_inputs(table, debug = True) == []
+    assert changed_inputs(table.assign(value = [1.0, 3.0])) == [
+        'merged_table']
+    assert changed_inputs(table, bin_count = 4) == ['color_scheme', 
+    'map_parameters']
+    # The state column is only hashed when it's used to select states.
+    table['state'] = ['51', '51']
+    with_states = census_folium_viewer._hash_map_inputs(_map_arguments(
+        **_box_map_spec(table, states = [51])))
+    table['state'] = ['51', '06']
+    assert census_folium_viewer._hash_map_inputs(_map_arguments(
+        **_box_map_spec(table, states = [51])))['merged_table'] != \
+        with_states['merged_table']
+
+
+def test_rebuild_maps_skips_unchanged_maps(tmp_path, monkeypatch):
+    _use_color_schemes(tmp_path, monkeypatch)
+    def rebuild(table):
+        report = census_folium_viewer.rebuild_maps([_box_map_spec(table)],
+        verbose = False)
+        return report.loc[0, 'action'], report.loc[0, 'reason']
+    table = _two_boxes([1.0, 2.0])
+    assert rebuild(table) == ('rebuilt', 'no previous build recorded')
+    action, reason = rebuild(table)
+    assert action == 'skipped'
+    assert reason.startswith('inputs unchanged and outputs present')
+    assert rebuild(table.assign(value = [1.0, 3.0])) == ('rebuilt', 
+    'changed inputs: merged_table')
+    os.remove('.\\boxes.html')
+    assert rebuild(table.assign(value = [1.0, 3.0])) == ('rebuilt',
+    'missing outputs: .\\boxes.html')
+    assert os.path.exists('.\\boxes.html')
+
+
+def test_optimize_screenshots(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    screenshot = Image.new('RGBA', (1200, 800), (255, 255, 255, 255))
+    screenshot.paste((8, 48, 107, 255), (0, 0, 600, 800))
+    screenshot.save(tmp_path / 'map.png')
+    # Files created by an earlier run are skipped.
+    screenshot.save(tmp_path / 'map_thumb.png')
+    report = census_folium_viewer.optimize_screenshots(str(tmp_path),
+    formats = ('png', 'webp'), thumbnail_width = 300, png_colors = 16, 
+    max_workers = 1, verbose = False)
+    assert list(report['kind']) == ['png', 'webp', 'thumbnail']
+    assert list(report['output_path']) == [str(tmp_path / name) for name 
+    in ['map_optimized.png', 'map_q80.webp', 'map_thumb.png']]
+    assert (report['bytes_saved'] == report['original_bytes'] - 
+    report['output_bytes']).all()
+    with Image.open(tmp_path / 'map_optimized.png') as image:
+        assert image.size == (1200, 800) and image.mode == 'P'
+    with Image.open(tmp_path / 'map_q80.webp') as image:
+        assert image.size == (1200, 800)
+        assert image.convert('RGB').getpixel((100, 400)) == \
+            pytest.approx((8, 48, 107), abs = 8)
+    with Image.open(tmp_path / 'map_thumb.png') as image:
+        assert image.size == (300, 200)
+
+
+def test_save_and_load_table(tmp_path):
+    table = _two_boxes([39000000.0, 1500000.0], column = 'population')
+    table['state'] = pd.Series(['51', '51'], dtype = object,
+    index = table.index)
+    table, report = census_folium_viewer.compact_table(table, 
+    categorical_threshold = 0.6, verbose = False)
+    path = census_folium_viewer.save_table(table, 
+    str(tmp_path / 'boxes.parquet'))
+    loaded_table = census_folium_viewer.load_table(path)
+    assert isinstance(loaded_table, geopandas.GeoDataFrame)
+    # The data types created by compact_table are preserved.
+    assert loaded_table['population'].dtype == np.int32
+    assert str(loaded_table['state'].dtype) == 'category'
+    assert loaded_table.crs == table.crs
+    assert loaded_table.geometry.geom_equals(table.geometry).all()
+    # Reading only some columns skips the others (and, without the
+    # geometry, returns a DataFrame).
+    values = census_folium_viewer.load_table(path, 
+    columns = ['NAME', 'population'])
+    assert not isinstance(values, geopandas.GeoDataFrame)
+    assert list(values.columns) == ['NAME', 'population']
+    assert list(values['population']) == [39000000, 1500000]
+    # Other formats are read via geopandas.read_file.
+    table.astype({'state': str}).to_file(tmp_path / 'boxes.geojson',
+    driver = 'GeoJSON')
+    assert list(census_folium_viewer.load_table(str(tmp_path / 
+    'boxes.geojson'), columns = ['NAME', 'state'])['state']) == ['51', '51']
+
+
+def test_public_names_are_exported():
+    public_names = [name for name, value in vars(census_folium_viewer
+    ).items() if not name.startswith('_') and (inspect.isfunction(value) or
+    inspect.isclass(value)) and value.__module__ in [
+        'census_folium_viewer', 'census_folium_geometry']]
+    assert sorted(census_folium_viewer.__all__) == sorted(public_names)